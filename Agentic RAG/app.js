@@ -50,6 +50,7 @@ const elements = {
     downloadBtn: document.getElementById('download-btn'),
     formatBtn: document.getElementById('format-btn'),
     statusBar: document.getElementById('status-bar'),
+    statusText: document.querySelector('#status-bar .status-text'),
     progressFill: document.getElementById('progress-fill'),
     tempValue: document.getElementById('temp-value'),
     tokensValue: document.getElementById('tokens-value'),
@@ -293,6 +294,7 @@ async function handleGenerate() {
 
     // 显示状态栏
     elements.statusBar.classList.remove('hidden');
+    elements.statusText.textContent = '正在生成中...';
     elements.generateBtn.disabled = true;
     elements.generateBtn.innerHTML = '<span class="btn-icon">⏳</span> 生成中...';
 
@@ -307,7 +309,7 @@ async function handleGenerate() {
     try {
         // 调用后端API（自动检测后端端口）
         const backendPort = getBackendPort();
-        const apiUrl = `http://localhost:${backendPort}/api/generate`;
+        const apiUrl = `http://localhost:${backendPort}/api/generate/stream`;
         
         // 准备请求数据（包含API Key）
         // 始终从localStorage获取真实密钥（如果已保存）
@@ -351,7 +353,8 @@ async function handleGenerate() {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
-        const data = await response.json();
+        // 读取SSE事件流：显示当前阶段，代码生成阶段的输出实时显示
+        const data = await readGenerationStream(response);
         
         // 完成进度
         clearInterval(progressInterval);
@@ -386,6 +389,81 @@ async function handleGenerate() {
     }
 }
 
+// 阶段名称（与后端progress阶段对应）
+const STAGE_LABELS = {
+    retrieval: '检索API文档',
+    planning: '制定计划',
+    thinking: '理解需求',
+    story: '扩写故事',
+    decomposition: '拆解玩法',
+    plan: '生成执行计划',
+    code: '生成代码',
+    refine: '优化代码',
+    validation: '验证代码'
+};
+
+// 读取 /api/generate/stream 的SSE事件，返回最终结果
+async function readGenerationStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    let streamedText = '';
+    let resetOnNextToken = true;
+    let result = null;
+
+    const handleEvent = (event, payload) => {
+        if (event === 'stage_start') {
+            elements.statusText.textContent = `正在${STAGE_LABELS[payload.stage] || payload.stage}...`;
+            resetOnNextToken = true;
+        } else if (event === 'token') {
+            if (resetOnNextToken) {
+                streamedText = '';
+                resetOnNextToken = false;
+            }
+            streamedText += payload.text;
+            displayResult(streamedText);
+        } else if (event === 'token_reset') {
+            streamedText = '';
+        } else if (event === 'result') {
+            result = payload;
+        } else if (event === 'error') {
+            result = payload;
+        } else if (event === 'done') {
+            console.log('阶段耗时(ms):', payload.stageTimings);
+        }
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let dataLines = [];
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).trim());
+                }
+            }
+            if (dataLines.length > 0) {
+                handleEvent(event, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    }
+
+    if (!result) {
+        throw new Error('生成流意外结束');
+    }
+    return result;
+}
+
 // 生成模拟脚本（用于演示）
 function generateMockScript(userInput) {
     // 这是一个简化的模拟生成器，实际应该由后端Agentic RAG系统处理
@@ -3,21 +3,92 @@ Agentic RAG Backend API
 处理自然语言输入，通过Agentic RAG系统生成LUA脚本
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import os
-from typing import Dict, Any, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 import json
-from knowledge_base import get_knowledge_base, KnowledgeBase
-from encounter_rag_system import EncounterRAGSystem
+from knowledge_base import get_knowledge_base, current_knowledge_base, reload_knowledge_base, KnowledgeBase
+from encounter_rag_system import EncounterRAGSystem, build_encounter_prefix
+from kb_watcher import KnowledgeSourceWatcher
+from llm_cache import get_response_cache
+from embedding_registry import get_query_cache
+from llm_client import ConcurrencyLimiter, chat_completion, request_llm_limit
+from progress import ProgressReporter, stage, stage_of
+from context_budget import ContextAssembler
+from prompt_prefix import PromptPrefix, get_prompt_prefix, prompt_prefix_stats
+from encounter_repair import repair_stats
+from metrics import render_metrics, request_metrics
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
-# 初始化知识库
-kb = get_knowledge_base()
+# 知识库在首次请求时加载（导入app不会加载知识库、嵌入模型或向量库）
 gameplay_kb = None  # 延迟初始化
 
+
+def _preload_knowledge_bases():
+    """在后台线程预热知识库及其提示词静态前缀，使首个请求不必等待加载"""
+    from gameplay_knowledge_base import get_gameplay_knowledge_base
+    
+    start_kb_watcher()
+    try:
+        _warm_map_prefix(get_knowledge_base())
+        _warm_encounter_prefix(get_gameplay_knowledge_base())
+        print("[INFO] 知识库预热完成")
+    except Exception as e:
+        print(f"[ERROR] 知识库预热失败: {e}")
+
+
+def _warm_map_prefix(kb: KnowledgeBase) -> KnowledgeBase:
+    """构建地图知识库当前版本的静态前缀"""
+    get_prompt_prefix(kb, "map", build_map_prefix)
+    return kb
+
+
+def _warm_encounter_prefix(kb: Any) -> Any:
+    """构建奇遇知识库当前版本的静态前缀"""
+    get_prompt_prefix(kb, "encounter", build_encounter_prefix)
+    return kb
+
+
+# 知识源热重载监视器（由服务入口或预热线程启动，导入app不会启动轮询线程）
+kb_watcher: Optional[KnowledgeSourceWatcher] = None
+_kb_watcher_lock = threading.Lock()
+
+
+def start_kb_watcher() -> Optional[KnowledgeSourceWatcher]:
+    """
+    启动知识源热重载监视（重复调用只启动一次）
+    规则文件或奇遇文档变化时在后台重建知识库并原子替换，无需重启进程
+    设置环境变量 RAG_KB_HOT_RELOAD=0 可关闭
+    """
+    global kb_watcher
+    if os.getenv('RAG_KB_HOT_RELOAD', '1') == '0':
+        return None
+    
+    from gameplay_knowledge_base import current_gameplay_knowledge_base, reload_gameplay_knowledge_base
+    
+    with _kb_watcher_lock:
+        if kb_watcher is None:
+            watcher = KnowledgeSourceWatcher()
+            # 重建后立即构建新版本的静态前缀
+            watcher.watch("map", current_knowledge_base, lambda: _warm_map_prefix(reload_knowledge_base()))
+            watcher.watch("gameplay", current_gameplay_knowledge_base,
+                          lambda: _warm_encounter_prefix(reload_gameplay_knowledge_base()))
+            watcher.start()
+            kb_watcher = watcher
+    return kb_watcher
+
+# 批量生成：单次请求的最大条目数、每个批量请求同时进行的LLM调用上限、同时处理的条目数上限
+# LLM上限只约束该批量请求自己的调用，交互式的 /api/generate 不会排在批量请求之后
+BATCH_MAX_ITEMS = int(os.getenv('RAG_BATCH_MAX_ITEMS', '500'))
+BATCH_LLM_CONCURRENCY = int(os.getenv('RAG_BATCH_LLM_CONCURRENCY', '8'))
+BATCH_MAX_WORKERS = int(os.getenv('RAG_BATCH_WORKERS', str(max(BATCH_LLM_CONCURRENCY, 1))))
+
 # 配置
 API_CONFIG = {
     "gpt-4.1": {
@@ -31,17 +102,91 @@ API_CONFIG = {
 }
 
 
+SYSTEM_ROLE = "你是一个专业的LUA代码生成专家，专门生成游戏地图脚本。"
+
+
+def build_map_prefix(kb: KnowledgeBase) -> PromptPrefix:
+    """
+    构建地图生成的静态前缀：功能模块说明、8步生成流程和默认API列表
+    规划、生成、优化、验证各阶段共用同一前缀
+    """
+    modules_text = "\n".join(f"- {code}: {name}" for code, name in kb.MODULE_MAPPING.items())
+    body = f"""你是一个专业的LUA地图生成系统。根据用户需求生成完整的LUA脚本。
+
+## 功能模块
+{modules_text}
+
+## 8步生成流程及默认API函数（未检索到更具体的函数文档时使用）
+
+1. 创建地图
+   - Env.CreateMap(width, height, scale)
+   - Env.SetMapName(map, name)
+   - Env.SetMapTheme(map, theme)
+
+2. 塑造地形
+   - Env.RaiseTerrain(map, center, radius, height, falloff)
+   - Env.LowerTerrain(map, center, radius, depth, falloff)
+   - Env.AddWaterBody(map, center, size, depth)
+   - Env.SmoothTerrain(map, iterations)
+
+3. 划分Block区域
+   - Env.AddBlock(map, name, gridPos, gridSize)
+   - Env.SetBlockType(block, type)
+   - Env.SetBlockProperty(block, key, value)
+
+4. 填充Block内容
+   - Env.AddBuilding(block, localPos, size, style)
+   - Env.AddNPCSpawn(block, npcID, localPos, rotation)
+   - Env.AddEnemySpawn(block, enemyID, localPos, patrolRadius)
+   - Env.AddProp(block, propID, localPos, rotation)
+   - Env.AddSpawnPoint(block, tag, localPos)
+
+5. 建立连接
+   - Env.AddRoad(map, blockA, blockB, width, roadType)
+   - 或 Env.AutoGenerateRoads(map)
+
+6. 自动化处理
+   - Env.AutoPaintTerrain(map)
+   - Env.AutoAddVegetation(map, density)
+   - Env.AutoDecorate(map)
+
+7. 设置氛围
+   - Env.SetTimeOfDay(map, hour)
+   - Env.SetWeather(map, weather)
+   - Env.SetAmbientSound(map, soundID)
+
+8. 验证并构建
+   - Env.ValidateMap(map)
+   - Env.SaveMap(map, slotName)
+   - Env.BuildAsync(map, callback)"""
+    return PromptPrefix(SYSTEM_ROLE, body)
+
+
+# 设置 RAG_PRELOAD_KB=1 时启动后立即在后台预热（不阻塞进程启动）
+if os.getenv('RAG_PRELOAD_KB', '0') == '1':
+    threading.Thread(target=_preload_knowledge_bases, name="kb-preload", daemon=True).start()
+
+
 class AgenticRAGSystem:
     """
     Agentic RAG系统核心类
     实现多步骤推理和迭代优化
     """
     
-    def __init__(self, config: Dict[str, Any]):
+    # 指标的mode标签
+    mode = "map"
+    
+    def __init__(self, config: Dict[str, Any], progress: Optional[ProgressReporter] = None):
         self.config = config
         self.model = config.get('model', 'gpt-4.1')
         self.agent_mode = config.get('agentMode', 'standard')
         self.max_iterations = config.get('maxIterations', 3)
+        # 请求开始时固定知识库快照，热重载不会影响进行中的生成
+        self.kb = get_knowledge_base()
+        # 进度事件（流式接口使用），为None时不记录
+        self.progress = progress
+        # 各次LLM调用的提示词token估算（按上下文预算组装）
+        self.prompt_reports: List[Dict[str, Any]] = []
         # API Key会在调用时从config或环境变量获取
         
     def generate(self, user_input: str) -> str:
@@ -62,24 +207,28 @@ class AgenticRAGSystem:
         """
         标准模式：单次生成（集成RAG）
         """
-        # 识别需要的模块
-        required_modules = kb.identify_required_modules(user_input)
-        
-        # 检索相关函数
-        relevant_functions = kb.retrieve_functions(
-            modules=required_modules,
-            query=user_input,
-            top_k=40
-        )
-        
-        # 获取函数文档
-        function_docs = kb.get_function_docs_text(relevant_functions)
+        with stage_of(self, "retrieval"):
+            # 识别需要的模块
+            required_modules = self.kb.identify_required_modules(user_input)
+            
+            # 检索相关函数
+            relevant_functions = self.kb.retrieve_functions(
+                modules=required_modules,
+                query=user_input,
+                top_k=40
+            )
+            
+            # 获取函数文档（按code阶段的上下文预算精简）
+            context = self._budget_function_docs("code", relevant_functions)
+            function_docs = context.fit()["function_docs"]
         
         # 构建提示词（包含RAG检索结果）
         prompt = self._build_prompt(user_input, function_docs=function_docs)
+        self._record_prompt(context, prompt)
         
         # 调用LLM API
-        response = self._call_llm_api(prompt)
+        with stage_of(self, "code"):
+            response = self._call_llm_api(prompt, stream=True, prefix=self._prompt_prefix())
         
         # 提取和验证LUA代码
         lua_script = self._extract_lua_code(response)
@@ -91,13 +240,15 @@ class AgenticRAGSystem:
         迭代模式：多次优化（集成RAG）
         """
         # 识别需要的模块（只在第一次）
-        required_modules = kb.identify_required_modules(user_input)
-        relevant_functions = kb.retrieve_functions(
-            modules=required_modules,
-            query=user_input,
-            top_k=40
-        )
-        function_docs = kb.get_function_docs_text(relevant_functions)
+        with stage_of(self, "retrieval"):
+            required_modules = self.kb.identify_required_modules(user_input)
+            relevant_functions = self.kb.retrieve_functions(
+                modules=required_modules,
+                query=user_input,
+                top_k=40
+            )
+            context = self._budget_function_docs("code", relevant_functions)
+            function_docs = context.fit()["function_docs"]
         
         current_script = None
         
@@ -108,8 +259,10 @@ class AgenticRAGSystem:
             else:
                 # 后续迭代：基于之前的输出进行优化
                 prompt = self._build_refinement_prompt(user_input, current_script, function_docs)
+            self._record_prompt(context, prompt)
             
-            response = self._call_llm_api(prompt)
+            with stage_of(self, "code" if iteration == 0 else "refine"):
+                response = self._call_llm_api(prompt, stream=True, prefix=self._prompt_prefix())
             current_script = self._extract_lua_code(response)
             
             # 验证脚本质量
@@ -133,23 +286,25 @@ class AgenticRAGSystem:
         
         return validation_agent
     
+    @stage("planning")
     def _planning_agent(self, user_input: str) -> Dict[str, Any]:
         """
         规划Agent：分析需求，制定生成计划
         使用RAG检索识别需要的功能模块
         """
         # 使用知识库识别需要的模块
-        required_modules = kb.identify_required_modules(user_input)
+        required_modules = self.kb.identify_required_modules(user_input)
         
         # 检索相关函数文档
-        relevant_functions = kb.retrieve_functions(
+        relevant_functions = self.kb.retrieve_functions(
             modules=required_modules,
             query=user_input,
             top_k=30
         )
         
         # 获取函数文档文本
-        function_docs = kb.get_function_docs_text(relevant_functions)
+        context = self._budget_function_docs("planning", relevant_functions)
+        function_docs = context.fit()["function_docs"]
         
         prompt = f"""你是一个LUA地图生成专家。分析以下用户需求，制定详细的生成计划。
 
@@ -171,7 +326,8 @@ class AgenticRAGSystem:
 
 请以JSON格式返回计划，包括每个步骤需要使用的具体函数。"""
         
-        response = self._call_llm_api(prompt)
+        self._record_prompt(context, prompt)
+        response = self._call_llm_api(prompt, prefix=self._prompt_prefix())
         # 解析JSON计划（简化处理）
         return {
             "plan": response,
@@ -179,6 +335,7 @@ class AgenticRAGSystem:
             "functions": [f.lua_signature for f in relevant_functions[:10]]
         }
     
+    @stage("code")
     def _code_generation_agent(self, user_input: str, plan: Dict[str, Any]) -> str:
         """
         代码生成Agent：根据计划生成LUA代码
@@ -188,19 +345,22 @@ class AgenticRAGSystem:
         modules = plan.get("modules", [])
         
         # 检索相关函数
-        relevant_functions = kb.retrieve_functions(
+        relevant_functions = self.kb.retrieve_functions(
             modules=modules,
             query=user_input,
             top_k=40
         )
         
         # 获取函数文档
-        function_docs = kb.get_function_docs_text(relevant_functions)
+        context = self._budget_function_docs("code", relevant_functions)
+        function_docs = context.fit()["function_docs"]
         
         prompt = self._build_prompt(user_input, plan, function_docs)
-        response = self._call_llm_api(prompt)
+        self._record_prompt(context, prompt)
+        response = self._call_llm_api(prompt, stream=True, prefix=self._prompt_prefix())
         return self._extract_lua_code(response)
     
+    @stage("validation")
     def _validation_agent(self, lua_script: str) -> str:
         """
         验证Agent：检查代码质量并优化
@@ -220,14 +380,26 @@ LUA代码：
 
 如果发现问题，请提供修复后的完整代码。"""
         
-        response = self._call_llm_api(prompt)
+        response = self._call_llm_api(prompt, prefix=self._prompt_prefix())
         return self._extract_lua_code(response)
     
+    def _budget_function_docs(self, stage_name: str, relevant_functions: List[Any]) -> ContextAssembler:
+        """按阶段的上下文预算组装检索到的函数文档"""
+        context = ContextAssembler(stage_name)
+        context.add_docs("function_docs", relevant_functions, self.kb)
+        return context
+    
+    def _record_prompt(self, context: ContextAssembler, prompt: str):
+        """记录最终提示词的token估算（各阶段都使用静态前缀）"""
+        context.finalize(prompt, self._prompt_prefix().tokens)
+        self.prompt_reports.append(context.report)
+    
     def _build_prompt(self, user_input: str, plan: Dict[str, Any] = None, function_docs: str = None) -> str:
         """
-        构建提示词，集成RAG检索的函数文档
+        构建提示词（可变部分），集成RAG检索的函数文档
+        8步流程和默认API列表位于静态前缀中
         """
-        base_prompt = f"""你是一个专业的LUA地图生成系统。根据用户需求生成完整的LUA脚本。
+        base_prompt = f"""根据用户需求生成完整的LUA脚本。
 
 用户需求：
 {user_input}
@@ -239,56 +411,9 @@ LUA代码：
             base_prompt += f"""可用的API函数参考（已根据你的需求智能检索）：
 {function_docs}
 
-"""
-        else:
-            # 如果没有RAG结果，使用默认提示
-            base_prompt += """请使用以下API函数：
-
-1. 创建地图
-   - Env.CreateMap(width, height, scale)
-   - Env.SetMapName(map, name)
-   - Env.SetMapTheme(map, theme)
-
-2. 塑造地形
-   - Env.RaiseTerrain(map, center, radius, height, falloff)
-   - Env.LowerTerrain(map, center, radius, depth, falloff)
-   - Env.AddWaterBody(map, center, size, depth)
-   - Env.SmoothTerrain(map, iterations)
-
-3. 划分Block区域
-   - Env.AddBlock(map, name, gridPos, gridSize)
-   - Env.SetBlockType(block, type)
-   - Env.SetBlockProperty(block, key, value)
-
-4. 填充Block内容
-   - Env.AddBuilding(block, localPos, size, style)
-   - Env.AddNPCSpawn(block, npcID, localPos, rotation)
-   - Env.AddEnemySpawn(block, enemyID, localPos, patrolRadius)
-   - Env.AddProp(block, propID, localPos, rotation)
-   - Env.AddSpawnPoint(block, tag, localPos)
-
-5. 建立连接
-   - Env.AddRoad(map, blockA, blockB, width, roadType)
-   - 或 Env.AutoGenerateRoads(map)
-
-6. 自动化处理
-   - Env.AutoPaintTerrain(map)
-   - Env.AutoAddVegetation(map, density)
-   - Env.AutoDecorate(map)
-
-7. 设置氛围
-   - Env.SetTimeOfDay(map, hour)
-   - Env.SetWeather(map, weather)
-   - Env.SetAmbientSound(map, soundID)
-
-8. 验证并构建
-   - Env.ValidateMap(map)
-   - Env.SaveMap(map, slotName)
-   - Env.BuildAsync(map, callback)
-
 """
         
-        base_prompt += """请严格按照以上8个步骤生成完整的、可直接运行的LUA代码。
+        base_prompt += """请严格按照8个步骤生成完整的、可直接运行的LUA代码。
 代码应该包含 CreateStarterZone() 函数和 OnLevelReady() 函数。
 确保所有函数调用都使用正确的参数格式和类型。"""
         
@@ -332,47 +457,54 @@ LUA代码：
         
         return prompt
     
-    def _call_llm_api(self, prompt: str) -> str:
+    def _prompt_prefix(self) -> PromptPrefix:
+        """当前知识库版本的静态前缀（每个知识库实例只构建一次）"""
+        return get_prompt_prefix(self.kb, "map", build_map_prefix)
+    
+    def _call_llm_api(self, prompt: str, stream: bool = False, prefix: Optional[PromptPrefix] = None) -> str:
         """
         调用LLM API
         支持从环境变量或配置中获取API密钥
+        stream=True 且设置了progress时使用流式接口，增量文本通过progress.token()推送
+        prefix: 静态前缀（system消息），prompt为其后的可变部分；为None时只使用角色说明
         """
-        import openai
+        stream = stream and self.progress is not None
         
         # 优先使用配置中的API Key，否则使用环境变量
         api_key = self.config.get('apiKey') or os.getenv('OPENAI_API_KEY', '')
         
         if not api_key:
             # 如果没有配置API密钥，返回模拟响应
-            return self._mock_llm_response(prompt)
+            return self._stream_fallback(prompt) if stream else self._mock_llm_response(prompt)
         
         model_config = API_CONFIG.get(self.model, API_CONFIG['gpt-4.1'])
         
         try:
-            # 创建OpenAI客户端
-            client = openai.OpenAI(
-                api_key=api_key,
-                base_url=model_config.get('base_url', 'https://api.openai.com/v1')
-            )
-            
-            response = client.chat.completions.create(
-                model=model_config['model'],
-                messages=[
-                    {"role": "system", "content": "你是一个专业的LUA代码生成专家，专门生成游戏地图脚本。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.config.get('temperature', 0.7),
-                max_tokens=self.config.get('maxTokens', 4000),
-                top_p=self.config.get('topP', 0.9),
-                frequency_penalty=self.config.get('frequencyPenalty', 0.0),
-                presence_penalty=self.config.get('presencePenalty', 0.0)
+            return chat_completion(
+                api_key,
+                model_config.get('base_url', 'https://api.openai.com/v1'),
+                {
+                    "model": model_config['model'],
+                    "messages": (prefix or PromptPrefix(SYSTEM_ROLE)).messages(prompt),
+                    "temperature": self.config.get('temperature', 0.7),
+                    "max_tokens": self.config.get('maxTokens', 4000),
+                    "top_p": self.config.get('topP', 0.9),
+                    "frequency_penalty": self.config.get('frequencyPenalty', 0.0),
+                    "presence_penalty": self.config.get('presencePenalty', 0.0)
+                },
+                on_token=self.progress.token if stream else None
             )
             
-            return response.choices[0].message.content
-            
         except Exception as e:
             print(f"API调用错误: {e}")
-            return self._mock_llm_response(prompt)
+            return self._stream_fallback(prompt) if stream else self._mock_llm_response(prompt)
+    
+    def _stream_fallback(self, prompt: str) -> str:
+        """流式调用不可用时，丢弃已推送的部分输出并一次性推送模拟响应"""
+        response = self._mock_llm_response(prompt)
+        self.progress.emit("token_reset", {"stage": self.progress.current_stage})
+        self.progress.token(response)
+        return response
     
     def _mock_llm_response(self, prompt: str) -> str:
         """
@@ -451,68 +583,90 @@ end"""
         return all(func in script for func in required_functions)
 
 
-@app.route('/api/generate', methods=['POST'])
-def generate_lua():
+def _run_generation(data: Dict[str, Any], progress: Optional[ProgressReporter] = None) -> Dict[str, Any]:
+    """执行一次生成并记录请求指标（耗时、成功/失败），返回响应数据"""
+    mode = 'encounter' if data.get('mode') == 'encounter' else 'map'
+    agent_mode = (data.get('config') or {}).get('agentMode', 'standard')
+    with request_metrics(mode, agent_mode):
+        return _generate_response(data, progress)
+
+
+def _generate_response(data: Dict[str, Any], progress: Optional[ProgressReporter] = None) -> Dict[str, Any]:
     """
-    API端点：生成LUA脚本
+    执行一次生成，返回响应数据
     支持两种模式：
     - map: 地图生成（使用AgenticRAGSystem）
     - encounter: 奇遇生成（使用EncounterRAGSystem）
     """
+    user_input = data.get('input', '')
+    config = data.get('config', {})
+    generation_mode = data.get('mode', 'map')  # 默认地图模式
+    
+    # 处理API Key（优先使用前端传入的，否则使用环境变量）
+    # API Key会直接传递给RAG系统，不需要修改环境变量
+    
+    if generation_mode == 'encounter':
+        # 奇遇生成模式 - 使用奇遇知识库（GameplayKnowledgeBase）
+        npc_tags = data.get('npcTags', None)  # 可选的NPC标签列表
+        
+        # 延迟初始化奇遇知识库（向量数据库：chroma_db_gameplay）
+        global gameplay_kb
+        if gameplay_kb is None:
+            from gameplay_knowledge_base import get_gameplay_knowledge_base
+            gameplay_kb = get_gameplay_knowledge_base()
+            print(f"[INFO] 奇遇知识库已加载，包含 {len(gameplay_kb.functions)} 个API函数")
+        
+        # 创建奇遇RAG系统（使用奇遇知识库）
+        encounter_system = EncounterRAGSystem(config, progress)
+        
+        # 生成奇遇LUA脚本
+        lua_script = encounter_system.generate(user_input, npc_tags)
+        
+        return {
+            'success': True,
+            'luaScript': lua_script,
+            'model': config.get('model', 'gpt-4.1'),
+            'agentMode': config.get('agentMode', 'standard'),
+            'mode': 'encounter',
+            'knowledgeBase': 'gameplay',  # 标识使用的知识库
+            'pipelineTimings': encounter_system.pipeline_timings,  # 各阶段起止时间和耗时（毫秒）
+            'promptReports': encounter_system.prompt_reports,  # 各次LLM调用的提示词token估算
+            'repairReport': encounter_system.repair_report,  # 本地修复的规则次数和避免的LLM调用
+            'retrievalReport': encounter_system.retrieval.report()  # 请求内检索缓存的命中次数和省去的耗时
+        }
+    else:
+        # 地图生成模式（默认）- 使用地图知识库（KnowledgeBase）
+        # 创建Agentic RAG系统（使用地图知识库，向量数据库：chroma_db）
+        rag_system = AgenticRAGSystem(config, progress)
+        print(f"[INFO] 地图知识库已使用，包含 {len(rag_system.kb.functions)} 个API函数")
+        
+        # 生成LUA脚本
+        lua_script = rag_system.generate(user_input)
+        
+        return {
+            'success': True,
+            'luaScript': lua_script,
+            'model': config.get('model', 'gpt-4.1'),
+            'agentMode': config.get('agentMode', 'standard'),
+            'mode': 'map',
+            'knowledgeBase': 'map',  # 标识使用的知识库
+            'promptReports': rag_system.prompt_reports  # 各次LLM调用的提示词token估算
+        }
+
+
+@app.route('/api/generate', methods=['POST'])
+def generate_lua():
+    """
+    API端点：生成LUA脚本
+    请求体：{input, mode, npcTags, config}
+    """
     try:
         data = request.get_json()
-        user_input = data.get('input', '')
-        config = data.get('config', {})
-        generation_mode = data.get('mode', 'map')  # 默认地图模式
         
-        if not user_input:
+        if not data.get('input', ''):
             return jsonify({'error': '输入不能为空'}), 400
         
-        # 处理API Key（优先使用前端传入的，否则使用环境变量）
-        # API Key会直接传递给RAG系统，不需要修改环境变量
-        
-        if generation_mode == 'encounter':
-            # 奇遇生成模式 - 使用奇遇知识库（GameplayKnowledgeBase）
-            npc_tags = data.get('npcTags', None)  # 可选的NPC标签列表
-            
-            # 延迟初始化奇遇知识库（向量数据库：chroma_db_gameplay）
-            global gameplay_kb
-            if gameplay_kb is None:
-                from gameplay_knowledge_base import get_gameplay_knowledge_base
-                gameplay_kb = get_gameplay_knowledge_base()
-                print(f"[INFO] 奇遇知识库已加载，包含 {len(gameplay_kb.functions)} 个API函数")
-            
-            # 创建奇遇RAG系统（使用奇遇知识库）
-            encounter_system = EncounterRAGSystem(config)
-            
-            # 生成奇遇LUA脚本
-            lua_script = encounter_system.generate(user_input, npc_tags)
-            
-            return jsonify({
-                'success': True,
-                'luaScript': lua_script,
-                'model': config.get('model', 'gpt-4.1'),
-                'agentMode': config.get('agentMode', 'standard'),
-                'mode': 'encounter',
-                'knowledgeBase': 'gameplay'  # 标识使用的知识库
-            })
-        else:
-            # 地图生成模式（默认）- 使用地图知识库（KnowledgeBase）
-            # 创建Agentic RAG系统（使用地图知识库，向量数据库：chroma_db）
-            rag_system = AgenticRAGSystem(config)
-            print(f"[INFO] 地图知识库已使用，包含 {len(kb.functions)} 个API函数")
-            
-            # 生成LUA脚本
-            lua_script = rag_system.generate(user_input)
-            
-            return jsonify({
-                'success': True,
-                'luaScript': lua_script,
-                'model': config.get('model', 'gpt-4.1'),
-                'agentMode': config.get('agentMode', 'standard'),
-                'mode': 'map',
-                'knowledgeBase': 'map'  # 标识使用的知识库
-            })
+        return jsonify(_run_generation(data))
         
     except Exception as e:
         return jsonify({
@@ -521,6 +675,160 @@ def generate_lua():
         }), 500
 
 
+@app.route('/api/generate/stream', methods=['POST'])
+def generate_lua_stream():
+    """
+    API端点：流式生成LUA脚本（Server-Sent Events）
+    请求体与 /api/generate 相同，响应事件：
+    - start：请求已接受
+    - stage_start / stage_end：各阶段开始/结束（stage_end包含duration_ms）
+    - token：代码生成阶段LLM输出的增量文本
+    - token_reset：之前推送的增量文本作废（流式调用失败回退时）
+    - result：最终结果（与 /api/generate 的响应相同）
+    - error：生成失败
+    - done：结束，包含各阶段累计耗时
+    """
+    data = request.get_json(silent=True) or {}
+    if not data.get('input', ''):
+        return jsonify({'error': '输入不能为空'}), 400
+    
+    progress = ProgressReporter()
+    progress.emit("start", {
+        'mode': data.get('mode', 'map'),
+        'agentMode': (data.get('config') or {}).get('agentMode', 'standard')
+    })
+    
+    def worker():
+        try:
+            progress.emit("result", _run_generation(data, progress))
+        except Exception as e:
+            progress.emit("error", {'success': False, 'error': str(e)})
+        finally:
+            progress.emit("done", {'stageTimings': progress.stage_timings})
+            progress.close()
+    
+    # 生成在后台线程进行，响应线程只负责转发事件；客户端断开后生成仍会完成
+    threading.Thread(target=worker, name="generate-stream", daemon=True).start()
+    
+    return Response(
+        progress.sse_events(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 关闭反向代理缓冲
+        }
+    )
+
+
+def _warm_batch_queries(items: List[Dict[str, Any]]):
+    """批量生成前按模式汇总所有输入，一次性编码查询向量，各条目的首次检索直接命中缓存"""
+    inputs = {'map': [], 'encounter': []}
+    for item in items:
+        if isinstance(item, dict) and item.get('input'):
+            inputs['encounter' if item.get('mode') == 'encounter' else 'map'].append(item['input'])
+    
+    try:
+        if inputs['map']:
+            get_knowledge_base().warm_queries(inputs['map'])
+        if inputs['encounter']:
+            from gameplay_knowledge_base import get_gameplay_knowledge_base
+            get_gameplay_knowledge_base().warm_queries(inputs['encounter'])
+    except Exception as e:
+        print(f"[WARN] 批量预编码查询失败: {e}")
+
+
+def _run_batch_item(limiter: ConcurrencyLimiter, index: int, item: Any) -> Dict[str, Any]:
+    """执行批量中的单个条目（LLM调用受该批量请求的并发上限约束），错误记录在结果中而不影响其他条目"""
+    start = time.perf_counter()
+    try:
+        if not isinstance(item, dict) or not item.get('input'):
+            raise ValueError('输入不能为空')
+        with request_llm_limit(limiter):
+            result = _run_generation(item)
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    result['index'] = index
+    result['durationMs'] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+@app.route('/api/generate/batch', methods=['POST'])
+def generate_lua_batch():
+    """
+    API端点：批量生成LUA脚本
+    请求体：{"items": [{input, mode, npcTags, config}, ...], "concurrency": 可选，同时处理的条目数}
+    条目由工作线程池并发处理，同时进行的LLM调用数受本次批量请求的上限（RAG_BATCH_LLM_CONCURRENCY）约束；
+    所有条目的查询向量预先批量编码，检索共享同一份知识库和向量缓存
+    响应：每个条目的结果（与 /api/generate 相同）或错误，以及耗时
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items必须是非空列表'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'单次批量最多 {BATCH_MAX_ITEMS} 个条目'}), 400
+    
+    try:
+        concurrency = int(data.get('concurrency') or BATCH_MAX_WORKERS)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency必须是整数'}), 400
+    workers = max(1, min(concurrency, BATCH_MAX_WORKERS, len(items)))
+    
+    start = time.perf_counter()
+    _warm_batch_queries(items)
+    
+    limiter = ConcurrencyLimiter(BATCH_LLM_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+        results = list(executor.map(lambda index, item: _run_batch_item(limiter, index, item), range(len(items)), items))
+    
+    elapsed = time.perf_counter() - start
+    succeeded = sum(1 for r in results if r.get('success'))
+    
+    return jsonify({
+        'success': succeeded == len(results),
+        'results': results,
+        'summary': {
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'workers': workers,
+            'durationMs': round(elapsed * 1000, 1),
+            'itemsPerSecond': round(len(results) / elapsed, 2) if elapsed > 0 else None,
+            'llmConcurrency': limiter.stats()
+        }
+    })
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    缓存统计：LLM响应缓存（命中率、节省的时间）和查询向量缓存
+    """
+    return jsonify({
+        'llmResponse': get_response_cache().stats(),
+        'queryEmbedding': get_query_cache().stats(),
+        'promptPrefix': prompt_prefix_stats()
+    })
+
+
+@app.route('/api/repair/stats', methods=['GET'])
+def repair_stats_endpoint():
+    """
+    奇遇代码本地修复统计：各规则的累计修复次数、避免的LLM优化调用次数、交给LLM处理的问题类型
+    """
+    return jsonify(repair_stats())
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus格式的生成指标：请求/阶段/阶段内操作的耗时直方图，
+    LLM调用次数、耗时、token用量和重试次数，按 mode、agent_mode、stage 标签区分
+    """
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """
@@ -537,4 +845,6 @@ if __name__ == '__main__':
     # 支持通过环境变量PORT指定端口，默认5000
     import os
     port = int(os.environ.get('PORT', 5000))
+    # 知识源热重载只在服务进程中启动（导入app的脚本和基准测试不会启动轮询线程）
+    start_kb_watcher()
     app.run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量生成吞吐基准测试
+通过 /api/generate/batch 提交一批地图生成条目，LLM调用指向本地OpenAI兼容模拟服务器（固定延迟），
+在不同的批量LLM并发上限（RAG_BATCH_LLM_CONCURRENCY）下测量吞吐（条目/秒），验证吞吐随并发上限扩展
+
+用法：
+    python benchmarks/bench_batch.py --items 32 --latency 0.2 --limits 1 2 4 8
+"""
+
+import argparse
+import io
+import os
+import sys
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('RAG_KB_HOT_RELOAD', '0')
+
+import app as backend_app
+import llm_client
+from benchmarks.mock_openai_server import start_mock_server
+
+PROMPTS = [
+    "创建一个有村庄和森林的地图",
+    "生成一个雪山脚下的小镇，有铁匠铺和酒馆",
+    "创建一个沙漠绿洲，周围有商队营地",
+    "生成一个湖边的渔村，有码头和灯塔",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成吞吐基准测试")
+    parser.add_argument("--items", type=int, default=32, help="每批条目数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟LLM每次调用的延迟（秒）")
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 2, 4, 8], help="要测试的LLM并发上限")
+    args = parser.parse_args()
+
+    server = start_mock_server(latency=args.latency)
+    for model_config in backend_app.API_CONFIG.values():
+        model_config['base_url'] = server.base_url
+
+    client = backend_app.app.test_client()
+    items = [
+        {"input": PROMPTS[i % len(PROMPTS)], "mode": "map", "config": {"agentMode": "standard", "apiKey": "sk-mock"}}
+        for i in range(args.items)
+    ]
+
+    # 预热：加载知识库、建立连接
+    client.post('/api/generate/batch', json={"items": items[:1]})
+
+    print(f"条目数: {args.items}, 模拟LLM延迟: {args.latency * 1000:.0f} ms")
+    print("-" * 70)
+    print(f"{'LLM并发上限':<12}{'耗时(s)':>10}{'吞吐(条/s)':>14}{'峰值并发':>10}{'失败':>8}")
+    try:
+        for limit in args.limits:
+            backend_app.BATCH_LLM_CONCURRENCY = limit
+            backend_app.BATCH_MAX_WORKERS = limit
+            response = client.post('/api/generate/batch', json={"items": items})
+            summary = response.get_json()['summary']
+            print(f"{limit:<12}{summary['durationMs'] / 1000:>10.2f}{summary['itemsPerSecond']:>14.2f}"
+                  f"{summary['llmConcurrency']['peak']:>10}{summary['failed']:>8}")
+    finally:
+        llm_client.close_clients()
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
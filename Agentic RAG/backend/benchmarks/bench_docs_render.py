@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+函数文档渲染基准测试
+对比每次调用都用f-string和 += 重新渲染（原 get_function_docs_text 的写法）与
+知识库加载时预先渲染的文档片段 + 单次 str.join（未命中缓存）以及相同函数列表的缓存命中；
+同时测量一次完整的提示词上下文组装（ContextAssembler.add_docs + fit）。
+两种渲染的结果必须一致；缓存命中相对原实现的加速低于 --min-speedup 时返回非零退出码
+
+用法：
+    python benchmarks/bench_docs_render.py --top-k 40
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_budget import ContextAssembler
+from gameplay_knowledge_base import ANIMATION_LIBRARY_DOC, DIALOGUE_RULES_DOC, GameplayKnowledgeBase
+from knowledge_base import KnowledgeBase
+
+
+def legacy_map_docs(kb, functions, omit_fields=None):
+    """原地图知识库实现：每次重新渲染每个函数文档和模块标题"""
+    if not functions:
+        return ""
+    text_parts = []
+    current_module = None
+    for i, func in enumerate(functions):
+        if func.module != current_module:
+            current_module = func.module
+            module_name = kb.MODULE_MAPPING.get(current_module, current_module)
+            text_parts.append(f"\n## {module_name} ({current_module})\n")
+        omit = omit_fields[i] if omit_fields else ()
+        lines = [f"### {func.lua_signature}", f"**说明**: {func.description}", f"**参数**: {func.parameters}"]
+        if func.example and "example" not in omit:
+            lines.append(f"**示例**: {func.example}")
+        lines.append("")
+        text_parts.append("\n".join(lines))
+    return "\n".join(text_parts)
+
+
+def legacy_gameplay_docs(kb, functions, omit_fields=None):
+    """原奇遇知识库实现：f-string渲染后逐段 += 拼接，每次附加动画素材库和对话规则"""
+    if not functions:
+        return "未找到相关API函数文档。"
+    docs_text = ""
+    current_module = None
+    for i, func in enumerate(functions):
+        if func.module != current_module:
+            docs_text += f"\n## {func.module} 模块\n"
+            current_module = func.module
+        omit = omit_fields[i] if omit_fields else ()
+        doc_text = f"""
+### {func.function_name}
+签名: {func.signature}
+说明: {func.description}
+参数: {func.parameters}
+返回值: {func.return_value}
+"""
+        if "example" not in omit:
+            doc_text += f"示例:\n{func.example}\n"
+        if "recommended_usage" not in omit:
+            doc_text += f"推荐用法:\n{func.recommended_usage}\n"
+        if func.common_errors and "common_errors" not in omit:
+            doc_text += f"常见错误: {func.common_errors}\n"
+        docs_text += doc_text
+    if any(func.module == "Performer" for func in functions) or any("PlayAnim" in func.function_name for func in functions):
+        for line in ANIMATION_LIBRARY_DOC.splitlines(keepends=True):
+            docs_text += line
+    if any(func.module == "UI" for func in functions) or any(
+            "ShowDialogue" in func.function_name or "ApproachAndSay" in func.function_name for func in functions):
+        for line in DIALOGUE_RULES_DOC.splitlines(keepends=True):
+            docs_text += line
+    return docs_text
+
+
+def measure_us(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def compare(label, kb, legacy, query, top_k, repeat):
+    functions = kb.retrieve_functions(None, query, top_k)
+    omit_levels = [frozenset(kb.OPTIONAL_DOC_FIELDS[:i % (len(kb.OPTIONAL_DOC_FIELDS) + 1)])
+                   for i in range(len(functions))]
+    for omit in (None, omit_levels):
+        assert legacy(kb, functions, omit) == kb.get_function_docs_text(functions, omit), f"{label}: 渲染结果不一致"
+
+    legacy_us = measure_us(lambda: legacy(kb, functions), repeat)
+
+    def cold():
+        kb._docs_text_cache.clear()
+        kb.get_function_docs_text(functions)
+
+    cold_us = measure_us(cold, repeat)
+    cached_us = measure_us(lambda: kb.get_function_docs_text(functions), repeat)
+
+    def assemble():
+        context = ContextAssembler("code")
+        context.add_docs("function_docs", functions, kb)
+        context.fit()
+
+    assemble_us = measure_us(assemble, repeat)
+    size_kb = len(kb.get_function_docs_text(functions).encode('utf-8')) / 1024
+    speedup = legacy_us / cached_us if cached_us > 0 else float('inf')
+    print(f"{label:<10} {len(functions):>6} {size_kb:>8.1f} {legacy_us:>12.1f} {cold_us:>12.1f} "
+          f"{cached_us:>10.1f} {speedup:>8.1f}x {assemble_us:>12.1f}")
+    return speedup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="函数文档渲染基准测试")
+    parser.add_argument("--top-k", type=int, default=40, help="参与渲染的函数文档数")
+    parser.add_argument("--repeat", type=int, default=200, help="重复次数（取中位数）")
+    parser.add_argument("--min-speedup", type=float, default=5.0,
+                        help="缓存命中相对原实现的加速下限，低于该值时返回非零退出码；0表示不检查")
+    args = parser.parse_args()
+
+    map_kb = KnowledgeBase()
+    gameplay_kb = GameplayKnowledgeBase()
+
+    print("-" * 90)
+    print(f"{'知识库':<10} {'文档数':>6} {'文本KB':>8} {'原实现us':>12} {'预渲染us':>12} {'缓存us':>10} "
+          f"{'加速':>9} {'上下文组装us':>12}")
+    speedups = [
+        compare("地图", map_kb, legacy_map_docs, "创建地图 添加建筑 道路 天气", args.top_k, args.repeat),
+        compare("奇遇", gameplay_kb, legacy_gameplay_docs, "NPC对话 选择 战斗 奖励 动画", args.top_k, args.repeat),
+    ]
+
+    if args.min_speedup > 0 and min(speedups) < args.min_speedup:
+        print(f"[ERROR] 缓存命中加速 {min(speedups):.1f}x 低于下限 {args.min_speedup:.1f}x")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
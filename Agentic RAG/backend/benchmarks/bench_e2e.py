@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+端到端生成基准测试
+启动本地OpenAI兼容模拟服务器（可配置固定延迟、输出速度、各阶段的固定响应），
+通过Flask测试客户端调用 /api/generate，依次测试地图/奇遇模式的 standard、iterative、multi-agent，
+统计每种组合的 p50/p95/p99 延迟、每个请求的LLM调用次数（按阶段）和吞吐；
+结果写入JSON文件（包含当前提交），--baseline 指定之前的结果文件时打印对比
+
+用法：
+    python benchmarks/bench_e2e.py --requests 20 --latency 0.05 --tokens-per-sec 200
+    python benchmarks/bench_e2e.py --modes encounter --concurrency 4 --stage-latency encounter.code=0.5
+    python benchmarks/bench_e2e.py --output after.json --baseline before.json
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('RAG_KB_HOT_RELOAD', '0')
+# 每次生成都必须真正调用LLM，LLM响应缓存会让重复的需求直接命中
+os.environ['RAG_LLM_CACHE'] = '0'
+
+import app
+import encounter_rag_system
+import pipeline
+from benchmarks.mock_openai_server import StageResponse, start_mock_server
+
+AGENT_MODES = ["standard", "iterative", "multi-agent"]
+MODES = ["map", "encounter"]
+
+ENCOUNTER_INPUTS = [
+    "在酒馆里，一个醉汉和酒保发生了争吵，玩家可以选择劝架或者离开",
+    "NPC在路边哭泣，说自己的猫走丢了，玩家可以帮忙寻找或者安慰她",
+    "商人拦住玩家推销一件神秘的古董，玩家可以购买、讨价还价或拒绝",
+    "守卫怀疑玩家是小偷，玩家可以解释、贿赂或者逃跑",
+]
+
+MAP_INPUTS = [
+    "创建一个中世纪风格的新手村，包含铁匠铺、酒馆和一条小河",
+    "生成一片沙漠地图，中间有绿洲和商队营地",
+    "创建一个雪山地图，山顶有寺庙，山脚有猎人小屋",
+    "生成一个海岛地图，包含港口、灯塔和海盗营地",
+]
+
+NPC_TAGS = ["enc1_Alice", "enc1_Bob"]
+
+MAP_CODE = """```lua
+function CreateStarterZone()
+    local map = Env.CreateMap(100, 100, 100)
+    Env.SetMapName(map, "新手村")
+    Env.SetMapTheme(map, "Medieval")
+
+    Env.RaiseTerrain(map, {X=50, Y=50}, 30, 200, 0.8)
+    Env.SmoothTerrain(map, 3)
+
+    local village = Env.AddBlock(map, "新手村", {X=35, Y=30}, {X=30, Y=25})
+    Env.SetBlockType(village, "Village")
+    Env.PlaceBuilding(village, "Blacksmith", {X=40, Y=32})
+    Env.PlaceBuilding(village, "Tavern", {X=45, Y=36})
+
+    Env.SetTimeOfDay(map, 9)
+    Env.SetWeather(map, "Clear")
+
+    local errors = Env.ValidateMap(map)
+    if #errors > 0 then
+        return nil
+    end
+
+    Env.SaveMap(map, "StarterZone_v1")
+    Env.BuildAsync(map, function(levelRoot)
+        OnLevelReady(levelRoot)
+    end)
+    return map
+end
+
+function OnLevelReady(levelRoot)
+    local spawnPos = World.GetSpawnPoint("PlayerStart")
+    World.SpawnPlayer(spawnPos)
+end
+```"""
+
+# 能通过奇遇校验的代码（不触发LLM优化；提取代码时会截掉末尾的StartGame/Resume，由本地修复补回）
+ENCOUNTER_CODE = """```lua
+local function ResolveEncounterLoc()
+    return { X = 0, Y = 0, Z = 0 }
+end
+
+function SpawnEncounter_Tavern()
+    local npcData = {
+        enc1_Alice = "Default",
+        enc1_Bob = "Default"
+    }
+
+    local code = [[
+if _G.enc1_done then return end
+_G.enc1_done = true
+
+local player = World.GetByID("Player")
+local alice = World.GetByID("enc1_Alice")
+local bob = World.GetByID("enc1_Bob")
+
+if not player or not player:IsValid() then return end
+if not alice or not alice:IsValid() then return end
+if not bob or not bob:IsValid() then return end
+
+bob:LookAt(alice)
+bob:ApproachAndSay(alice, "把钱袋还给我！")
+World.Wait(1.0)
+alice:ApproachAndSay(player, "旅行者，你能帮帮我吗？")
+local choice = UI.AskMany("你要怎么做？", {"出手相助", "旁观", "离开"})
+if choice == 1 then
+    UI.ShowDialogue("Player", "住手，把钱袋还给她。")
+    bob:PlayAnimLoop("Frustrated", 0)
+    World.Wait(1.0)
+    UI.Toast("获得了 Alice 的感谢")
+elseif choice == 2 then
+    alice:PlayAnimLoop("Frustrated", 0)
+    World.Wait(1.0)
+else
+    UI.ShowDialogue("Player", "这与我无关。")
+end
+
+System.Exit()
+]]
+
+    local loc = ResolveEncounterLoc()
+    return World.SpawnEncounter(loc, 450, npcData, "EnterVolume", code)
+end
+
+SpawnEncounter_Tavern()
+
+World.StartGame()
+Time.Resume()
+```"""
+
+THINKING = """{
+    "required_modules": ["World", "UI", "Performer", "System"],
+    "key_requirements": ["两名NPC发生冲突", "玩家可以介入或离开"],
+    "constraints": ["对话不使用方括号", "结尾调用System.Exit"],
+    "required_apis": ["World.GetByID", "UI.AskMany", "World.Wait", "System.Exit"],
+    "story_elements": {"scene": "酒馆", "trigger": "偷窃", "player_action": "选择", "branches": ["介入", "离开"]},
+    "code_patterns": ["判空检查", "_G.encX_done防重复触发"],
+    "potential_issues": ["动画名称必须来自素材库"]
+}"""
+
+STORY = ("夜幕降临，酒馆里人声鼎沸。Bob突然抓住Alice的手腕，指责她偷走了自己的钱袋。Alice满脸委屈，"
+         "转身向刚进门的旅行者求助。旅行者可以出手相助，查明真相；也可以在一旁观望，看事态如何发展；"
+         "或者干脆转身离开，不去理会这场纷争。")
+
+GAMEPLAY_NODES = """[
+    {"action": "LookAt", "target": "enc1_Bob", "params": "enc1_Alice", "description": "Bob盯着Alice"},
+    {"action": "ApproachAndSay", "target": "enc1_Bob", "params": "把钱袋还给我！", "description": "Bob质问"},
+    {"action": "ApproachAndSay", "target": "enc1_Alice", "params": "旅行者，你能帮帮我吗？", "description": "Alice求助"},
+    {"action": "AskMany", "target": "Player", "params": "出手相助/旁观/离开", "description": "玩家选择"},
+    {"action": "ShowDialogue", "target": "Player", "params": "住手", "description": "玩家介入"},
+    {"action": "Exit", "target": "System", "params": "", "description": "结束奇遇"}
+]"""
+
+EXECUTION_PLAN = """1. 获取player、enc1_Alice、enc1_Bob，判空后返回
+2. Bob面向Alice并质问，等待1秒
+3. Alice向玩家求助，UI.AskMany给出三个选项
+4. 出手相助：玩家对话、Bob播放Frustrated、提示获得感谢；旁观：Alice播放Frustrated；离开：玩家对话
+5. System.Exit()结束奇遇"""
+
+MAP_PLAN = """{
+    "steps": [
+        {"step": 1, "functions": ["Env.CreateMap", "Env.SetMapName", "Env.SetMapTheme"]},
+        {"step": 2, "functions": ["Env.RaiseTerrain", "Env.SmoothTerrain"]},
+        {"step": 3, "functions": ["Env.AddBlock", "Env.SetBlockType"]},
+        {"step": 7, "functions": ["Env.SetTimeOfDay", "Env.SetWeather"]},
+        {"step": 8, "functions": ["Env.ValidateMap", "Env.SaveMap", "Env.BuildAsync"]}
+    ]
+}"""
+
+# 各阶段提示词（user消息）的开头 -> 固定响应；按顺序匹配
+STAGE_RESPONSES = [
+    StageResponse("encounter.thinking", "你是一个LUA代码分析专家", THINKING),
+    StageResponse("encounter.story", "你是一个游戏剧情设计师", STORY),
+    StageResponse("encounter.decomposition", "你是一个游戏玩法设计师", GAMEPLAY_NODES),
+    StageResponse("encounter.plan", "你是一个LUA脚本工程师", EXECUTION_PLAN),
+    StageResponse("encounter.code", "你是一个LUA代码生成专家", ENCOUNTER_CODE),
+    StageResponse("encounter.refine", "优化以下LUA奇遇代码", ENCOUNTER_CODE),
+    StageResponse("map.planning", "你是一个LUA地图生成专家", MAP_PLAN),
+    StageResponse("map.code", "根据用户需求生成完整的LUA脚本", MAP_CODE),
+    StageResponse("map.validation", "你是一个LUA代码验证专家", MAP_CODE),
+    StageResponse("map.refine", "优化以下LUA代码", MAP_CODE),
+]
+
+
+def point_to_server(base_url):
+    """将地图和奇遇系统的API地址指向模拟服务器"""
+    for config in (app.API_CONFIG, encounter_rag_system.API_CONFIG):
+        for model_config in config.values():
+            model_config["base_url"] = base_url
+
+
+def parse_stage_latency(items):
+    """解析 阶段=秒 形式的参数（阶段名见 STAGE_RESPONSES，如 encounter.code=0.5）"""
+    latencies = {}
+    names = {stage.name for stage in STAGE_RESPONSES}
+    for item in items or []:
+        name, _, value = item.partition("=")
+        if name not in names or not value:
+            raise SystemExit(f"无效的阶段延迟: {item}（可用阶段: {', '.join(sorted(names))}）")
+        latencies[name] = float(value)
+    return latencies
+
+
+def percentile(values, q):
+    """线性插值的百分位数（q: 0-100）"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def git_commit():
+    """当前提交（不在git仓库中时为None）"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def request_body(mode, agent_mode, index):
+    inputs = ENCOUNTER_INPUTS if mode == "encounter" else MAP_INPUTS
+    body = {
+        "input": inputs[index % len(inputs)],
+        "mode": mode,
+        "config": {"apiKey": "sk-bench", "agentMode": agent_mode}
+    }
+    if mode == "encounter":
+        body["npcTags"] = NPC_TAGS
+    return body
+
+
+def run_combination(server, mode, agent_mode, requests, concurrency):
+    """并发执行requests次生成，返回该组合的统计"""
+    local = threading.local()
+
+    def generate(index):
+        # Flask测试客户端不跨线程共享
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.app.test_client()
+        start = time.perf_counter()
+        response = client.post('/api/generate', json=request_body(mode, agent_mode, index))
+        elapsed = time.perf_counter() - start
+        ok = response.status_code == 200 and (response.get_json() or {}).get('success', False)
+        return elapsed, ok
+
+    server.reset_stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as executor:
+        outcomes = list(executor.map(generate, range(requests)))
+    wall = time.perf_counter() - start
+
+    latencies = [elapsed * 1000 for elapsed, ok in outcomes if ok]
+    return {
+        "mode": mode,
+        "agentMode": agent_mode,
+        "requests": requests,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "concurrency": concurrency,
+        "p50_ms": _round(percentile(latencies, 50)),
+        "p95_ms": _round(percentile(latencies, 95)),
+        "p99_ms": _round(percentile(latencies, 99)),
+        "mean_ms": _round(sum(latencies) / len(latencies) if latencies else None),
+        "llm_calls_per_request": round(server.requests / requests, 2),
+        "llm_calls_by_stage": {name: round(count / requests, 2) for name, count in sorted(server.stage_requests.items())},
+        "prompt_tokens_per_request": round(server.prompt_tokens / requests, 1),
+        "requests_per_sec": round(requests / wall, 3) if wall > 0 else None,
+        "wall_seconds": round(wall, 3)
+    }
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+def print_results(results, baseline=None):
+    """打印结果表格；提供baseline时附带p50/p95和吞吐的变化"""
+    previous = {}
+    if baseline:
+        previous = {(r["mode"], r["agentMode"]): r for r in baseline.get("results", [])}
+
+    print("-" * 100)
+    print(f"{'模式':<10} {'Agent模式':<12} {'请求':>5} {'错误':>4} {'p50':>9} {'p95':>9} {'p99':>9} "
+          f"{'LLM调用/请求':>12} {'请求/秒':>9}")
+    for r in results:
+        def fmt(key):
+            return f"{r[key]:.0f}ms" if r[key] is not None else "-"
+        print(f"{r['mode']:<10} {r['agentMode']:<12} {r['requests']:>5} {r['errors']:>4} {fmt('p50_ms'):>9} "
+              f"{fmt('p95_ms'):>9} {fmt('p99_ms'):>9} {r['llm_calls_per_request']:>12.2f} "
+              f"{r['requests_per_sec']:>9.2f}")
+        before = previous.get((r["mode"], r["agentMode"]))
+        if before:
+            changes = []
+            for key, label in (("p50_ms", "p50"), ("p95_ms", "p95"), ("requests_per_sec", "吞吐")):
+                if before.get(key) and r[key] is not None:
+                    changes.append(f"{label} {(r[key] - before[key]) / before[key]:+.1%}")
+            changes.append(f"LLM调用/请求 {before['llm_calls_per_request']:.2f} -> {r['llm_calls_per_request']:.2f}")
+            print(f"{'':<23}对比 {baseline.get('commit') or '基线'}: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端生成基准测试（本地模拟OpenAI服务器）")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES, help="生成模式")
+    parser.add_argument("--agent-modes", nargs="+", default=AGENT_MODES, choices=AGENT_MODES, help="Agent模式")
+    parser.add_argument("--requests", type=int, default=20, help="每种组合的请求数")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时进行的请求数")
+    parser.add_argument("--latency", type=float, default=0.05, help="每次LLM调用的固定延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="模拟的输出速度（token/秒），0表示不限制")
+    parser.add_argument("--chunk-chars", type=int, default=16, help="流式输出每块的字符数")
+    parser.add_argument("--stage-latency", nargs="*", metavar="阶段=秒",
+                        help="单独设置某些阶段的固定延迟，如 encounter.code=0.5 map.planning=0.2")
+    parser.add_argument("--output", help="结果JSON文件（默认 benchmarks/e2e_<提交>.json）")
+    parser.add_argument("--baseline", help="之前的结果JSON文件，打印对比")
+    args = parser.parse_args()
+
+    stage_latency = parse_stage_latency(args.stage_latency)
+    stages = [stage._replace(latency=stage_latency.get(stage.name)) for stage in STAGE_RESPONSES]
+    server = start_mock_server(latency=args.latency, chunk_chars=args.chunk_chars,
+                               tokens_per_sec=args.tokens_per_sec, stages=stages)
+    point_to_server(server.base_url)
+
+    results = []
+    try:
+        for mode in args.modes:
+            # 预热：加载知识库、构建静态前缀、建立连接池（不计入结果）
+            app.app.test_client().post('/api/generate', json=request_body(mode, "standard", 0))
+            for agent_mode in args.agent_modes:
+                result = run_combination(server, mode, agent_mode, args.requests, max(1, args.concurrency))
+                results.append(result)
+                print(f"[INFO] {mode}/{agent_mode}: p50 {result['p50_ms']}ms, "
+                      f"LLM调用/请求 {result['llm_calls_per_request']}")
+    finally:
+        server.shutdown()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "tokens_per_sec": args.tokens_per_sec,
+            "chunk_chars": args.chunk_chars,
+            "stage_latency": stage_latency,
+            "pipeline_parallel": pipeline.PIPELINE_PARALLEL
+        },
+        "results": results
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), f"e2e_{commit or 'local'}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入: {output}")
+
+    return 0 if all(r["errors"] == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模块识别关键词匹配基准测试
+对比逐个关键词 lower() + 子串查找（原 identify_required_modules 的写法）与编译好的关键词正则（KeywordMatcher）：
+- 合成的大规模关键词表（默认1万个中英文关键词）和大输入（默认20KB，少量关键词散布在其中）
+- 地图/奇遇知识库实际的关键词表和典型输入
+两种方式的结果必须一致；合成场景加速低于 --min-speedup，或知识库关键词表在20KB剧本上
+加速低于 --min-real-speedup（即比逐个查找更慢）时返回非零退出码
+
+用法：
+    python benchmarks/bench_keyword_match.py --keywords 10000 --input-kb 20
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gameplay_knowledge_base import GameplayKnowledgeBase
+from keyword_matcher import KeywordMatcher
+from knowledge_base import KnowledgeBase
+
+# 合成关键词使用的汉字和英文词根
+CJK_CHARS = "创建地图形区域建筑道路连接自动美化装饰植被程序生成氛围时间天气音效构建验证保存运行酒馆街道教堂商店偷窃争吵请求帮助对话选择分支战斗敌人奖励物品"
+WORDS = ["add", "set", "get", "auto", "gen", "spawn", "block", "terrain", "road", "bridge", "village", "forest",
+         "dungeon", "weather", "sound", "npc", "enemy", "prop", "water", "teleport", "decorate", "paint"]
+# 输入文本的填充内容（不含关键词的字符多数不在关键词字母表中）
+FILLER = "玩家走进了一片陌生的土地，远处传来悠扬的歌声。The traveler looks around quietly. "
+
+REAL_INPUTS = [
+    "创建一个中世纪风格的新手村，包含铁匠铺、酒馆和一条小河，村口有道路连接到森林区域",
+    "在酒馆里，一个醉汉和酒保发生了争吵，玩家可以选择劝架或者离开",
+    "NPC在夜晚的街道上请求玩家帮助寻找丢失的物品，完成后获得奖励",
+]
+
+
+def legacy_match(keyword_map, text):
+    """原实现：每个关键词一次 lower() 和一次整段子串查找"""
+    text_lower = text.lower()
+    found = set()
+    for keyword, values in keyword_map.items():
+        if keyword.lower() in text_lower:
+            found.update(values)
+    return found
+
+
+def build_keywords(count, modules, rng):
+    """合成count个中英文关键词，分配到modules个模块"""
+    keywords = {}
+    while len(keywords) < count:
+        if rng.random() < 0.5:
+            keyword = "".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(2, 4)))
+        else:
+            keyword = "".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 3)))
+        keywords.setdefault(keyword, [f"M{rng.randrange(modules)}"])
+    return keywords
+
+
+def build_input(keywords, size_kb, hits, rng):
+    """约size_kb KB的输入，随机位置插入hits个关键词"""
+    parts = []
+    size = 0
+    chosen = rng.sample(list(keywords), hits)
+    while size < size_kb * 1024:
+        parts.append(FILLER)
+        size += len(FILLER.encode('utf-8'))
+    for keyword in chosen:
+        parts.insert(rng.randrange(len(parts)), keyword)
+    return "".join(parts)
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def compare(name, keyword_map, matcher, text, repeat):
+    legacy_time, legacy_result = measure(lambda: legacy_match(keyword_map, text), repeat)
+    matcher_time, matcher_result = measure(lambda: matcher.match(text), repeat)
+    assert legacy_result == matcher_result, f"{name}: 结果不一致 {sorted(legacy_result)} != {sorted(matcher_result)}"
+    speedup = legacy_time / matcher_time if matcher_time > 0 else float('inf')
+    print(f"{name:<28} {len(keyword_map):>7} {len(text.encode('utf-8')) / 1024:>8.1f} "
+          f"{legacy_time * 1000:>10.3f} {matcher_time * 1000:>10.3f} {speedup:>8.1f}x {len(matcher_result):>6}")
+    return speedup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模块识别关键词匹配基准测试")
+    parser.add_argument("--keywords", type=int, default=10000, help="合成关键词数量")
+    parser.add_argument("--modules", type=int, default=50, help="合成关键词分配到的模块数")
+    parser.add_argument("--input-kb", type=int, default=20, help="合成输入大小（KB）")
+    parser.add_argument("--hits", type=int, default=20, help="合成输入中插入的关键词数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数（取中位数）")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子")
+    parser.add_argument("--min-speedup", type=float, default=5.0,
+                        help="合成场景的加速下限，低于该值时返回非零退出码；0表示不检查")
+    parser.add_argument("--min-real-speedup", type=float, default=1.0,
+                        help="知识库关键词表在20KB剧本上的加速下限；0表示不检查")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    keywords = build_keywords(args.keywords, args.modules, rng)
+
+    start = time.perf_counter()
+    matcher = KeywordMatcher(keywords)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    print("-" * 90)
+    print(f"{'场景':<28} {'关键词':>7} {'输入KB':>8} {'逐个查找ms':>10} {'正则ms':>10} {'加速':>9} {'模块数':>6}")
+    synthetic = compare("合成：散布关键词", keywords, matcher,
+                        build_input(keywords, args.input_kb, args.hits, rng), args.repeat)
+    compare("合成：无关键词", keywords, matcher, build_input(keywords, args.input_kb, 0, rng), args.repeat)
+
+    # 知识库实际的关键词表（与 identify_required_modules 使用的匹配器相同）
+    map_keywords = KnowledgeBase.FUNCTION_TO_MODULE
+    gameplay_keywords = {}
+    for table in (GameplayKnowledgeBase.FUNCTION_TO_MODULE, GameplayKnowledgeBase.CONTEXT_KEYWORDS):
+        for keyword, modules in table.items():
+            gameplay_keywords.setdefault(keyword.lower(), set()).update(modules)
+    real_speedups = []
+    for label, table in (("地图", map_keywords), ("奇遇", gameplay_keywords)):
+        table_matcher = KeywordMatcher(table)
+        for index, text in enumerate(REAL_INPUTS):
+            compare(f"{label}知识库：输入{index + 1}", table, table_matcher, text, args.repeat * 20)
+        real_speedups.append(compare(f"{label}知识库：20KB剧本", table, table_matcher,
+                                     "\n".join(REAL_INPUTS) * 100, args.repeat * 4))
+
+    print(f"\n关键词正则构建（{len(keywords)} 个关键词）: {build_ms:.1f}ms，知识库加载时构建一次")
+
+    failed = False
+    if args.min_speedup > 0 and synthetic < args.min_speedup:
+        print(f"[ERROR] 合成场景加速 {synthetic:.1f}x 低于下限 {args.min_speedup:.1f}x")
+        failed = True
+    if args.min_real_speedup > 0 and min(real_speedups) < args.min_real_speedup:
+        print(f"[ERROR] 知识库关键词表在20KB剧本上加速 {min(real_speedups):.2f}x 低于下限 {args.min_real_speedup:.2f}x")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文本匹配回退基准测试
+对比原 _text_search（逐文档子串/空格分词匹配）与BM25倒排索引（lexical_index.BM25Index）：
+- 地图/奇遇知识库的实际文档和典型中英文查询：两种方式的命中数和前几名结果
+- 合成的大规模文档集（默认1千到10万个函数）：单次查询耗时随文档数的变化
+BM25在最大规模下的加速低于 --min-speedup 时返回非零退出码
+
+用法：
+    python benchmarks/bench_lexical.py --sizes 1000,10000,100000
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gameplay_knowledge_base import GameplayKnowledgeBase
+from knowledge_base import KnowledgeBase
+from lexical_index import BM25Index
+
+MAP_QUERIES = [
+    "创建森林区域并添加敌人刷新点",
+    "用道路连接两个村庄",
+    "AddEnemySpawn",
+    "设置天气和时间氛围",
+]
+GAMEPLAY_QUERIES = [
+    "NPC对玩家说话并给出选择",
+    "击败敌人后获得奖励",
+    "ShowDialogue",
+    "随机概率触发事件",
+]
+
+# 合成文档使用的汉字和API名词根
+CJK_CHARS = "创建地图形区域建筑道路连接自动美化装饰植被程序生成氛围时间天气音效构建验证保存运行酒馆街道教堂商店敌人奖励物品对话选择"
+WORDS = ["Add", "Set", "Get", "Auto", "Gen", "Spawn", "Block", "Terrain", "Road", "Bridge", "Village", "Forest",
+         "Dungeon", "Weather", "Sound", "NPC", "Enemy", "Prop", "Water", "Teleport", "Decorate", "Paint"]
+SYNTHETIC_QUERIES = ["在森林里添加敌人刷新点", "AddRoadBridge", "设置天气音效"]
+
+
+def legacy_map_search(kb, query, top_k):
+    """原地图知识库实现：标签在查询中 +2，整句查询是文档子串 +1"""
+    query_lower = query.lower()
+    scored = []
+    for func in kb.functions:
+        score = 0
+        text = (func.lua_signature + " " + func.description + " " + func.category).lower()
+        for tag in func.tags:
+            if tag.lower() in query_lower:
+                score += 2
+        if query_lower in text:
+            score += 1
+        if score > 0:
+            scored.append((score, func))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [f for _, f in scored[:top_k]]
+
+
+def legacy_gameplay_search(kb, query, top_k):
+    """原奇遇知识库实现：按空格分词后逐词子串匹配"""
+    query_lower = query.lower()
+    scored = []
+    for func in kb.functions:
+        text = (func.function_name + " " + func.description + " " + func.signature).lower()
+        score = sum(1 for keyword in query_lower.split() if keyword in text)
+        if score > 0:
+            scored.append((score, func))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [f for _, f in scored[:top_k]]
+
+
+def legacy_scan(documents, query, top_k):
+    """合成场景的原实现：逐文档计算空格分词的子串命中数"""
+    keywords = query.lower().split()
+    scored = []
+    for idx, text in enumerate(documents):
+        score = sum(1 for keyword in keywords if keyword in text)
+        if score > 0:
+            scored.append((score, idx))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored[:top_k]
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def compare_real(label, kb, queries, legacy, name_of, top_k):
+    print(f"\n{label}知识库（{len(kb.functions)} 个函数，{kb._lexical_index.term_count} 个词项）")
+    for query in queries:
+        old = legacy(kb, query, top_k)
+        new = kb._text_search(None, query, top_k) if isinstance(kb, GameplayKnowledgeBase) \
+            else kb._text_search(kb.functions, None, query, top_k)
+        print(f"  {query}")
+        print(f"    原实现 {len(old):>2} 个: {', '.join(name_of(f) for f in old[:3]) or '-'}")
+        print(f"    BM25   {len(new):>2} 个: {', '.join(name_of(f) for f in new[:3]) or '-'}")
+
+
+def build_documents(size, rng):
+    documents = []
+    for i in range(size):
+        name = "".join(rng.choice(WORDS) for _ in range(rng.randint(2, 3)))
+        description = "".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(8, 20)))
+        documents.append(f"Env.{name}{i}(Block, Pos) {description}")
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本匹配回退基准测试")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="合成文档数，逗号分隔")
+    parser.add_argument("--top-k", type=int, default=20, help="返回结果数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数（取中位数）")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子")
+    parser.add_argument("--min-speedup", type=float, default=5.0,
+                        help="最大规模下BM25的加速下限，低于该值时返回非零退出码；0表示不检查")
+    args = parser.parse_args()
+
+    compare_real("地图", KnowledgeBase(), MAP_QUERIES, legacy_map_search,
+                 lambda f: f.lua_signature.split("(")[0], args.top_k)
+    compare_real("奇遇", GameplayKnowledgeBase(), GAMEPLAY_QUERIES, legacy_gameplay_search,
+                 lambda f: f"{f.module}.{f.function_name}", args.top_k)
+
+    rng = random.Random(args.seed)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    print("\n" + "-" * 72)
+    print(f"{'文档数':>8} {'构建ms':>10} {'原实现ms':>10} {'BM25 ms':>10} {'加速':>9}")
+    speedup = 0.0
+    for size in sizes:
+        documents = build_documents(size, rng)
+        start = time.perf_counter()
+        index = BM25Index(documents)
+        build_ms = (time.perf_counter() - start) * 1000
+        lowered = [doc.lower() for doc in documents]
+
+        legacy_time = sum(measure(lambda q=q: legacy_scan(lowered, q, args.top_k), args.repeat)
+                          for q in SYNTHETIC_QUERIES)
+        bm25_time = sum(measure(lambda q=q: index.search(q, args.top_k), args.repeat)
+                        for q in SYNTHETIC_QUERIES)
+        speedup = legacy_time / bm25_time if bm25_time > 0 else float('inf')
+        print(f"{size:>8} {build_ms:>10.1f} {legacy_time * 1000 / len(SYNTHETIC_QUERIES):>10.3f} "
+              f"{bm25_time * 1000 / len(SYNTHETIC_QUERIES):>10.3f} {speedup:>8.1f}x")
+
+    if args.min_speedup > 0 and sizes and speedup < args.min_speedup:
+        print(f"[ERROR] {sizes[-1]} 个文档时BM25加速 {speedup:.1f}x 低于下限 {args.min_speedup:.1f}x")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+LLM客户端连接复用基准测试
+对本地OpenAI兼容模拟服务器发起chat.completions调用，对比：
+- 每次调用新建 openai.OpenAI 客户端（旧实现）
+- 复用 llm_client.get_openai_client 返回的共享客户端
+输出每次调用的耗时分布、相对服务器固定延迟的额外开销，以及服务器端建立的TCP连接数
+
+用法：
+    python benchmarks/bench_llm_client.py --calls 200 --latency 0.02 --concurrency 4
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai
+
+import llm_client
+from benchmarks.mock_openai_server import start_mock_server
+
+API_KEY = "sk-mock"
+MESSAGES = [
+    {"role": "system", "content": "你是一个专业的LUA奇遇脚本生成专家，专门生成游戏Encounter脚本。"},
+    {"role": "user", "content": "生成一个简单的奇遇脚本"}
+]
+
+
+def call_per_request_client(base_url):
+    """旧实现：每次调用都创建新的客户端"""
+    client = openai.OpenAI(api_key=API_KEY, base_url=base_url)
+    response = client.chat.completions.create(model="mock", messages=MESSAGES, max_tokens=100)
+    return response.choices[0].message.content
+
+
+def call_pooled_client(base_url):
+    """新实现：复用进程内共享的客户端"""
+    client = llm_client.get_openai_client(API_KEY, base_url)
+    response = client.chat.completions.create(model="mock", messages=MESSAGES, max_tokens=100)
+    return response.choices[0].message.content
+
+
+def run(label, call, server, calls, concurrency):
+    server.reset_stats()
+
+    def timed(_):
+        start = time.perf_counter()
+        call(server.base_url)
+        return time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            timings = list(executor.map(timed, range(calls)))
+    else:
+        timings = [timed(i) for i in range(calls)]
+    wall = time.perf_counter() - wall_start
+
+    timings.sort()
+    mean = statistics.mean(timings)
+    overhead = mean - server.latency
+    print(f"{label:<10} mean {mean * 1000:7.2f} ms  p50 {timings[len(timings) // 2] * 1000:7.2f} ms  "
+          f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:7.2f} ms  "
+          f"额外开销 {overhead * 1000:6.2f} ms/次  连接数 {server.connections:4d}  "
+          f"吞吐 {calls / wall:7.1f} 次/s")
+    return overhead
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM客户端连接复用基准测试")
+    parser.add_argument("--calls", type=int, default=200, help="调用次数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务器每次响应的固定延迟（秒）")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发调用数")
+    args = parser.parse_args()
+
+    server = start_mock_server(latency=args.latency)
+    print(f"模拟服务器: {server.base_url}（固定延迟 {args.latency * 1000:.0f} ms）")
+    print(f"调用次数: {args.calls}, 并发: {args.concurrency}")
+    print("-" * 100)
+
+    try:
+        # 预热：导入SDK内部模块、建立首个连接
+        call_per_request_client(server.base_url)
+        call_pooled_client(server.base_url)
+
+        legacy = run("每次新建", call_per_request_client, server, args.calls, args.concurrency)
+        pooled = run("连接池", call_pooled_client, server, args.calls, args.concurrency)
+    finally:
+        llm_client.close_clients()
+        server.shutdown()
+
+    print("-" * 100)
+    print(f"每次调用节省: {(legacy - pooled) * 1000:.2f} ms（不含TLS握手；真实HTTPS端点上节省更多）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
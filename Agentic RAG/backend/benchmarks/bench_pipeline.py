@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+奇遇生成阶段调度基准测试
+用固定延迟的模拟LLM调用替换 _call_llm_api，对比阶段依赖图串行执行与并发执行的端到端耗时
+（Thinking与故事扩写并发，预期节省约一次LLM往返）
+
+用法：
+    python benchmarks/bench_pipeline.py --latency 0.5 --runs 3
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline
+from encounter_rag_system import EncounterRAGSystem
+from benchmarks.mock_openai_server import DEFAULT_RESPONSE
+
+USER_INPUT = "在酒馆里，一个醉汉和酒保发生了争吵，玩家可以选择劝架或者离开"
+
+
+class FixedLatencySystem(EncounterRAGSystem):
+    """LLM调用固定耗时latency秒，返回模拟服务器的默认奇遇代码"""
+
+    latency = 0.5
+
+    def _call_llm_api(self, prompt, stream=False, prefix=None):
+        time.sleep(self.latency)
+        return DEFAULT_RESPONSE
+
+
+def run(parallel, runs, agent_mode):
+    pipeline.PIPELINE_PARALLEL = parallel
+    timings = []
+    for _ in range(runs):
+        system = FixedLatencySystem({"agentMode": agent_mode})
+        start = time.perf_counter()
+        system.generate(USER_INPUT, ["Tag_A", "Tag_B"])
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), system.pipeline_timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="奇遇生成阶段调度基准测试")
+    parser.add_argument("--latency", type=float, default=0.5, help="每次模拟LLM调用的耗时（秒）")
+    parser.add_argument("--runs", type=int, default=3, help="每种模式的运行次数（取中位数）")
+    parser.add_argument("--agent-mode", default="standard", choices=["standard", "iterative", "multi-agent"])
+    args = parser.parse_args()
+
+    FixedLatencySystem.latency = args.latency
+
+    sequential, _ = run(False, args.runs, args.agent_mode)
+    parallel, stage_timings = run(True, args.runs, args.agent_mode)
+
+    print("-" * 70)
+    print(f"模拟LLM延迟: {args.latency:.2f}s, 模式: {args.agent_mode}, 运行次数: {args.runs}")
+    print(f"串行执行: {sequential:.2f}s")
+    print(f"依赖图并发: {parallel:.2f}s")
+    print(f"节省: {sequential - parallel:.2f}s（约 {(sequential - parallel) / args.latency:.1f} 次LLM往返）")
+    print("\n并发执行的阶段时间线:")
+    for name, t in sorted(stage_timings.items(), key=lambda item: item[1]["start_ms"]):
+        print(f"  {name:<16} {t['start_ms'] / 1000:6.2f}s -> {t['end_ms'] / 1000:6.2f}s  ({t['thread']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
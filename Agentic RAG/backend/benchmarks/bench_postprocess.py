@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+生成代码后处理吞吐基准测试
+构造大规模的奇遇脚本（默认1万行以上，包含玩家ApproachAndSay、带方括号的对话、素材库外的动画名称等），
+测量 LuaPostProcessor 的代码问题修正和SpawnEncounter语法修正的吞吐；
+低于 --min-lines-per-sec 时返回非零退出码，用于防止吞吐回退
+
+用法：
+    python benchmarks/bench_postprocess.py --lines 20000 --repeat 5
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encounter_rag_system import ANIMATION_LIBRARY
+from lua_postprocess import LuaPostProcessor
+
+# 一个分支的典型生成代码，包含需要修正的写法
+BRANCH_TEMPLATE = '''if r == {i} then
+    alice:MoveTo({{X=ppos.X + {i}, Y=ppos.Y, Z=ppos.Z}})
+    World.Wait(0.9)
+    alice:LookAt(player)
+    alice:PlayAnim("Alice_Wave")
+    alice:ApproachAndSay(player, "[你好，第{i}位旅行者]")
+    World.Wait(0.6)
+    player:ApproachAndSay(alice, "[我只是路过]")
+    UI.ShowDialogue("Alice", "[真的吗？]")
+    alice:PlayAnim("Happy")
+    bob:PlayAnim("Uncle_Angry_{i}")
+    local choice{i} = UI.AskMany("你要怎么回应？", {{"帮忙", "拒绝"}})
+    UI.Toast("你获得了 Money x{i}")
+end'''
+
+HEADER = '''local function ResolveEncounterLoc()
+    return { X = 12016.593860, Y = 13372.975811, Z = 4797.613441 }
+end
+
+function SpawnEncounter_Bench()
+    local npcData = {
+        enc0_Alice = "Default"
+    }
+
+    local code = [[
+if _G.enc0_done then return end
+_G.enc0_done = true
+local player = World.GetByID("Player")
+local alice = World.GetByID("enc0_Alice")
+local r = UI.AskMany("开始？", {"是", "否"})
+'''
+
+FOOTER = ''']]
+
+    local loc = ResolveEncounterLoc()
+    return World.SpawnEncounter(loc, 100.0, npcData, "Other", code)
+end
+
+SpawnEncounter_Bench()
+
+World.StartGame()
+Time.Resume()
+UI.Toast("游戏开始")'''
+
+
+def build_script(lines):
+    """构造不少于lines行的脚本"""
+    branches = []
+    count = HEADER.count('\n') + FOOTER.count('\n')
+    i = 0
+    while count < lines:
+        branch = BRANCH_TEMPLATE.format(i=i)
+        branches.append(branch)
+        count += branch.count('\n') + 1
+        i += 1
+    return HEADER + "\n".join(branches) + "\n" + FOOTER
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成代码后处理吞吐基准测试")
+    parser.add_argument("--lines", type=int, default=10000, help="脚本行数（至少）")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数（取中位数）")
+    parser.add_argument("--min-lines-per-sec", type=float, default=100000,
+                        help="吞吐下限（行/秒），低于该值时返回非零退出码；0表示不检查")
+    args = parser.parse_args()
+
+    script = build_script(args.lines)
+    line_count = script.count('\n') + 1
+    processor = LuaPostProcessor(ANIMATION_LIBRARY)
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        fixed = processor.fix_syntax_errors(script, ["Tag_A"])
+        fixed = processor.fix_code_issues(fixed)
+        timings.append(time.perf_counter() - start)
+
+    # 结果检查：所有需要修正的写法都已修正
+    assert 'player:ApproachAndSay' not in fixed
+    assert '"[' not in fixed
+    assert 'Alice_Wave' not in fixed and 'Uncle_Angry' not in fixed
+
+    median = statistics.median(timings)
+    lines_per_sec = line_count / median
+    print("-" * 70)
+    print(f"脚本: {line_count} 行, {len(script.encode('utf-8')) / 1024:.0f} KB, 重复 {args.repeat} 次")
+    print(f"后处理耗时（中位数）: {median * 1000:.1f}ms, 吞吐: {lines_per_sec:,.0f} 行/秒")
+
+    if args.min_lines_per_sec > 0 and lines_per_sec < args.min_lines_per_sec:
+        print(f"[ERROR] 吞吐低于下限 {args.min_lines_per_sec:,.0f} 行/秒")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
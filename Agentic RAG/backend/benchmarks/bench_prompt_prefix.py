@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+提示词前缀缓存基准测试
+启动模拟前缀缓存的本地OpenAI兼容服务器（未命中缓存的提示词按 --prefill-per-1k 计入延迟），
+分别以旧布局（可变内容在前、静态内容在后）和静态前缀布局（静态内容在system消息中）
+执行多个不同需求的奇遇/地图生成，对比前缀缓存命中率和端到端耗时
+
+用法：
+    python benchmarks/bench_prompt_prefix.py --prefill-per-1k 0.2 --mode encounter
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('RAG_KB_HOT_RELOAD', '0')
+
+import app
+import encounter_rag_system
+import prompt_prefix
+from benchmarks.mock_openai_server import start_mock_server
+
+ENCOUNTER_INPUTS = [
+    "在酒馆里，一个醉汉和酒保发生了争吵，玩家可以选择劝架或者离开",
+    "NPC在路边哭泣，说自己的猫走丢了，玩家可以帮忙寻找或者安慰她",
+    "商人拦住玩家推销一件神秘的古董，玩家可以购买、讨价还价或拒绝",
+    "两个孩子在广场上跳舞，邀请玩家一起加入",
+    "守卫怀疑玩家是小偷，玩家可以解释、贿赂或者逃跑",
+    "一位老人坐在长椅上讲述年轻时的冒险故事，最后送给玩家一件礼物",
+]
+
+MAP_INPUTS = [
+    "创建一个中世纪风格的新手村，包含铁匠铺、酒馆和一条小河",
+    "生成一片沙漠地图，中间有绿洲和商队营地",
+    "创建一个雪山地图，山顶有寺庙，山脚有猎人小屋",
+    "生成一个海岛地图，包含港口、灯塔和海盗营地",
+]
+
+
+def point_to_server(base_url):
+    """将地图和奇遇系统的API地址指向模拟服务器"""
+    for config in (app.API_CONFIG, encounter_rag_system.API_CONFIG):
+        for model_config in config.values():
+            model_config["base_url"] = base_url
+
+
+def run_layout(server, enabled, mode, rounds):
+    """以指定布局执行所有需求rounds轮，返回每次生成耗时和服务器统计"""
+    prompt_prefix.PROMPT_PREFIX_ENABLED = enabled
+    server.reset_stats()
+    config = {"apiKey": "sk-bench", "agentMode": "standard"}
+    timings = []
+    for _ in range(rounds):
+        for user_input in (ENCOUNTER_INPUTS if mode == "encounter" else MAP_INPUTS):
+            start = time.perf_counter()
+            if mode == "encounter":
+                encounter_rag_system.EncounterRAGSystem(config).generate(user_input, ["Tag_A", "Tag_B"])
+            else:
+                app.AgenticRAGSystem(config).generate(user_input)
+            timings.append(time.perf_counter() - start)
+    return timings, {
+        "requests": server.requests,
+        "prompt_tokens": server.prompt_tokens,
+        "cached_tokens": server.cached_tokens,
+        "prefill_seconds": server.prefill_seconds
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提示词前缀缓存基准测试")
+    parser.add_argument("--mode", default="encounter", choices=["encounter", "map"])
+    parser.add_argument("--latency", type=float, default=0.02, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--prefill-per-1k", type=float, default=0.2,
+                        help="未命中前缀缓存的提示词每千token的处理耗时（秒）")
+    parser.add_argument("--rounds", type=int, default=1, help="所有需求重复执行的轮数")
+    args = parser.parse_args()
+
+    server = start_mock_server(latency=args.latency, prefill_per_1k=args.prefill_per_1k)
+    point_to_server(server.base_url)
+
+    # 静态前缀在启动时构建（每个知识库版本一次）
+    start = time.perf_counter()
+    if args.mode == "encounter":
+        app._warm_encounter_prefix(encounter_rag_system.get_gameplay_knowledge_base())
+    else:
+        app._warm_map_prefix(app.get_knowledge_base())
+    build_seconds = time.perf_counter() - start
+
+    # 预热：建立连接池、加载知识库（run_layout开始时会清空服务器统计和前缀缓存）
+    config = {"apiKey": "sk-bench", "agentMode": "standard"}
+    if args.mode == "encounter":
+        encounter_rag_system.EncounterRAGSystem(config).generate("预热", ["Tag_A"])
+    else:
+        app.AgenticRAGSystem(config).generate("预热")
+
+    results = {}
+    try:
+        for name, enabled in (("旧布局", False), ("静态前缀", True)):
+            results[name] = run_layout(server, enabled, args.mode, args.rounds)
+    finally:
+        server.shutdown()
+
+    print("-" * 78)
+    print(f"模式: {args.mode}, 固定延迟: {args.latency:.3f}s, prefill: {args.prefill_per_1k:.3f}s/千token, "
+          f"知识库加载及前缀构建: {build_seconds:.2f}s")
+    print(f"{'布局':<8} {'请求数':>6} {'提示词token':>12} {'缓存命中':>10} {'命中率':>8} {'prefill':>9} {'单次生成':>9}")
+    for name, (timings, stats) in results.items():
+        hit_rate = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        print(f"{name:<8} {stats['requests']:>6} {stats['prompt_tokens']:>12} {stats['cached_tokens']:>10} "
+              f"{hit_rate:>8.1%} {stats['prefill_seconds']:>8.2f}s {statistics.mean(timings):>8.2f}s")
+
+    legacy = statistics.mean(results["旧布局"][0])
+    prefixed = statistics.mean(results["静态前缀"][0])
+    print(f"单次生成平均耗时: {legacy:.2f}s -> {prefixed:.2f}s（{legacy / prefixed:.2f}x）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检索召回率基准测试
+在标注好的查询集（benchmarks/retrieval_queries.json，每条查询标注了应当召回的函数）上
+对比三种检索方式的 recall@k 和 MRR：
+- lexical：只用BM25
+- vector：只用向量检索（需要sentence-transformers，未安装时跳过）
+- hybrid：两路并行检索后做倒数排名融合（RAG_HYBRID_SEARCH=1）
+并给出平均召回率达到 --target-recall 所需的最小top_k，用于评估能把top_k降到多少
+默认在全部函数中检索以评估排序本身，--module-filter 时按 identify_required_modules 过滤（与生成流程一致）；
+混合检索的召回率低于纯向量检索时返回非零退出码
+
+用法：
+    python benchmarks/bench_retrieval_recall.py --ks 5,10,20 --target-recall 0.9
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 基准测试默认使用进程内向量索引，不读写ChromaDB目录
+os.environ.setdefault('RAG_VECTOR_BACKEND', 'numpy')
+
+from gameplay_knowledge_base import GameplayKnowledgeBase
+from knowledge_base import KnowledgeBase
+
+DEFAULT_QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_queries.json")
+MODES = ("lexical", "vector", "hybrid")
+
+
+def map_function_id(func):
+    return func.lua_signature.split("(")[0].replace("Env.", "", 1).strip()
+
+
+def encounter_function_id(func):
+    return func.signature.split("(")[0].strip()
+
+
+def retrieve(kb, mode, modules, query, top_k):
+    if mode == "lexical":
+        return [kb.functions[idx] for idx in kb._lexical_search_rows(query, modules, top_k)]
+    kb.hybrid_search = mode == "hybrid"
+    return kb.retrieve_functions(modules, query, top_k)
+
+
+def evaluate(kb, entries, function_id, mode, max_k, module_filter):
+    """返回 (各k的平均召回率列表（下标k-1）, MRR)"""
+    recall_sums = [0.0] * max_k
+    reciprocal_sum = 0.0
+    for entry in entries:
+        relevant = set(entry["relevant"])
+        modules = kb.identify_required_modules(entry["query"]) if module_filter else None
+        ranked = []
+        for func in retrieve(kb, mode, modules, entry["query"], max_k):
+            func_id = function_id(func)
+            if func_id not in ranked:
+                ranked.append(func_id)
+        found = 0
+        first_hit = None
+        for k in range(max_k):
+            if k < len(ranked) and ranked[k] in relevant:
+                found += 1
+                if first_hit is None:
+                    first_hit = k + 1
+            recall_sums[k] += found / len(relevant)
+        reciprocal_sum += 1.0 / first_hit if first_hit else 0.0
+    count = len(entries)
+    return [value / count for value in recall_sums], reciprocal_sum / count
+
+
+def report(label, kb, entries, function_id, ks, target, module_filter):
+    max_k = max(ks)
+    modes = [mode for mode in MODES if mode == "lexical" or kb.has_vector_index()]
+    print(f"\n{label}知识库：{len(entries)} 条查询，{len(kb.functions)} 个函数")
+    header = " ".join(f"{'R@' + str(k):>7}" for k in ks)
+    print(f"{'方式':<10} {header} {'MRR':>7} {'达到' + format(target, '.0%') + '的top_k':>14}")
+    results = {}
+    for mode in modes:
+        recalls, mrr = evaluate(kb, entries, function_id, mode, max_k, module_filter)
+        needed = next((k + 1 for k, value in enumerate(recalls) if value >= target), None)
+        results[mode] = recalls
+        row = " ".join(f"{recalls[k - 1]:>7.3f}" for k in ks)
+        print(f"{mode:<10} {row} {mrr:>7.3f} {needed if needed else '>' + str(max_k):>14}")
+    if len(modes) == 1:
+        print("[WARN] 未加载嵌入模型（需要sentence-transformers），只评估BM25")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索召回率基准测试")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES, help="标注查询集（JSON）")
+    parser.add_argument("--ks", default="5,10,20", help="计算recall@k的k值，逗号分隔")
+    parser.add_argument("--max-k", type=int, default=40, help="计算所需最小top_k时的搜索上限")
+    parser.add_argument("--target-recall", type=float, default=0.9, help="目标平均召回率")
+    parser.add_argument("--check-k", type=int, default=10, help="比较混合检索与纯向量检索时使用的k")
+    parser.add_argument("--module-filter", action="store_true", help="按识别出的模块过滤（与生成流程一致）")
+    args = parser.parse_args()
+
+    with open(args.queries, 'r', encoding='utf-8') as f:
+        queries = json.load(f)
+    check_k = min(args.check_k, args.max_k)
+    ks = sorted({int(k) for k in args.ks.split(",") if k.strip() and 0 < int(k) <= args.max_k}
+                | {check_k, args.max_k})
+
+    failed = False
+    for label, kb, key, function_id in (("地图", KnowledgeBase(), "map", map_function_id),
+                                        ("奇遇", GameplayKnowledgeBase(), "encounter", encounter_function_id)):
+        entries = queries.get(key, [])
+        if not entries:
+            continue
+        results = report(label, kb, entries, function_id, ks, args.target_recall, args.module_filter)
+        if "hybrid" in results:
+            hybrid, vector = results["hybrid"][check_k - 1], results["vector"][check_k - 1]
+            if hybrid < vector:
+                print(f"[ERROR] {label}知识库混合检索 R@{check_k}={hybrid:.3f} 低于纯向量检索 {vector:.3f}")
+                failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+KnowledgeBase.retrieve_functions 规模扩展基准测试
+使用合成语料（默认1k/10k/100k个函数）测量检索+合并的耗时，
+并与旧版 functions.index() 合并循环对比
+
+用法：
+    python benchmarks/bench_retrieve_scaling.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import embedding_registry
+from knowledge_base import KnowledgeBase, FunctionDoc
+from vector_index import NumpyVectorIndex
+
+MODULES = ["P1", "P2", "P3", "P4", "P5", "P6", "P7", "P8", "R1-R6"]
+DIM = 64
+BENCH_MODEL = "bench-random-encoder"
+
+
+class _RandomEncoder:
+    """固定随机向量编码器（基准测试只关心检索/合并开销）"""
+
+    def __init__(self, dim: int):
+        self._rng = np.random.default_rng(7)
+        self._dim = dim
+
+    def encode(self, texts):
+        return self._rng.standard_normal((len(texts), self._dim)).astype(np.float32)
+
+
+def _build_kb(size: int) -> KnowledgeBase:
+    """构造一个包含合成函数文档的知识库（不读取规则文件）"""
+    kb = KnowledgeBase.__new__(KnowledgeBase)
+    kb.rule_file = ""
+    kb.embedding_model_name = BENCH_MODEL
+    kb.vector_backend = "numpy"
+    kb.hybrid_search = False
+    kb.functions = [
+        FunctionDoc(
+            lua_signature=f"Env.SyntheticFunc{i}(Map, Arg)",
+            cpp_signature="",
+            description=f"合成函数 {i}",
+            parameters="Map, Arg",
+            example="",
+            module=MODULES[i % len(MODULES)],
+            category="其他",
+            atomicity="",
+            llm_suitability="",
+            tags=[f"SyntheticFunc{i}"]
+        )
+        for i in range(size)
+    ]
+    kb._build_lookup_tables()
+
+    encoder = _RandomEncoder(DIM)
+    embedding_registry._models[BENCH_MODEL] = encoder
+    kb.embedding_model = encoder
+
+    index = NumpyVectorIndex()
+    index.build(kb.doc_ids, encoder.encode(kb.doc_ids), [f.module for f in kb.functions])
+    kb.vector_db = index
+    return kb
+
+
+def _legacy_retrieve(kb: KnowledgeBase, modules, query: str, top_k: int):
+    """旧版实现：模块列表推导 + 对每个函数调用 functions.index()"""
+    filtered_funcs = [f for f in kb.functions if f.module in modules]
+    query_embedding = embedding_registry.encode_query(query, kb.embedding_model_name).tolist()
+    db_results = kb.vector_db.query(
+        query_embeddings=[query_embedding],
+        n_results=min(top_k, len(filtered_funcs)),
+        where={"module": {"$in": modules}}
+    )
+    retrieved_funcs = {}
+    for func_id in db_results['ids'][0]:
+        idx = kb._id_to_index.get(func_id)
+        if idx is not None:
+            retrieved_funcs[idx] = kb.functions[idx]
+    results = []
+    for func in filtered_funcs:
+        if kb.functions.index(func) in retrieved_funcs:
+            results.append(func)
+    return results[:top_k]
+
+
+def _time_ms(fn, repeats: int):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="retrieve_functions 规模扩展基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--top-k", type=int, default=40)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="旧版实现只在不超过该规模时运行（O(n²)，大规模下过慢）")
+    args = parser.parse_args()
+
+    modules = ["P1", "P2", "P3", "P8"]
+    query = "创建一个有村庄和森林的地图"
+
+    print("=" * 60)
+    print(f"retrieve_functions scaling: top_k={args.top_k} modules={modules}")
+    print("=" * 60)
+    print(f"  {'functions':>10} {'current p50':>14} {'legacy p50':>14}")
+
+    for size in args.sizes:
+        kb = _build_kb(size)
+        embedding_registry.get_query_cache().clear()
+        kb.retrieve_functions(modules=modules, query=query, top_k=args.top_k)  # 预热查询向量缓存
+
+        current = _time_ms(lambda: kb.retrieve_functions(modules=modules, query=query, top_k=args.top_k),
+                           args.repeats)
+        if size <= args.legacy_max:
+            legacy = _time_ms(lambda: _legacy_retrieve(kb, modules, query, args.top_k),
+                              max(1, args.repeats // 10))
+            legacy_text = f"{legacy:12.2f}ms"
+        else:
+            legacy_text = f"{'skipped':>14}"
+        print(f"  {size:>10} {current:12.3f}ms {legacy_text}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
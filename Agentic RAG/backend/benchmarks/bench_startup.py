@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Flask应用启动耗时检查
+在全新的子进程中执行 `import app`，测量导入耗时并与预算比较（超出预算时返回非零退出码）；
+--importtime 模式使用 `python -X importtime` 统计各模块的累计导入耗时，输出报告
+
+用法：
+    python benchmarks/bench_startup.py --runs 5 --budget 1.0
+    python benchmarks/bench_startup.py --importtime --top 25 --output benchmarks/import_time_report.md
+"""
+
+import argparse
+import io
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 启动阶段不应导入的重量级依赖
+HEAVY_MODULES = ("torch", "sentence_transformers", "chromadb", "transformers")
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def _child_env():
+    env = dict(os.environ)
+    # 启动检查只关心导入本身，关闭后台线程
+    env['RAG_KB_HOT_RELOAD'] = '0'
+    env['RAG_PRELOAD_KB'] = '0'
+    env['PYTHONIOENCODING'] = 'utf-8'
+    return env
+
+
+def measure_import(runs):
+    """多次在新进程中导入app，返回每次的耗时（秒）以及加载到的重量级模块"""
+    probe = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import app\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print('STARTUP', elapsed, ','.join(heavy))\n"
+    )
+    timings = []
+    heavy_loaded = set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", probe], cwd=BACKEND_DIR, env=_child_env(),
+            capture_output=True, text=True, encoding='utf-8', errors='replace'
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"导入app失败:\n{result.stderr}")
+        line = [l for l in result.stdout.splitlines() if l.startswith('STARTUP ')][-1]
+        parts = line.split(' ', 2)
+        timings.append(float(parts[1]))
+        if len(parts) > 2 and parts[2].strip():
+            heavy_loaded.update(parts[2].strip().split(','))
+    return timings, sorted(heavy_loaded)
+
+
+def profile_imports():
+    """执行 python -X importtime -c "import app"，解析stderr，返回 [(模块, 自身us, 累计us, 深度)]"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"], cwd=BACKEND_DIR, env=_child_env(),
+        capture_output=True, text=True, encoding='utf-8', errors='replace'
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入app失败:\n{result.stderr}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def format_report(entries, top, timings):
+    """生成Markdown格式的导入耗时报告"""
+    total_us = sum(e[2] for e in entries if e[3] == 0)
+    # app 模块直接导入的依赖（深度1）
+    direct = sorted((e for e in entries if e[3] == 1), key=lambda e: e[2], reverse=True)
+
+    lines = [
+        "# `import app` 导入耗时报告",
+        "",
+        "由 `python benchmarks/bench_startup.py --importtime` 生成（基于 `python -X importtime -c \"import app\"`）。",
+        "",
+        f"- Python: {platform.python_version()} ({platform.system()} {platform.machine()})",
+        f"- 已安装的重量级依赖: {', '.join(m for m in HEAVY_MODULES if _installed(m)) or '无'}",
+        f"- 导入总耗时（importtime累计）: {total_us / 1000:.1f} ms",
+    ]
+    if timings:
+        lines.append(f"- `import app` 墙钟耗时（{len(timings)}次中位数）: {statistics.median(timings) * 1000:.1f} ms")
+    lines += [
+        "",
+        f"## app 的直接导入（按累计耗时排序，前{top}项）",
+        "",
+        "| 模块 | 累计 (ms) | 自身 (ms) |",
+        "|------|----------:|----------:|",
+    ]
+    for module, self_us, cumulative_us, _ in direct[:top]:
+        lines.append(f"| `{module}` | {cumulative_us / 1000:.1f} | {self_us / 1000:.1f} |")
+
+    lines += [
+        "",
+        f"## 全部模块（按累计耗时排序，前{top}项）",
+        "",
+        "| 模块 | 累计 (ms) | 自身 (ms) | 深度 |",
+        "|------|----------:|----------:|-----:|",
+    ]
+    for module, self_us, cumulative_us, depth in sorted(entries, key=lambda e: e[2], reverse=True)[:top]:
+        lines.append(f"| `{module}` | {cumulative_us / 1000:.1f} | {self_us / 1000:.1f} | {depth} |")
+
+    heavy = [m for m in HEAVY_MODULES if any(e[0] == m for e in entries)]
+    lines += ["", f"启动阶段导入的重量级依赖: {', '.join(heavy) if heavy else '无'}", ""]
+    return "\n".join(lines)
+
+
+def _installed(module):
+    import importlib.util
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flask应用启动耗时检查")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数")
+    parser.add_argument("--budget", type=float, default=float(os.getenv('RAG_STARTUP_BUDGET', '1.0')),
+                        help="导入耗时预算（秒，按中位数判断）")
+    parser.add_argument("--importtime", action="store_true", help="输出 -X importtime 模块耗时报告")
+    parser.add_argument("--top", type=int, default=20, help="报告中列出的模块数量")
+    parser.add_argument("--output", help="将报告写入文件（Markdown）")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    timings, heavy_loaded = measure_import(args.runs)
+    median = statistics.median(timings)
+
+    print(f"import app: 中位数 {median * 1000:.1f} ms, 最小 {min(timings) * 1000:.1f} ms, "
+          f"最大 {max(timings) * 1000:.1f} ms（{args.runs}次, 预算 {args.budget * 1000:.0f} ms）")
+
+    if args.importtime:
+        report = format_report(profile_imports(), args.top, timings)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(report)
+            print(f"报告已写入: {args.output}")
+        else:
+            print(report)
+
+    print(f"总耗时: {time.perf_counter() - start:.1f}s")
+
+    failed = False
+    if heavy_loaded:
+        print(f"[FAIL] 启动阶段导入了重量级依赖: {', '.join(heavy_loaded)}")
+        failed = True
+    if median > args.budget:
+        print(f"[FAIL] 启动耗时超出预算: {median * 1000:.1f} ms > {args.budget * 1000:.0f} ms")
+        failed = True
+    if not failed:
+        print("[OK] 启动耗时在预算之内")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
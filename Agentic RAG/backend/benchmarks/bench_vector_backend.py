@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检索后端基准测试
+对比 ChromaDB 与进程内 NumPy 向量索引的 top-k 检索延迟
+
+用法：
+    python benchmarks/bench_vector_backend.py --docs 300 --queries 500 --top-k 30
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 添加backend目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from vector_index import NumpyVectorIndex
+
+MODULES = ["P1", "P2", "P3", "P4", "P5", "P6", "P7", "P8", "R1-R6"]
+
+
+def _summarize(name: str, samples_ms):
+    """打印延迟统计"""
+    samples_ms = sorted(samples_ms)
+    p95 = samples_ms[int(len(samples_ms) * 0.95) - 1]
+    print(f"  {name:<8} mean={statistics.mean(samples_ms):8.3f}ms  "
+          f"p50={statistics.median(samples_ms):8.3f}ms  p95={p95:8.3f}ms")
+    return statistics.median(samples_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChromaDB vs NumPy 检索延迟对比")
+    parser.add_argument("--docs", type=int, default=300, help="文档数量")
+    parser.add_argument("--dim", type=int, default=384, help="向量维度（MiniLM为384）")
+    parser.add_argument("--queries", type=int, default=500, help="查询次数")
+    parser.add_argument("--top-k", type=int, default=30, help="每次检索返回的数量")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    embeddings = rng.standard_normal((args.docs, args.dim)).astype(np.float32)
+    ids = [f"func_{i}" for i in range(args.docs)]
+    modules = [MODULES[i % len(MODULES)] for i in range(args.docs)]
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    module_filters = [sorted(rng.choice(MODULES, size=4, replace=False).tolist()) for _ in range(args.queries)]
+
+    print("=" * 60)
+    print(f"Vector backend benchmark: docs={args.docs} dim={args.dim} "
+          f"queries={args.queries} top_k={args.top_k}")
+    print("=" * 60)
+
+    # NumPy索引
+    index = NumpyVectorIndex()
+    start = time.perf_counter()
+    index.build(ids, embeddings, modules)
+    print(f"  numpy build: {(time.perf_counter() - start) * 1000:.2f}ms")
+
+    numpy_samples = []
+    for query, mods in zip(queries, module_filters):
+        start = time.perf_counter()
+        index.query(query_embeddings=[query.tolist()], n_results=args.top_k,
+                    where={"module": {"$in": mods}})
+        numpy_samples.append((time.perf_counter() - start) * 1000)
+    numpy_p50 = _summarize("numpy", numpy_samples)
+
+    # ChromaDB（可选）
+    try:
+        import chromadb
+    except ImportError:
+        print("  chroma   跳过（chromadb未安装）")
+        return 0
+
+    client = chromadb.EphemeralClient()
+    collection = client.create_collection(name="bench_vector_backend",
+                                          metadata={"hnsw:space": "cosine"})
+    start = time.perf_counter()
+    collection.add(ids=ids, embeddings=embeddings.tolist(),
+                   metadatas=[{"module": m} for m in modules])
+    print(f"  chroma build: {(time.perf_counter() - start) * 1000:.2f}ms")
+
+    chroma_samples = []
+    for query, mods in zip(queries, module_filters):
+        start = time.perf_counter()
+        collection.query(query_embeddings=[query.tolist()], n_results=args.top_k,
+                         where={"module": {"$in": mods}})
+        chroma_samples.append((time.perf_counter() - start) * 1000)
+    chroma_p50 = _summarize("chroma", chroma_samples)
+
+    print(f"\n  p50 speedup (chroma / numpy): {chroma_p50 / numpy_p50:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
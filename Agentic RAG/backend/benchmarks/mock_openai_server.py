@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地OpenAI兼容模拟服务器（仅用于基准测试）
+实现 POST /v1/chat/completions（支持 stream=true 的SSE输出），
+可配置固定响应延迟，并统计建立的TCP连接数和请求数，用于衡量客户端连接复用效果
+
+可选模拟服务端前缀缓存（prefill_per_1k > 0 时）：消息按固定大小分块，
+与之前请求相同的前导块视为已缓存，只有未缓存部分按 prefill_per_1k 秒/千token 计入延迟，
+usage.prompt_tokens_details.cached_tokens 返回命中的token数
+
+可选模拟输出速度（tokens_per_sec > 0 时）：响应按 completion_tokens / tokens_per_sec 计入延迟，流式输出分摊到每块；
+可按阶段返回不同响应（stages）：最后一条user消息以某阶段的前缀开头时返回该阶段的响应，并按阶段统计请求数
+
+用法：
+    python benchmarks/mock_openai_server.py --port 8765 --latency 0.05
+    python benchmarks/mock_openai_server.py --prefill-per-1k 0.2
+    python benchmarks/mock_openai_server.py --tokens-per-sec 50
+    然后将 base_url 指向 http://127.0.0.1:8765/v1
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import NamedTuple, Optional, Sequence
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 设置UTF-8编码输出（Windows兼容）
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# 前缀缓存的分块大小（字符）和最多保留的块数
+PREFIX_BLOCK_CHARS = 256
+PREFIX_CACHE_BLOCKS = 100000
+
+DEFAULT_RESPONSE = """```lua
+local function ResolveEncounterLoc()
+    return { X = 0, Y = 0, Z = 0 }
+end
+
+function SpawnEncounter_Mock()
+    local npcData = {
+        enc0_Alice = "Default"
+    }
+
+    local code = [[
+local player = World.GetByID("Player")
+local alice = World.GetByID("enc0_Alice")
+if not player or not player:IsValid() then return end
+if not alice or not alice:IsValid() then return end
+alice:ApproachAndSay(player, "你好，旅行者。")
+]]
+
+    local loc = ResolveEncounterLoc()
+    return World.SpawnEncounter(loc, 100.0, npcData, "EnterVolume", code)
+end
+
+SpawnEncounter_Mock()
+
+World.StartGame()
+Time.Resume()
+```"""
+
+
+class StageResponse(NamedTuple):
+    """一个阶段的固定响应：最后一条user消息以prefix开头时匹配"""
+    name: str
+    prefix: str
+    text: str
+    latency: Optional[float] = None  # None时使用服务器的latency
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """每个连接对应一个处理器实例；HTTP/1.1下同一连接可处理多个请求"""
+
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，关闭Nagle算法避免与客户端延迟ACK叠加产生约40ms的停顿
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        with self.server.stats_lock:
+            self.server.requests += 1
+
+        stage = self.server.match_stage(body.get("messages", []))
+        prompt_tokens, cached_tokens, prefill = self.server.prefill(body.get("messages", []))
+        latency = self.server.latency if stage is None or stage.latency is None else stage.latency
+        if latency + prefill > 0:
+            time.sleep(latency + prefill)
+
+        if stage is not None:
+            text = stage.text
+        else:
+            text = self.server.response_text
+            if callable(text):
+                text = text(body)
+        completion_tokens = max(1, len(text) // 4)
+        # 非流式响应整体等待输出耗时，流式响应分摊到每块
+        generation = completion_tokens / self.server.tokens_per_sec if self.server.tokens_per_sec > 0 else 0.0
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+
+        if body.get("stream"):
+            self._send_stream(body, text, usage, generation)
+        else:
+            if generation > 0:
+                time.sleep(generation)
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, body, text, usage, generation=0.0):
+        """以SSE分块输出，每块约 chunk_chars 个字符；generation为全部输出的模拟耗时（秒）"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write_event(payload):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+        chunk_chars = self.server.chunk_chars
+        chunk_generation = generation * chunk_chars / len(text) if text else 0.0
+        for start in range(0, len(text), chunk_chars):
+            if self.server.chunk_delay + chunk_generation > 0:
+                time.sleep(self.server.chunk_delay + chunk_generation)
+            write_event(json.dumps({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": text[start:start + chunk_chars]}, "finish_reason": None}]
+            }, ensure_ascii=False))
+        final = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        }
+        if (body.get("stream_options") or {}).get("include_usage"):
+            final["usage"] = usage
+        write_event(json.dumps(final))
+        write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """带统计信息的模拟服务器"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, response_text=DEFAULT_RESPONSE, chunk_chars=16, chunk_delay=0.0,
+                 prefill_per_1k=0.0, tokens_per_sec=0.0, stages: Sequence[StageResponse] = ()):
+        super().__init__(address, MockOpenAIHandler)
+        self.latency = latency
+        self.response_text = response_text
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.prefill_per_1k = prefill_per_1k
+        self.tokens_per_sec = tokens_per_sec
+        self.stages = tuple(stages)
+        self.connections = 0
+        self.requests = 0
+        self.stage_requests: Counter = Counter()
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prefill_seconds = 0.0
+        self.stats_lock = threading.Lock()
+        self._prefix_blocks = OrderedDict()
+
+    def match_stage(self, messages) -> Optional[StageResponse]:
+        """按最后一条user消息的开头匹配阶段（按stages的顺序，第一个匹配的生效），并计数"""
+        if not self.stages:
+            return None
+        content = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        stage = next((s for s in self.stages if content.startswith(s.prefix)), None)
+        with self.stats_lock:
+            self.stage_requests[stage.name if stage is not None else "unmatched"] += 1
+        return stage
+
+    def prefill(self, messages):
+        """
+        计算提示词token数、命中前缀缓存的token数和模拟的prefill耗时（按约4字符/token）
+        前导块的累积哈希在缓存中即为命中；遇到第一个未命中块后其余部分都需要重新计算
+        """
+        text = "".join(f"<|{m.get('role', '')}|>{m.get('content', '')}" for m in messages)
+        prompt_tokens = len(text) // 4
+        cached_chars = 0
+        digest = hashlib.sha256()
+        block_keys = []
+        for start in range(0, len(text), PREFIX_BLOCK_CHARS):
+            block = text[start:start + PREFIX_BLOCK_CHARS]
+            digest.update(block.encode('utf-8'))
+            # 只有完整的块可以缓存
+            if len(block) == PREFIX_BLOCK_CHARS:
+                block_keys.append(digest.hexdigest())
+
+        with self.stats_lock:
+            hit = True
+            for key in block_keys:
+                if hit and key in self._prefix_blocks:
+                    cached_chars += PREFIX_BLOCK_CHARS
+                    self._prefix_blocks.move_to_end(key)
+                else:
+                    hit = False
+                    self._prefix_blocks[key] = True
+            while len(self._prefix_blocks) > PREFIX_CACHE_BLOCKS:
+                self._prefix_blocks.popitem(last=False)
+
+            cached_tokens = cached_chars // 4
+            prefill = self.prefill_per_1k * (prompt_tokens - cached_tokens) / 1000
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.prefill_seconds += prefill
+        return prompt_tokens, cached_tokens, prefill
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.connections = 0
+            self.requests = 0
+            self.stage_requests.clear()
+            self.prompt_tokens = 0
+            self.cached_tokens = 0
+            self.prefill_seconds = 0.0
+            self._prefix_blocks.clear()
+
+
+def start_mock_server(port=0, latency=0.0, response_text=DEFAULT_RESPONSE, chunk_chars=16, chunk_delay=0.0,
+                      prefill_per_1k=0.0, tokens_per_sec=0.0, stages: Sequence[StageResponse] = ()):
+    """
+    在后台线程启动模拟服务器（port=0时随机端口），返回服务器对象
+    使用完毕后调用 server.shutdown()
+    """
+    server = MockOpenAIServer(('127.0.0.1', port), latency, response_text, chunk_chars, chunk_delay, prefill_per_1k,
+                              tokens_per_sec, stages)
+    thread = threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟服务器")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="流式输出每块之间的延迟（秒）")
+    parser.add_argument("--prefill-per-1k", type=float, default=0.0,
+                        help="未命中前缀缓存的提示词每千token的处理耗时（秒），0表示不模拟")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="模拟的输出速度（token/秒），0表示不限制")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(('127.0.0.1', args.port), args.latency, chunk_delay=args.chunk_delay,
+                              prefill_per_1k=args.prefill_per_1k, tokens_per_sec=args.tokens_per_sec)
+    print(f"模拟服务器已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"连接数: {server.connections}, 请求数: {server.requests}, "
+              f"提示词token: {server.prompt_tokens}（缓存命中 {server.cached_tokens}）")
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+按token预算组装提示词上下文
+每个阶段有独立的上下文预算（检索到的函数文档、参考示例、深度分析等可变材料），
+各部分按优先级填充；超出预算时依次：
+1. 从排名最低的文档开始去掉可选字段（常见错误、推荐用法、示例）
+2. 从优先级最低的部分开始截断或整体去掉
+3. 从排名最低的文档开始整篇去掉（保留最少文档数）
+并记录每个提示词的最终token估算
+"""
+
+import os
+import re
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence
+
+from metrics import timed
+
+
+# 各阶段的上下文token预算（<=0表示不限制），可通过 RAG_CONTEXT_BUDGET_<阶段名大写> 覆盖
+DEFAULT_STAGE_BUDGETS = {
+    "thinking": 4000,
+    "decomposition": 4000,
+    "plan": 2500,
+    "code": 6000,
+    "refine": 6000,
+    "planning": 4000,
+}
+
+# 整篇去掉文档时至少保留的文档数
+MIN_DOCS = int(os.getenv('RAG_CONTEXT_MIN_DOCS', '5'))
+
+_CJK_PATTERN = re.compile(r'[⺀-鿿가-힯豈-﫿＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本token数（不依赖分词器）：
+    中日韩字符和全角符号约1个token/字符，其余字符约4个字符/token
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def stage_budget(stage: str) -> int:
+    """返回阶段的上下文预算"""
+    value = os.getenv(f"RAG_CONTEXT_BUDGET_{stage.upper()}")
+    if value is not None:
+        return int(value)
+    return DEFAULT_STAGE_BUDGETS.get(stage, 0)
+
+
+class _Section:
+    def __init__(self, name: str, text: str, required: bool, truncatable: bool):
+        self.name = name
+        self.text = text or ""
+        self.required = required
+        self.truncatable = truncatable
+        self.tokens = estimate_tokens(self.text)
+        self.output = self.text
+
+
+class _DocsSection:
+    """
+    排序后的函数文档
+    doc_tokens(doc, omit) 返回单篇文档的token估算；join(docs, omit_list) 渲染整体（含模块标题等）
+    optional_fields 按去掉的先后顺序排列
+    """
+
+    def __init__(self, name: str, docs: Sequence[Any], doc_tokens: Callable[[Any, FrozenSet[str]], int],
+                 join: Callable[[List[Any], List[FrozenSet[str]]], str], optional_fields: Sequence[str],
+                 min_docs: int):
+        self.name = name
+        self.docs = list(docs)
+        self.join = join
+        self.min_docs = min_docs
+        self.required = False
+
+        # 每篇文档在每个精简级别（去掉前k个可选字段）下的token数
+        self.levels = [frozenset(optional_fields[:k]) for k in range(len(optional_fields) + 1)]
+        self.doc_tokens = [[doc_tokens(doc, omit) for omit in self.levels] for doc in self.docs]
+        self.doc_level = [0] * len(self.docs)
+        self.kept = len(self.docs)
+
+        full_text = join(self.docs, [self.levels[0]] * len(self.docs))
+        # 模块标题、附加规则等不随文档精简变化的部分
+        self.overhead = max(0, estimate_tokens(full_text) - sum(t[0] for t in self.doc_tokens))
+        self.output = full_text
+
+    @property
+    def tokens(self) -> int:
+        if not self.docs:
+            return self.overhead
+        return self.overhead + sum(self.doc_tokens[i][self.doc_level[i]] for i in range(self.kept))
+
+    def render(self) -> str:
+        docs = self.docs[:self.kept]
+        self.output = self.join(docs, [self.levels[self.doc_level[i]] for i in range(self.kept)])
+        return self.output
+
+
+class ContextAssembler:
+    """
+    单个提示词的上下文组装器
+    sections按添加顺序即优先级（先添加的优先保留）
+    """
+
+    def __init__(self, stage: str, budget: Optional[int] = None):
+        self.stage = stage
+        self.budget = stage_budget(stage) if budget is None else budget
+        self.sections: List[Any] = []
+        self.report: Dict[str, Any] = {}
+
+    def add(self, name: str, text: str, required: bool = False, truncatable: bool = False) -> "ContextAssembler":
+        """添加文本部分；required部分始终完整保留，truncatable部分超出预算时按行截断"""
+        self.sections.append(_Section(name, text, required, truncatable))
+        return self
+
+    def add_docs(self, name: str, docs: Sequence[Any], kb: Any, min_docs: int = MIN_DOCS) -> "ContextAssembler":
+        """添加按相关度排序的函数文档（使用知识库的渲染方法、文档token估算和可选字段定义）"""
+        self.sections.append(_DocsSection(
+            name, docs,
+            kb.function_doc_tokens,
+            lambda docs, omit: kb.get_function_docs_text(docs, omit),
+            kb.OPTIONAL_DOC_FIELDS,
+            min_docs
+        ))
+        return self
+
+    def _total(self) -> int:
+        return sum(section.tokens for section in self.sections)
+
+    @timed("prompt_assembly")
+    def fit(self) -> Dict[str, str]:
+        """按预算裁剪各部分，返回 {部分名称: 文本}"""
+        original = {section.name: section.tokens for section in self.sections}
+        docs_sections = [s for s in self.sections if isinstance(s, _DocsSection)]
+
+        if self.budget > 0 and self._total() > self.budget:
+            self._strip_optional_fields(docs_sections)
+        if self.budget > 0 and self._total() > self.budget:
+            self._shrink_sections()
+        if self.budget > 0 and self._total() > self.budget:
+            self._drop_docs(docs_sections)
+
+        for section in docs_sections:
+            section.render()
+
+        self.report = {
+            "stage": self.stage,
+            "budget": self.budget,
+            "context_tokens": self._total(),
+            "original_tokens": sum(original.values()),
+            "sections": {
+                section.name: {"tokens": section.tokens, "original_tokens": original[section.name]}
+                for section in self.sections
+            },
+            "docs": {
+                section.name: {"kept": section.kept, "retrieved": len(section.docs)}
+                for section in docs_sections
+            }
+        }
+        return {section.name: section.output for section in self.sections}
+
+    def _strip_optional_fields(self, docs_sections: List[_DocsSection]):
+        """逐级去掉可选字段：每一级都从排名最低的文档开始"""
+        max_level = max((len(s.levels) - 1 for s in docs_sections), default=0)
+        for level in range(1, max_level + 1):
+            for section in docs_sections:
+                if level >= len(section.levels):
+                    continue
+                for i in range(section.kept - 1, -1, -1):
+                    if section.doc_level[i] < level:
+                        section.doc_level[i] = level
+                        if self._total() <= self.budget:
+                            return
+
+    def _shrink_sections(self):
+        """从优先级最低的非必需文本部分开始截断或去掉"""
+        for section in reversed(self.sections):
+            if isinstance(section, _DocsSection) or section.required or not section.output:
+                continue
+            excess = self._total() - self.budget
+            if excess <= 0:
+                return
+            if section.truncatable and section.tokens > excess:
+                section.output = _truncate_lines(section.output, section.tokens - excess)
+            else:
+                section.output = ""
+            section.tokens = estimate_tokens(section.output)
+
+    def _drop_docs(self, docs_sections: List[_DocsSection]):
+        """从排名最低的文档开始整篇去掉（保留最少文档数）"""
+        for section in reversed(docs_sections):
+            while section.kept > section.min_docs and self._total() > self.budget:
+                section.kept -= 1
+
+    def finalize(self, prompt: str, prefix_tokens: int = 0) -> int:
+        """记录并打印最终提示词（可变部分）的token估算；prefix_tokens为其前的静态前缀token数"""
+        tokens = estimate_tokens(prompt)
+        self.report["prompt_tokens"] = tokens
+        self.report["prefix_tokens"] = prefix_tokens
+        trimmed = [
+            f"{name} {info['original_tokens']}→{info['tokens']}"
+            for name, info in self.report.get("sections", {}).items()
+            if info["tokens"] != info["original_tokens"]
+        ]
+        detail = f"，裁剪: {', '.join(trimmed)}" if trimmed else ""
+        if prefix_tokens:
+            detail += f"，静态前缀 {prefix_tokens}"
+        print(f"[INFO] 提示词[{self.stage}] 约 {tokens} tokens"
+              f"（上下文 {self.report.get('context_tokens', 0)}/{self.budget or '不限'}{detail}）")
+        return tokens
+
+
+def _truncate_lines(text: str, max_tokens: int) -> str:
+    """按行截断到max_tokens以内（至少保留空串）"""
+    if max_tokens <= 0:
+        return ""
+    lines = []
+    used = 0
+    for line in text.splitlines():
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
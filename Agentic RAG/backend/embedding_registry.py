@@ -0,0 +1,154 @@
+"""
+嵌入模型注册表
+进程内按模型名称共享SentenceTransformer实例，首次使用时加载（线程安全）
+并提供查询向量的LRU缓存，两个知识库共用
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+
+# 两个知识库默认使用的多语言嵌入模型
+DEFAULT_EMBEDDING_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# 查询向量缓存容量（条目数），可通过环境变量调整
+QUERY_CACHE_SIZE = int(os.getenv('RAG_QUERY_CACHE_SIZE', '256'))
+
+_models: Dict[str, Any] = {}
+_models_lock = threading.Lock()
+
+
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL) -> Any:
+    """
+    获取共享的嵌入模型实例
+    同一进程内相同模型名称只加载一次；加载失败时抛出异常，由调用方决定回退策略
+    """
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    with _models_lock:
+        # 双重检查：等待锁期间其他线程可能已完成加载
+        model = _models.get(model_name)
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name)
+            _models[model_name] = model
+            print(f"已加载嵌入模型: {model_name}")
+    return model
+
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本：统一Unicode形式并折叠空白（不改变大小写，嵌入模型区分大小写）"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    查询向量LRU缓存
+    键为 (模型名称, 规范化查询文本)，记录命中/未命中次数
+    """
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_encode(self, model_name: str, text: str, model: Any) -> Any:
+        """返回缓存的查询向量；未命中时用model编码并写入缓存"""
+        key = (model_name, normalize_query(text))
+
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        # 编码在锁外进行，避免阻塞其他线程的缓存命中
+        vector = model.encode([key[1]])[0]
+        if hasattr(vector, 'flags'):
+            # 缓存的向量被多个请求共享，禁止原地修改
+            vector.flags.writeable = False
+
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return vector
+
+    def get_or_encode_many(self, model_name: str, texts: List[str], model: Any) -> List[Any]:
+        """批量版本：未命中的查询合并为一次model.encode调用（批量请求共享编码开销）"""
+        keys = [(model_name, normalize_query(text)) for text in texts]
+        vectors: Dict[Tuple[str, str], Any] = {}
+        
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    vectors[key] = vector
+            missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+            self.misses += len(missing)
+        
+        if missing:
+            encoded = model.encode([key[1] for key in missing])
+            with self._lock:
+                for key, vector in zip(missing, encoded):
+                    if hasattr(vector, 'flags'):
+                        vector.flags.writeable = False
+                    vectors[key] = vector
+                    if self.maxsize > 0:
+                        self._entries[key] = vector
+                        self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return [vectors[key] for key in keys]
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+    def clear(self):
+        """清空缓存并重置计数"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_query_cache = QueryEmbeddingCache()
+
+
+def encode_query(query: str, model_name: str = DEFAULT_EMBEDDING_MODEL) -> Any:
+    """编码查询文本（经过LRU缓存），返回一维向量"""
+    return _query_cache.get_or_encode(model_name, query, get_embedding_model(model_name))
+
+
+def encode_queries(queries: List[str], model_name: str = DEFAULT_EMBEDDING_MODEL) -> List[Any]:
+    """批量编码查询文本（经过LRU缓存），未命中的查询一次性编码"""
+    return _query_cache.get_or_encode_many(model_name, queries, get_embedding_model(model_name))
+
+
+def get_query_cache() -> QueryEmbeddingCache:
+    """获取进程内共享的查询向量缓存"""
+    return _query_cache
@@ -0,0 +1,163 @@
+"""
+文档向量持久化缓存
+以内容寻址的方式保存文档嵌入：向量矩阵存为可内存映射的 .npy 文件，
+清单（manifest）记录模型名称、向量维度和每篇文档文本的哈希。
+向量按行L2归一化后写入，NumpyVectorIndex 可直接使用内存映射的只读矩阵（零拷贝加载），
+只对文本发生变化的文档重新编码。
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from vector_index import l2_normalize
+
+
+# 版本2起矩阵中的向量已按行L2归一化（清单中 normalized=true）；版本1的向量仍可复用，写回时归一化
+MANIFEST_VERSION = 2
+_READABLE_VERSIONS = (1, MANIFEST_VERSION)
+
+# 缓存目录，默认位于backend/embedding_cache
+DEFAULT_CACHE_DIR = os.getenv(
+    'RAG_EMBEDDING_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache")
+)
+
+
+def text_hash(text: str) -> str:
+    """文档文本的内容哈希"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    内容寻址的文档向量缓存
+    - <name>.manifest.json：模型名称、维度、每行对应的文本哈希、矩阵文件名
+    - <name>-<digest>.npy：按行L2归一化的float32向量矩阵（写入后不再修改，可安全地被多个进程内存映射）
+    """
+
+    def __init__(self, name: str, model_name: str, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.name = name
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, f"{name}.manifest.json")
+        # 最近一次 get_embeddings 的统计
+        self.last_reused = 0
+        self.last_encoded = 0
+
+    def _load_manifest(self) -> Optional[Dict[str, Any]]:
+        """读取清单；不存在、损坏或模型不一致时返回None"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if manifest.get("version") not in _READABLE_VERSIONS or manifest.get("model") != self.model_name:
+            return None
+        return manifest
+
+    def _load_matrix(self, manifest: Dict[str, Any]) -> Optional["np.ndarray"]:
+        """以内存映射方式打开清单引用的向量矩阵（零拷贝）"""
+        matrix_path = os.path.join(self.cache_dir, manifest.get("matrix", ""))
+        try:
+            matrix = np.load(matrix_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if matrix.ndim != 2 or matrix.shape[0] != len(manifest.get("hashes", [])):
+            return None
+        return matrix
+
+    def get_embeddings(self, documents: List[str], encode: Callable[[List[str]], Any]) -> "np.ndarray":
+        """
+        返回与documents一一对应、按行L2归一化的向量矩阵（全部命中时为只读的内存映射矩阵）
+        encode: 编码函数，只会收到缓存中不存在的文档文本；全部命中时不会被调用
+        """
+        hashes = [text_hash(doc) for doc in documents]
+
+        manifest = self._load_manifest()
+        cached = self._load_matrix(manifest) if manifest else None
+
+        # 完全命中：直接返回内存映射的矩阵
+        if cached is not None and manifest.get("normalized") and manifest["hashes"] == hashes:
+            self.last_reused, self.last_encoded = len(hashes), 0
+            return cached
+
+        row_by_hash = {}
+        if cached is not None:
+            row_by_hash = {h: row for row, h in enumerate(manifest["hashes"])}
+
+        missing = [i for i, h in enumerate(hashes) if h not in row_by_hash]
+        new_vectors = None
+        if missing:
+            new_vectors = l2_normalize(np.asarray(encode([documents[i] for i in missing]), dtype=np.float32))
+
+        if cached is not None:
+            dim = cached.shape[1]
+        elif new_vectors is not None:
+            dim = new_vectors.shape[1]
+        else:
+            dim = 0
+
+        matrix = np.empty((len(documents), dim), dtype=np.float32)
+        for i, h in enumerate(hashes):
+            row = row_by_hash.get(h)
+            if row is not None:
+                matrix[i] = cached[row]
+        if new_vectors is not None:
+            matrix[missing] = new_vectors
+        if cached is not None and not manifest.get("normalized"):
+            # 版本1的缓存未归一化（新编码的行已归一化，重复归一化结果不变）
+            matrix = l2_normalize(matrix)
+
+        self.last_reused = len(documents) - len(missing)
+        self.last_encoded = len(missing)
+
+        try:
+            self._save(matrix, hashes, manifest)
+        except OSError as e:
+            print(f"写入向量缓存失败: {e}")
+        return matrix
+
+    def _save(self, matrix: "np.ndarray", hashes: List[str], previous: Optional[Dict[str, Any]]):
+        """写入新的矩阵文件和清单（先写临时文件再原子替换）"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # 摘要包含清单版本，归一化后的矩阵不会与版本1的文件同名
+        digest_source = f"{MANIFEST_VERSION}\n{self.model_name}\n" + "\n".join(hashes)
+        digest = hashlib.sha256(digest_source.encode('utf-8')).hexdigest()[:16]
+        matrix_name = f"{self.name}-{digest}.npy"
+        matrix_path = os.path.join(self.cache_dir, matrix_name)
+
+        if not os.path.exists(matrix_path):
+            tmp_path = f"{matrix_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, matrix)
+            os.replace(tmp_path, matrix_path)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "model": self.model_name,
+            "dim": int(matrix.shape[1]),
+            "normalized": True,
+            "matrix": matrix_name,
+            "hashes": hashes
+        }
+        tmp_manifest = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest, self.manifest_path)
+
+        # 清理旧的矩阵文件（仍被其他进程映射时删除可能失败，忽略即可）
+        if previous and previous.get("matrix") and previous["matrix"] != matrix_name:
+            try:
+                os.remove(os.path.join(self.cache_dir, previous["matrix"]))
+            except OSError:
+                pass
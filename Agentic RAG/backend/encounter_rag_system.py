@@ -7,6 +7,17 @@ import os
 import re
 from typing import Dict, Any, List, Optional
 from gameplay_knowledge_base import get_gameplay_knowledge_base, GameplayKnowledgeBase
+from llm_client import chat_completion
+from progress import ProgressReporter, stage
+from metrics import timed
+from pipeline import StagePipeline
+from context_budget import ContextAssembler
+from retrieval_context import RetrievalContext
+from prompt_prefix import PromptPrefix, get_prompt_prefix
+from lua_postprocess import LuaPostProcessor
+from lua_parser import LuaSyntaxError, strip_comments
+from encounter_validation import EncounterAnalysis, analyze_encounter
+from encounter_repair import EncounterRepairer, get_repair_stats
 
 # Few-Shot示例（基于用户提供的实际项目代码）
 FEW_SHOT_EXAMPLE = """```lua
@@ -104,6 +115,44 @@ ANIMATION_LIBRARY = [
     "Dialogue", "Give", "Point To", "Wave", "Sing", "Dance"
 ]
 
+# 生成代码后处理器（正则和动画别名表在加载时构建）
+_postprocessor = LuaPostProcessor(ANIMATION_LIBRARY)
+# 本地修复（可机械修复的问题不交给LLM）
+_repairer = EncounterRepairer(_postprocessor, ANIMATION_LIBRARY)
+
+# API配置
+API_CONFIG = {
+    "gpt-4.1": {
+        "model": "gpt-4-turbo-preview",
+        "base_url": "https://api.openai.com/v1"
+    },
+    "gpt-5.1": {
+        "model": "gpt-4-turbo-preview",  # 实际使用时替换为GPT-5.1的模型名
+        "base_url": "https://api.openai.com/v1"
+    }
+}
+
+SYSTEM_ROLE = "你是一个专业的LUA奇遇脚本生成专家，专门生成游戏Encounter脚本。"
+
+
+def build_encounter_prefix(kb: GameplayKnowledgeBase) -> PromptPrefix:
+    """
+    构建奇遇生成的静态前缀：参考文档示例、Few-Shot示例和动画素材库
+    thinking/decomposition/plan/code/refine 各阶段共用同一前缀
+    """
+    animations_text = "\n".join([f"- {anim}" for anim in ANIMATION_LIBRARY])
+    body = f"""以下参考资料适用于本次对话中的所有任务，任务中提到的参考文档示例、Few-Shot示例和动画素材库均指这里的内容。
+
+## 参考文档示例（gameplay_document.md）
+{kb.get_reference_examples()}
+
+## Few-Shot完整示例（必须严格遵循此格式）
+{FEW_SHOT_EXAMPLE}
+
+## 动画素材库（PlayAnim必须使用以下动画名称）
+{animations_text}"""
+    return PromptPrefix(SYSTEM_ROLE, body)
+
 
 class EncounterRAGSystem:
     """
@@ -111,12 +160,28 @@ class EncounterRAGSystem:
     实现4层工作流生成奇遇LUA脚本
     """
     
-    def __init__(self, config: Dict[str, Any]):
+    # 指标的mode标签
+    mode = "encounter"
+    
+    def __init__(self, config: Dict[str, Any], progress: Optional[ProgressReporter] = None):
         self.config = config
         self.model = config.get('model', 'gpt-4.1')
         self.agent_mode = config.get('agentMode', 'standard')
         self.max_iterations = config.get('maxIterations', 3)
+        # 请求开始时固定知识库快照，热重载不会影响进行中的生成
         self.kb = get_gameplay_knowledge_base()
+        # 请求内的检索缓存（模块识别、检索结果、渲染后的文档），各阶段共用
+        self.retrieval = RetrievalContext(self.kb)
+        # 进度事件（流式接口使用），为None时不记录
+        self.progress = progress
+        # 最近一次阶段依赖图的各阶段耗时
+        self.pipeline_timings: Dict[str, Dict[str, Any]] = {}
+        # 各次LLM调用的提示词token估算（按上下文预算组装）
+        self.prompt_reports: List[Dict[str, Any]] = []
+        # 最近一次代码检查的结果（两个验证方法共用）
+        self._analysis: Optional[EncounterAnalysis] = None
+        # 本地修复：各规则的修复次数、避免的LLM调用次数、交给LLM处理的问题类型
+        self.repair_report: Dict[str, Any] = {"rules": {}, "llmCallsAvoided": 0, "escalations": []}
         
     def generate(self, user_input: str, npc_tags: List[str] = None) -> str:
         """
@@ -132,33 +197,67 @@ class EncounterRAGSystem:
         else:
             return self._standard_generate(user_input, npc_tags)
     
-    def _standard_generate(self, user_input: str, npc_tags: List[str] = None) -> str:
+    def _build_pipeline(self, user_input: str, npc_tags: List[str] = None) -> StagePipeline:
         """
-        标准模式：单次生成（集成RAG）
-        实现Thinking-Planning-Action工作流
-        支持两种输入方式：
-        1. 结构化剧本格式（【触发】【移动】等标记）
-        2. 自然语言输入（如"请生成一个爱情故事"）
+        构建Thinking-Planning-Action阶段依赖图
+        - thinking、story 只依赖结构化输入解析结果（本地解析，无需LLM），两者并发执行
+        - decomposition 依赖 story 和 thinking，plan 依赖 decomposition，code 依赖全部规划结果
+        结构化输入跳过故事扩写和玩法拆解，直接使用用户输入
         """
-        # Thinking阶段：深度理解需求（自动检测输入类型）
-        thinking_result = self._thinking_phase(user_input, npc_tags)
+        structured_input = self._parse_structured_input(user_input)
+        pipeline = StagePipeline()
         
-        # 检测输入类型
-        structured_input = thinking_result.get("structured_input", {})
-        is_structured = structured_input.get("is_structured", False)
+        pipeline.add("thinking", lambda r: self._thinking_phase(user_input, npc_tags, structured_input))
         
-        if is_structured:
+        if structured_input["is_structured"]:
             # 结构化输入模式：直接使用用户输入，跳过故事扩写和玩法拆解
-            story = user_input  # 直接使用原始输入
-            execution_plan = "按照用户提供的结构化剧本格式生成代码"  # 简化执行计划
+            pipeline.add("story", lambda r: user_input)
+            pipeline.add("gameplay_nodes", lambda r: [])
+            pipeline.add("execution_plan", lambda r: "按照用户提供的结构化剧本格式生成代码")
         else:
             # 自然语言输入模式：使用完整的工作流
-            story = self._expand_story(user_input, npc_tags, thinking_result)
-            gameplay_nodes = self._decompose_gameplay(story, npc_tags, thinking_result)
-            execution_plan = self._build_execution_plan(gameplay_nodes, npc_tags, thinking_result)
+            pipeline.add("story", lambda r: self._expand_story(user_input, npc_tags, {"structured_input": structured_input}))
+            pipeline.add(
+                "gameplay_nodes",
+                lambda r: self._decompose_gameplay(r["story"], npc_tags, r["thinking"]),
+                deps=("story", "thinking")
+            )
+            pipeline.add(
+                "execution_plan",
+                lambda r: self._build_execution_plan(r["gameplay_nodes"], npc_tags, r["thinking"]),
+                deps=("gameplay_nodes", "thinking")
+            )
         
-        # Action阶段：生成和验证代码（两种模式都使用相同的生成方法）
-        lua_code = self._generate_lua_code(user_input, story, execution_plan, npc_tags, thinking_result)
+        # Action阶段：代码生成（两种输入方式使用相同的生成方法）
+        pipeline.add(
+            "code",
+            lambda r: self._code_generation_agent(user_input, {
+                "story": r["story"],
+                "gameplay_nodes": r["gameplay_nodes"],
+                "execution_plan": r["execution_plan"],
+                "thinking_result": r["thinking"]
+            }, npc_tags),
+            deps=("thinking", "story", "gameplay_nodes", "execution_plan")
+        )
+        return pipeline
+    
+    def _run_pipeline(self, user_input: str, npc_tags: List[str] = None) -> Dict[str, Any]:
+        """执行阶段依赖图并记录各阶段耗时"""
+        pipeline = self._build_pipeline(user_input, npc_tags)
+        results = pipeline.run()
+        self.pipeline_timings = pipeline.timings
+        print(f"[INFO] 阶段耗时（总计 {pipeline.critical_path_ms() / 1000:.2f}s）: {pipeline.summary()}")
+        return results
+    
+    def _standard_generate(self, user_input: str, npc_tags: List[str] = None) -> str:
+        """
+        标准模式：单次生成（集成RAG）
+        实现Thinking-Planning-Action工作流
+        支持两种输入方式：
+        1. 结构化剧本格式（【触发】【移动】等标记）
+        2. 自然语言输入（如"请生成一个爱情故事"）
+        """
+        lua_code = self._run_pipeline(user_input, npc_tags)["code"]
         
         # 最终验证和修正
         lua_code = self._final_validation_and_fix(lua_code, user_input, npc_tags)
@@ -170,25 +269,7 @@ class EncounterRAGSystem:
         迭代模式：多次优化（使用Thinking-Planning-Action）
         支持两种输入方式：结构化输入和自然语言输入
         """
-        # Thinking阶段：深度理解需求（自动检测输入类型）
-        thinking_result = self._thinking_phase(user_input, npc_tags)
-        
-        # 检测输入类型
-        structured_input = thinking_result.get("structured_input", {})
-        is_structured = structured_input.get("is_structured", False)
-        
-        if is_structured:
-            # 结构化输入模式：直接使用用户输入
-            story = user_input
-            execution_plan = "按照用户提供的结构化剧本格式生成代码"
-        else:
-            # 自然语言输入模式：使用完整的工作流
-            story = self._expand_story(user_input, npc_tags, thinking_result)
-            gameplay_nodes = self._decompose_gameplay(story, npc_tags, thinking_result)
-            execution_plan = self._build_execution_plan(gameplay_nodes, npc_tags, thinking_result)
-        
-        # Action阶段：生成代码
-        current_code = self._generate_lua_code(user_input, story, execution_plan, npc_tags, thinking_result)
+        current_code = self._run_pipeline(user_input, npc_tags)["code"]
         
         # 迭代优化
         for iteration in range(self.max_iterations - 1):
@@ -197,9 +278,10 @@ class EncounterRAGSystem:
                 break
             
             # 优化代码
+            self._record_escalation(current_code)
             current_code = self._refine_code(user_input, current_code, npc_tags)
             # 修正代码问题
-            current_code = self._fix_code_issues(current_code)
+            current_code = self._repair_code(current_code, npc_tags)
         
         # 最终验证和修正
         current_code = self._final_validation_and_fix(current_code, user_input, npc_tags)
@@ -211,33 +293,8 @@ class EncounterRAGSystem:
         多Agent协作模式（使用Thinking-Planning-Action）
         支持两种输入方式：结构化输入和自然语言输入
         """
-        # Thinking阶段：深度理解需求（自动检测输入类型）
-        thinking_result = self._thinking_phase(user_input, npc_tags)
-        
-        # 检测输入类型
-        structured_input = thinking_result.get("structured_input", {})
-        is_structured = structured_input.get("is_structured", False)
-        
-        if is_structured:
-            # 结构化输入模式：直接使用用户输入
-            story = user_input
-            gameplay_nodes = []
-            execution_plan = "按照用户提供的结构化剧本格式生成代码"
-        else:
-            # 自然语言输入模式：使用完整的工作流
-            story = self._expand_story(user_input, npc_tags, thinking_result)
-            gameplay_nodes = self._decompose_gameplay(story, npc_tags, thinking_result)
-            execution_plan = self._build_execution_plan(gameplay_nodes, npc_tags, thinking_result)
-        
-        plan = {
-            "story": story,
-            "gameplay_nodes": gameplay_nodes,
-            "execution_plan": execution_plan,
-            "thinking_result": thinking_result
-        }
-        
-        # Action阶段：代码生成
-        code = self._code_generation_agent(user_input, plan, npc_tags)
+        # 规划Agent与代码生成Agent按依赖图调度
+        code = self._run_pipeline(user_input, npc_tags)["code"]
         
         # 最终验证和修正
         code = self._final_validation_and_fix(code, user_input, npc_tags)
@@ -377,23 +434,29 @@ class EncounterRAGSystem:
         parsed["npc_characters"] = list(parsed["npc_characters"])
         return parsed
     
-    def _thinking_phase(self, user_input: str, npc_tags: List[str] = None) -> Dict[str, Any]:
+    @stage("thinking")
+    def _thinking_phase(self, user_input: str, npc_tags: List[str] = None,
+                        structured_input: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         Thinking阶段：深度理解用户需求、约束和上下文
         分析需求的关键要素，识别必要的API和模式
+        structured_input: 已解析的结构化输入（未提供时在此解析）
         """
         # 首先解析结构化输入
-        structured_input = self._parse_structured_input(user_input)
+        if structured_input is None:
+            structured_input = self._parse_structured_input(user_input)
         
         # 检索相关函数文档以理解可用API
-        modules = self.kb.identify_required_modules(user_input, npc_tags)
-        relevant_functions = self.kb.retrieve_functions(
+        modules = self.retrieval.identify_required_modules(user_input, npc_tags)
+        relevant_functions = self.retrieval.retrieve_functions(
             modules=modules,
             query=user_input,
             top_k=30
         )
-        function_docs = self.kb.get_function_docs_text(relevant_functions)
-        reference_examples = self.kb.get_reference_examples()
+        # 参考文档示例等静态内容位于前缀中，这里只组装检索到的函数文档
+        context = ContextAssembler("thinking")
+        context.add_docs("function_docs", relevant_functions, self.retrieval)
+        function_docs = context.fit()["function_docs"]
         
         # 如果检测到结构化输入，使用专门的解析提示
         if structured_input["is_structured"]:
@@ -411,9 +474,6 @@ class EncounterRAGSystem:
 可用的API函数参考：
 {function_docs}
 
-参考文档示例（gameplay_document.md）：
-{reference_examples}
-
 **重要任务**：
 1. 必须严格按照用户提供的结构化输入生成代码
 2. 不能使用任何模板或默认场景
@@ -439,9 +499,6 @@ NPC标签：{', '.join(npc_tags) if npc_tags else 'Tag_A'}
 可用的API函数参考：
 {function_docs}
 
-参考文档示例（gameplay_document.md）：
-{reference_examples}
-
 请进行深度分析，输出JSON格式：
 {{
     "required_modules": ["模块列表"],
@@ -465,19 +522,20 @@ NPC标签：{', '.join(npc_tags) if npc_tags else 'Tag_A'}
 4. 玩家对话必须使用UI.ShowDialogue
 5. 所有API调用必须与参考文档示例一致"""
         
-        thinking_text = self._call_llm_api(prompt)
+        self._record_prompt(context, prompt)
+        thinking_text = self._call_llm_api(prompt, prefix=self._prompt_prefix())
         
         # 解析JSON（简化处理，实际应该使用json.loads）
         thinking_result = {
             "raw_analysis": thinking_text,
             "modules": modules,
             "function_docs": function_docs,
-            "reference_examples": reference_examples,
             "structured_input": structured_input  # 添加结构化输入解析结果
         }
         
         return thinking_result
     
+    @stage("story")
     def _expand_story(self, user_input: str, npc_tags: List[str] = None, thinking_result: Dict[str, Any] = None) -> str:
         """
         Layer 1: 故事扩写
@@ -512,6 +570,7 @@ NPC标签：{npc_list_text}
         story = self._call_llm_api(prompt)
         return story.strip()
     
+    @stage("decomposition")
     def _decompose_gameplay(self, story: str, npc_tags: List[str] = None, thinking_result: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
         Layer 2: 玩法拆解
@@ -525,32 +584,31 @@ NPC标签：{npc_list_text}
             return []
         
         # 识别需要的功能模块
-        modules = self.kb.identify_required_modules(story, npc_tags)
+        modules = self.retrieval.identify_required_modules(story, npc_tags)
         
         # 检索相关函数文档
-        relevant_functions = self.kb.retrieve_functions(
+        relevant_functions = self.retrieval.retrieve_functions(
             modules=modules,
             query=story,
             top_k=40
         )
         
-        function_docs = self.kb.get_function_docs_text(relevant_functions)
-        
         # 使用thinking_result
         thinking_analysis = thinking_result.get("raw_analysis", "") if thinking_result else ""
-        reference_examples = thinking_result.get("reference_examples", "") if thinking_result else self.kb.get_reference_examples()
         
-        # 构建动画素材库文本
-        animations_text = "\n".join([f"- {anim}" for anim in ANIMATION_LIBRARY])
+        # 按优先级组装上下文：深度分析 > 函数文档
+        context = ContextAssembler("decomposition")
+        context.add("thinking_analysis", thinking_analysis, truncatable=True)
+        context.add_docs("function_docs", relevant_functions, self.retrieval)
+        parts = context.fit()
+        thinking_analysis = parts["thinking_analysis"]
+        function_docs = parts["function_docs"]
         
         prompt = f"""你是一个游戏玩法设计师。请将以下故事拆解为6-12个可执行的动作节点。
 
 深度需求分析：
 {thinking_analysis}
 
-参考文档示例（gameplay_document.md）：
-{reference_examples}
-
 故事：
 {story}
 
@@ -559,9 +617,6 @@ NPC标签：{', '.join(npc_tags) if npc_tags else 'Tag_A'}
 可用的API函数参考：
 {function_docs}
 
-**动画素材库（PlayAnim必须使用以下动画名称）**：
-{animations_text}
-
 每个动作节点必须对应一个API调用，例如：
 - NPC移动到指定位置
 - NPC面向玩家
@@ -578,10 +633,12 @@ NPC标签：{', '.join(npc_tags) if npc_tags else 'Tag_A'}
 - params: 参数说明
 - description: 动作描述"""
         
-        response = self._call_llm_api(prompt)
+        self._record_prompt(context, prompt)
+        response = self._call_llm_api(prompt, prefix=self._prompt_prefix())
         # 简化处理：返回文本，后续解析
         return [{"description": response}]  # 实际应该解析JSON
     
+    @stage("plan")
     def _build_execution_plan(self, gameplay_nodes: List[Dict[str, Any]], npc_tags: List[str] = None, thinking_result: Dict[str, Any] = None) -> str:
         """
         Layer 3: 执行计划
@@ -596,27 +653,21 @@ NPC标签：{', '.join(npc_tags) if npc_tags else 'Tag_A'}
         
         # 使用thinking_result
         thinking_analysis = thinking_result.get("raw_analysis", "") if thinking_result else ""
-        reference_examples = thinking_result.get("reference_examples", "") if thinking_result else self.kb.get_reference_examples()
         
-        # 构建动画素材库文本
-        animations_text = "\n".join([f"- {anim}" for anim in ANIMATION_LIBRARY])
+        context = ContextAssembler("plan")
+        context.add("thinking_analysis", thinking_analysis, truncatable=True)
+        thinking_analysis = context.fit()["thinking_analysis"]
         
         prompt = f"""你是一个LUA脚本工程师。请将以下动作节点转化为详细的执行计划。
 
 深度需求分析：
 {thinking_analysis}
 
-参考文档示例（gameplay_document.md）：
-{reference_examples}
-
 动作节点：
 {gameplay_nodes}
 
 NPC标签：{', '.join(npc_tags) if npc_tags else 'Tag_A'}
 
-**动画素材库（PlayAnim必须使用以下动画名称）**：
-{animations_text}
-
 请制定执行计划，包括：
 1. 获取player与NPC actor（使用World.GetByID）
 2. 判空检查（IsValid）
@@ -632,9 +683,11 @@ NPC标签：{', '.join(npc_tags) if npc_tags else 'Tag_A'}
 
 请输出详细的执行步骤。"""
         
-        plan = self._call_llm_api(prompt)
+        self._record_prompt(context, prompt)
+        plan = self._call_llm_api(prompt, prefix=self._prompt_prefix())
         return plan.strip()
     
+    @stage("code")
     def _generate_lua_code(self, user_input: str, story: str, execution_plan: str, npc_tags: List[str] = None, thinking_result: Dict[str, Any] = None) -> str:
         """
         Layer 4: Lua代码生成
@@ -664,25 +717,26 @@ NPC标签：{', '.join(npc_tags) if npc_tags else 'Tag_A'}
         npc_map = npc_map.rstrip(",\n") + "\n    }"
         
         # 检索相关函数文档
-        modules = self.kb.identify_required_modules(user_input + " " + story, npc_tags)
-        relevant_functions = self.kb.retrieve_functions(
+        modules = self.retrieval.identify_required_modules(user_input + " " + story, npc_tags)
+        relevant_functions = self.retrieval.retrieve_functions(
             modules=modules,
             query=user_input + " " + story,
             top_k=50
         )
-        function_docs = self.kb.get_function_docs_text(relevant_functions)
-        
-        # 获取参考文档中的示例代码（gameplay_document.md）
-        reference_examples = self.kb.get_reference_examples()
-        
-        # 构建动画素材库文本
-        animations_text = "\n".join([f"- {anim}" for anim in ANIMATION_LIBRARY])
         
         # 从thinking_result获取深度分析
         thinking_analysis = thinking_result.get("raw_analysis", "") if thinking_result else ""
-        reference_examples = thinking_result.get("reference_examples", reference_examples) if thinking_result else reference_examples
         structured_input = thinking_result.get("structured_input", {}) if thinking_result else {}
         
+        # 按优先级组装上下文：函数文档 > 深度分析
+        # （参考文档示例、Few-Shot示例和动画素材库位于静态前缀中）
+        context = ContextAssembler("code")
+        context.add_docs("function_docs", relevant_functions, self.retrieval)
+        context.add("thinking_analysis", thinking_analysis, truncatable=True)
+        parts = context.fit()
+        function_docs = parts["function_docs"]
+        thinking_analysis = parts["thinking_analysis"]
+        
         # 如果检测到结构化输入，使用专门的生成提示
         is_structured = structured_input.get("is_structured", False)
         
@@ -722,18 +776,9 @@ NPC映射：{npc_mapping}
 结构化输入解析：
 {structured_desc}
 
-参考文档示例（gameplay_document.md）：
-{reference_examples}
-
-**Few-Shot完整示例（必须严格遵循此格式）**：
-{FEW_SHOT_EXAMPLE}
-
 可用的API函数参考：
 {function_docs}
 
-**动画素材库（PlayAnim必须使用以下动画名称）**：
-{animations_text}
-
 **关键要求（优先级从高到低）**：
 
 **优先级1：语法正确性（最高优先级，必须严格遵守）**：
@@ -830,12 +875,6 @@ UI.Toast("游戏开始")
 
 **重要：必须严格遵循 gameplay_document.md 中的示例格式和写法**
 
-参考文档示例（gameplay_document.md）：
-{reference_examples}
-
-**Few-Shot完整示例（必须严格遵循此格式）**：
-{FEW_SHOT_EXAMPLE}
-
 深度需求分析：
 {thinking_analysis}
 
@@ -854,9 +893,6 @@ NPC映射：
 可用的API函数参考：
 {function_docs}
 
-**动画素材库（PlayAnim必须使用以下动画名称）**：
-{animations_text}
-
 **重要约束（必须严格遵守Few-Shot示例格式）**：
 1. 输出格式必须严格遵循Few-Shot示例：
 local function ResolveEncounterLoc()
@@ -971,7 +1007,8 @@ World.StartGame()
 Time.Resume()
 UI.Toast("游戏开始")"""
         
-        lua_code = self._call_llm_api(prompt)
+        self._record_prompt(context, prompt)
+        lua_code = self._call_llm_api(prompt, stream=True, prefix=self._prompt_prefix())
         
         # 提取纯LUA代码（移除可能的说明文字）
         lua_code = self._extract_lua_code(lua_code)
@@ -979,11 +1016,8 @@ UI.Toast("游戏开始")"""
         # 清理代码：移除注释
         lua_code = self._remove_comments(lua_code)
         
-        # 优先级1：修正语法错误（最高优先级）
-        lua_code = self._fix_syntax_errors(lua_code, npc_tags)
-        
-        # 优先级2：修正其他代码问题（玩家对话、动画名称等）
-        lua_code = self._fix_code_issues(lua_code)
+        # 本地修复：SpawnEncounter参数、玩家对话、动画名称、防重复触发、System.Exit等
+        lua_code = self._repair_code(lua_code, npc_tags)
         
         return lua_code.strip()
     
@@ -1142,38 +1176,15 @@ UI.Toast("游戏开始")"""
         return code.strip()
     
     def _remove_comments(self, code: str) -> str:
-        """移除Lua代码中的注释"""
-        lines = code.split('\n')
-        cleaned_lines = []
-        in_multiline = False
-        
-        for line in lines:
-            # 处理多行注释
-            if '--[[' in line:
-                in_multiline = True
-                continue
-            if ']]' in line and in_multiline:
-                in_multiline = False
-                continue
-            if in_multiline:
-                continue
-            
-            # 移除单行注释
-            if '--' in line:
-                # 检查是否是字符串中的--
-                comment_pos = line.find('--')
-                if comment_pos > 0:
-                    # 检查前面是否有未闭合的字符串
-                    before_comment = line[:comment_pos]
-                    single_quotes = before_comment.count("'") - before_comment.count("\\'")
-                    double_quotes = before_comment.count('"') - before_comment.count('\\"')
-                    if single_quotes % 2 == 0 and double_quotes % 2 == 0:
-                        line = line[:comment_pos].rstrip()
-            
-            cleaned_lines.append(line)
-        
-        return '\n'.join(cleaned_lines)
+        """移除Lua代码中的注释（包括 [[ ... ]] 代码块内的注释）"""
+        try:
+            return strip_comments(code, long_strings=True)
+        except LuaSyntaxError as e:
+            # 词法错误的代码无法确定字符串边界，保持原样（校验时会作为语法错误处理）
+            print(f"[WARN] 跳过注释移除: {e}")
+            return code
     
+    @timed("regex_fix")
     def _fix_code_issues(self, code: str) -> str:
         """
         修正代码问题：
@@ -1181,99 +1192,7 @@ UI.Toast("游戏开始")"""
         2. 修正动画名称，确保使用素材库中的名称
         3. 移除对话内容中的方括号（如 "[文本]" -> "文本"）
         """
-        lines = code.split('\n')
-        fixed_lines = []
-        
-        for line in lines:
-            # 修正玩家对话：player:ApproachAndSay -> UI.ShowDialogue
-            # 匹配模式：player:ApproachAndSay(...) 或 player:ApproachAndSay(...)
-            player_approach_pattern = r'player:ApproachAndSay\s*\(([^)]+)\)'
-            match = re.search(player_approach_pattern, line)
-            if match:
-                # 提取参数
-                params = match.group(1)
-                # 解析参数（假设格式为：npc, "text"）
-                params_parts = [p.strip().strip('"\'') for p in params.split(',')]
-                if len(params_parts) >= 2:
-                    # 转换为UI.ShowDialogue("Player", "text")
-                    text = params_parts[-1].strip('"\'')
-                    new_line = re.sub(
-                        player_approach_pattern,
-                        f'UI.ShowDialogue("Player", "{text}")',
-                        line
-                    )
-                    line = new_line
-            
-            # 修正对话内容中的方括号：移除字符串中的方括号
-            # 匹配模式：ApproachAndSay(..., "[文本]") 或 ShowDialogue("名称", "[文本]")
-            # 处理 ApproachAndSay - 匹配第二个参数中的方括号
-            approach_pattern = r'(ApproachAndSay\s*\([^,]+,\s*)"\[([^\]]+)\]"'
-            line = re.sub(approach_pattern, r'\1"\2"', line)
-            
-            # 处理 ShowDialogue - 匹配第二个参数中的方括号
-            showdialogue_pattern = r'(ShowDialogue\s*\([^,]+,\s*)"\[([^\]]+)\]"'
-            line = re.sub(showdialogue_pattern, r'\1"\2"', line)
-            
-            # 处理更复杂的情况：可能有多层引号或嵌套
-            # 匹配任何函数调用中第二个字符串参数的方括号
-            # 通用模式：函数名(参数1, "[文本]")
-            general_bracket_pattern = r'(\w+\([^,]+,\s*)"\[([^\]]+)\]"'
-            line = re.sub(general_bracket_pattern, r'\1"\2"', line)
-            
-            # 处理变量名的情况（如 alice:ApproachAndSay）
-            variable_approach_pattern = r'(\w+:\s*ApproachAndSay\s*\([^,]+,\s*)"\[([^\]]+)\]"'
-            line = re.sub(variable_approach_pattern, r'\1"\2"', line)
-            
-            # 修正动画名称：检查PlayAnim中的动画名称是否在素材库中
-            playanim_pattern = r'PlayAnim\s*\(\s*"([^"]+)"\s*\)'
-            anim_match = re.search(playanim_pattern, line)
-            if anim_match:
-                anim_name = anim_match.group(1)
-                # 检查是否在素材库中
-                if anim_name not in ANIMATION_LIBRARY:
-                    # 尝试映射常见错误
-                    anim_mapping = {
-                        "Alice_Wave": "Wave",
-                        "Boss_Happy": "Happy",
-                        "Alice_Angry": "Frustrated",
-                        "Alice_Drink": "Drink",
-                        "Alice_Stun": "Scared",
-                        "Alice_Sleep": "Sleep",
-                        "Alice_Shy": "Shy",
-                        "Uncle_Happy": "Happy",
-                        "Angry": "Frustrated",
-                        "Sad": "Frustrated",
-                        "Cry": "Frustrated",
-                    }
-                    
-                    # 尝试直接匹配（移除前缀）
-                    for wrong_anim, correct_anim in anim_mapping.items():
-                        if wrong_anim in anim_name or anim_name.endswith(wrong_anim.split('_')[-1]):
-                            line = line.replace(f'"{anim_name}"', f'"{correct_anim}"')
-                            break
-                    else:
-                        # 如果无法映射，尝试从名称中提取关键词
-                        anim_lower = anim_name.lower()
-                        if 'wave' in anim_lower or '挥手' in anim_lower:
-                            line = line.replace(f'"{anim_name}"', '"Wave"')
-                        elif 'happy' in anim_lower or '开心' in anim_lower:
-                            line = line.replace(f'"{anim_name}"', '"Happy"')
-                        elif 'shy' in anim_lower or '害羞' in anim_lower:
-                            line = line.replace(f'"{anim_name}"', '"Shy"')
-                        elif 'scared' in anim_lower or '恐惧' in anim_lower or 'stun' in anim_lower:
-                            line = line.replace(f'"{anim_name}"', '"Scared"')
-                        elif 'drink' in anim_lower or '喝' in anim_lower:
-                            line = line.replace(f'"{anim_name}"', '"Drink"')
-                        elif 'sleep' in anim_lower or '睡' in anim_lower:
-                            line = line.replace(f'"{anim_name}"', '"Sleep"')
-                        elif 'frustrated' in anim_lower or 'angry' in anim_lower or '沮丧' in anim_lower or '生气' in anim_lower:
-                            line = line.replace(f'"{anim_name}"', '"Frustrated"')
-                        elif 'dialogue' in anim_lower or '说话' in anim_lower:
-                            line = line.replace(f'"{anim_name}"', '"Dialogue"')
-            
-            fixed_lines.append(line)
-        
-        return '\n'.join(fixed_lines)
+        return _postprocessor.fix_code_issues(code)
     
     def _planning_agent(self, user_input: str, npc_tags: List[str] = None) -> Dict[str, Any]:
         """规划Agent：分析需求，制定生成计划（已废弃，使用_standard_generate）"""
@@ -1303,32 +1222,24 @@ UI.Toast("游戏开始")"""
             thinking_result
         )
     
+    @stage("refine")
     def _refine_code(self, user_input: str, current_code: str, npc_tags: List[str] = None) -> str:
         """优化代码"""
-        modules = self.kb.identify_required_modules(user_input, npc_tags)
-        relevant_functions = self.kb.retrieve_functions(
+        modules = self.retrieval.identify_required_modules(user_input, npc_tags)
+        relevant_functions = self.retrieval.retrieve_functions(
             modules=modules,
             query=user_input,
             top_k=30
         )
-        function_docs = self.kb.get_function_docs_text(relevant_functions)
         
-        # 获取参考文档中的示例代码（gameplay_document.md）
-        reference_examples = self.kb.get_reference_examples()
-        
-        # 构建动画素材库文本
-        animations_text = "\n".join([f"- {anim}" for anim in ANIMATION_LIBRARY])
+        context = ContextAssembler("refine")
+        context.add_docs("function_docs", relevant_functions, self.retrieval)
+        function_docs = context.fit()["function_docs"]
         
         prompt = f"""优化以下LUA奇遇代码，使其更符合用户需求。
 
 **重要：必须严格遵循 gameplay_document.md 中的示例格式和写法**
 
-参考文档示例（gameplay_document.md）：
-{reference_examples}
-
-**Few-Shot完整示例（必须严格遵循此格式）**：
-{FEW_SHOT_EXAMPLE}
-
 用户需求：
 {user_input}
 
@@ -1340,9 +1251,6 @@ UI.Toast("游戏开始")"""
 可用的API函数参考：
 {function_docs}
 
-**动画素材库（PlayAnim必须使用以下动画名称）**：
-{animations_text}
-
 请检查并优化：
 1. **是否严格遵循gameplay_document.md中的示例格式**（最重要！）
 2. 是否完全满足用户需求
@@ -1363,7 +1271,8 @@ UI.Toast("游戏开始")"""
 - 直接输出代码，从 `local function ResolveEncounterLoc()` 开始，到 `UI.Toast("游戏开始")` 结束
 - 必须包含完整的格式：ResolveEncounterLoc函数、SpawnEncounter_XXX函数、函数调用、初始化代码"""
         
-        refined_code = self._call_llm_api(prompt)
+        self._record_prompt(context, prompt)
+        refined_code = self._call_llm_api(prompt, prefix=self._prompt_prefix())
         # 提取纯LUA代码
         refined_code = self._extract_lua_code(refined_code)
         refined_code = self._remove_comments(refined_code)
@@ -1376,173 +1285,85 @@ UI.Toast("游戏开始")"""
         验证奇遇代码质量
         优先级：语法正确性 > 功能完整性
         """
-        # 优先级1：语法验证（最高优先级）
-        
-        # 1. 检查World.SpawnEncounter的基本结构
-        if 'World.SpawnEncounter' not in code:
-            return False
-        
-        # 2. 检查World.SpawnEncounter的参数格式
-        spawn_pattern = r'World\.SpawnEncounter\s*\(\s*\{X=\d+,\s*Y=\d+,\s*Z=\d+\}\s*,\s*(\d+)\s*,\s*(\{[^}]*\})\s*,\s*"EnterVolume"'
-        match = re.search(spawn_pattern, code)
-        if not match:
-            return False
-        
-        # 3. 检查range参数（第2个参数）必须是数字，且不能太小
-        range_value = match.group(1)
-        try:
-            range_num = int(range_value)
-            if range_num < 100:  # 范围不能太小，至少100
-                return False
-        except ValueError:
-            return False
-        
-        # 4. 检查npcData参数（第3个参数）不能为空字典
-        npc_data = match.group(2)
-        # 检查是否包含至少一个NPC映射
-        if not re.search(r'\["[^"]+"\]\s*=\s*"[^"]+"', npc_data):
-            return False
-        
-        # 5. 检查代码块格式（第5个参数）必须使用 [[ ... ]]
-        code_block_pattern = r'\[\[.*?\]\]'
-        if not re.search(code_block_pattern, code, re.DOTALL):
-            return False
-        
-        # 优先级2：功能验证（如果语法正确，再检查功能）
-        
-        # 检查必需的元素（但如果没有也不强制，因为用户可能只要求简单场景）
-        if 'World.GetByID' not in code:
-            return False
-        
-        # 检查玩家对话：不应该有player:ApproachAndSay
-        if 'player:ApproachAndSay' in code or 'Player:ApproachAndSay' in code:
-            return False
-        
-        # 检查对话内容：不应该有方括号包裹的对话内容
-        bracket_patterns = [
-            r'ApproachAndSay\s*\([^,]+,\s*"\[[^\]]+\]"',
-            r'ShowDialogue\s*\([^,]+,\s*"\[[^\]]+\]"'
-        ]
-        for pattern in bracket_patterns:
-            if re.search(pattern, code):
-                return False
-        
-        # 检查动画名称：所有PlayAnim的动画名称应该在素材库中
-        playanim_pattern = r'PlayAnim\s*\(\s*"([^"]+)"\s*\)'
-        anim_matches = re.findall(playanim_pattern, code)
-        for anim_name in anim_matches:
-            if anim_name not in ANIMATION_LIBRARY:
-                # 允许一些常见映射，但最好都使用素材库
-                if anim_name not in ["Wave", "Happy", "Shy", "Scared", "Drink", "Sleep", "Dialogue", "Frustrated"]:
-                    return False
-        
-        return True
+        return self._analyze_code(code).encounter_valid
+    
+    def _analyze_code(self, code: str) -> EncounterAnalysis:
+        """
+        解析并检查代码（同一段代码只解析一次，两个验证方法共用结果）
+        """
+        if self._analysis is None or self._analysis.source != code:
+            with timed("analysis"):
+                self._analysis = analyze_encounter(code, ANIMATION_LIBRARY)
+        return self._analysis
     
+    @timed("regex_fix")
     def _fix_syntax_errors(self, code: str, npc_tags: List[str] = None) -> str:
         """
         修正语法错误（最高优先级）
         确保World.SpawnEncounter的语法完全正确
         """
-        if not npc_tags:
-            npc_tags = ["Tag_A"]
-        
-        # 1. 修正range参数：如果太小或不是数字，改为450
-        range_pattern = r'World\.SpawnEncounter\s*\(\s*\{X=\d+,\s*Y=\d+,\s*Z=\d+\}\s*,\s*(\d+)\s*,'
-        match = re.search(range_pattern, code)
-        if match:
-            range_value = match.group(1)
-            try:
-                range_num = int(range_value)
-                if range_num < 100:
-                    # 替换为450
-                    code = re.sub(
-                        r'(World\.SpawnEncounter\s*\(\s*\{X=\d+,\s*Y=\d+,\s*Z=\d+\}\s*,\s*)\d+(\s*,)',
-                        r'\g<1>450\2',
-                        code,
-                        count=1
-                    )
-            except ValueError:
-                # 如果不是数字，替换为450
-                code = re.sub(
-                    r'(World\.SpawnEncounter\s*\(\s*\{X=\d+,\s*Y=\d+,\s*Z=\d+\}\s*,\s*)[^,]+(\s*,)',
-                    r'\g<1>450\2',
-                    code,
-                    count=1
-                )
-        
-        # 2. 修正npcData参数：如果为空字典，添加默认NPC
-        empty_npc_pattern = r'World\.SpawnEncounter\s*\(\s*\{X=\d+,\s*Y=\d+,\s*Z=\d+\}\s*,\s*\d+\s*,\s*\{\}\s*,'
-        if re.search(empty_npc_pattern, code):
-            # 构建NPC映射
-            npc_map = "{\n"
-            for tag in npc_tags:
-                npc_map += f'        ["{tag}"] = "NPC_Base",\n'
-            npc_map = npc_map.rstrip(",\n") + "\n    }"
-            
-            code = re.sub(
-                r'(World\.SpawnEncounter\s*\(\s*\{X=\d+,\s*Y=\d+,\s*Z=\d+\}\s*,\s*\d+\s*,\s*)\{\}(\s*,)',
-                rf'\g<1>{re.escape(npc_map)}\2',
-                code,
-                count=1
-            )
-        
-        # 3. 确保位置参数格式正确
-        pos_pattern = r'World\.SpawnEncounter\s*\(\s*\{X=([^,]+),\s*Y=([^,]+),\s*Z=([^}]+)\}'
-        if not re.search(pos_pattern, code):
-            # 如果位置参数格式不对，修正为 {X=0, Y=0, Z=0}
-            code = re.sub(
-                r'World\.SpawnEncounter\s*\(\s*[^,]+',
-                'World.SpawnEncounter(\n    {X=0, Y=0, Z=0}',
-                code,
-                count=1
-            )
-        
-        # 4. 确保类型参数是 "EnterVolume"
-        type_pattern = r'World\.SpawnEncounter\s*\([^,]+,[^,]+,[^,]+,\s*"([^"]+)"'
-        match = re.search(type_pattern, code)
-        if match and match.group(1) != "EnterVolume":
-            code = re.sub(
-                r'(World\.SpawnEncounter\s*\([^,]+,[^,]+,[^,]+,\s*)"[^"]+"',
-                r'\1"EnterVolume"',
-                code,
-                count=1
-            )
-        
-        return code
+        return _postprocessor.fix_syntax_errors(code, npc_tags)
     
+    @stage("validation")
     def _final_validation_and_fix(self, code: str, user_input: str, npc_tags: List[str] = None) -> str:
         """
         最终验证和修正阶段
         优先级：语法正确性 > 功能完整性
-        确保代码完全符合标准
+        先在本地修复可机械修复的问题，只有仍不通过时才使用LLM修正
         """
         max_iterations = 5  # 增加迭代次数以确保语法正确
         
         for iteration in range(max_iterations):
-            # 优先级1：修正语法错误
-            code = self._fix_syntax_errors(code, npc_tags)
-            
-            # 优先级2：修正其他代码问题
-            code = self._fix_code_issues(code)
+            code = self._repair_code(code, npc_tags)
             
-            # 验证语法（最高优先级）
-            if self._validate_encounter_code(code):
-                # 如果语法正确，再检查格式
-                if self._validate_reference_format(code):
-                    return code
+            # 验证语法（最高优先级），再检查格式
+            if self._validate_encounter_code(code) and self._validate_reference_format(code):
+                return code
             
-            # 如果还有问题，使用LLM修正（但优先保证语法正确）
+            # 如果还有问题，使用LLM修正（修正结果在下一轮开始时再次本地修复）
             if iteration < max_iterations - 1:
-                # 在修正前，先确保语法正确
-                code = self._fix_syntax_errors(code, npc_tags)
+                self._record_escalation(code)
                 code = self._refine_code(user_input, code, npc_tags)
-                # 修正后再次确保语法正确
-                code = self._fix_syntax_errors(code, npc_tags)
         
-        # 最后一次确保语法正确
-        code = self._fix_syntax_issues(code, npc_tags)
         return code
     
+    @timed("repair")
+    def _repair_code(self, code: str, npc_tags: List[str] = None) -> str:
+        """
+        本地修复代码（不调用LLM）
+        代码可以解析时按AST规则修复；存在Lua语法错误时回退到正则修正
+        """
+        analysis = self._analyze_code(code)
+        if analysis.chunk is None:
+            code = self._fix_syntax_errors(code, npc_tags)
+            return self._fix_code_issues(code)
+        
+        result = _repairer.repair(code, npc_tags, analysis)
+        if not result.applied:
+            return code
+        
+        # 修复前不通过、修复后通过：省去了一次LLM优化
+        avoided = not result.before.valid and result.after.valid
+        get_repair_stats().record_repair(result.applied, avoided)
+        rules = self.repair_report["rules"]
+        for rule, count in result.applied.items():
+            rules[rule] = rules.get(rule, 0) + count
+        self.repair_report["llmCallsAvoided"] += int(avoided)
+        
+        summary = ", ".join(f"{rule} x{count}" for rule, count in result.applied.items())
+        print(f"[INFO] 本地修复: {summary}" + ("（无需LLM优化）" if avoided else ""))
+        self._analysis = result.after
+        return result.code
+    
+    def _record_escalation(self, code: str):
+        """记录交给LLM优化的问题类型"""
+        issues = self._analyze_code(code).issues
+        for issue in issues:
+            print(f"[INFO] 代码检查[{issue.code}]: {issue.message}")
+        codes = sorted({issue.code for issue in issues})
+        self.repair_report["escalations"].append(codes)
+        get_repair_stats().record_escalation(codes)
+    
     def _fix_syntax_issues(self, code: str, npc_tags: List[str] = None) -> str:
         """修正语法问题的别名方法"""
         return self._fix_syntax_errors(code, npc_tags)
@@ -1551,99 +1372,61 @@ UI.Toast("游戏开始")"""
         """
         验证代码是否严格遵循gameplay_document.md的格式
         """
-        reference_examples = self.kb.get_reference_examples()
-        
-        # 检查关键模式
-        checks = []
-        
-        # 1. 检查World.SpawnEncounter格式
-        spawn_pattern = r'World\.SpawnEncounter\s*\(\s*\{X=\d+,\s*Y=\d+,\s*Z=\d+\}'
-        checks.append(bool(re.search(spawn_pattern, code)))
-        
-        # 2. 检查ApproachAndSay格式（不能有方括号）
-        approach_with_brackets = r'ApproachAndSay\s*\([^,]+,\s*"\[[^\]]+\]"'
-        checks.append(not bool(re.search(approach_with_brackets, code)))
-        
-        # 3. 检查ShowDialogue格式（不能有方括号）
-        dialogue_with_brackets = r'ShowDialogue\s*\([^,]+,\s*"\[[^\]]+\]"'
-        checks.append(not bool(re.search(dialogue_with_brackets, code)))
-        
-        # 4. 检查PlayAnim是否使用素材库动画
-        playanim_pattern = r'PlayAnim\s*\(\s*"([^"]+)"'
-        anim_matches = re.findall(playanim_pattern, code)
-        anim_checks = [anim in ANIMATION_LIBRARY for anim in anim_matches]
-        checks.append(all(anim_checks) if anim_matches else True)
-        
-        # 5. 检查玩家对话（不能使用player:ApproachAndSay）
-        player_approach = r'player:ApproachAndSay|Player:ApproachAndSay'
-        checks.append(not bool(re.search(player_approach, code)))
-        
-        # 6. 检查代码块格式（必须使用[[ ... ]]）
-        code_block_pattern = r'\[\[.*?\]\]'
-        checks.append(bool(re.search(code_block_pattern, code, re.DOTALL)))
-        
-        # 7. 检查是否有注释（代码块内不能有注释）
-        # 注意：这里只检查代码块内的注释
-        code_block_match = re.search(r'\[\[(.*?)\]\]', code, re.DOTALL)
-        if code_block_match:
-            code_content = code_block_match.group(1)
-            has_comments = '--' in code_content
-            checks.append(not has_comments)
-        
-        return all(checks)
+        return self._analyze_code(code).reference_valid
+    
+    def _record_prompt(self, context: ContextAssembler, prompt: str):
+        """记录最终提示词的token估算（各阶段都使用静态前缀）"""
+        context.finalize(prompt, self._prompt_prefix().tokens)
+        self.prompt_reports.append(context.report)
     
-    def _call_llm_api(self, prompt: str) -> str:
+    def _prompt_prefix(self) -> PromptPrefix:
+        """当前知识库版本的静态前缀（每个知识库实例只构建一次）"""
+        return get_prompt_prefix(self.kb, "encounter", build_encounter_prefix)
+    
+    def _call_llm_api(self, prompt: str, stream: bool = False, prefix: Optional[PromptPrefix] = None) -> str:
         """
         调用LLM API
         支持从环境变量或配置中获取API密钥
+        stream=True 且设置了progress时使用流式接口，增量文本通过progress.token()推送
+        prefix: 静态前缀（system消息），prompt为其后的可变部分；为None时只使用角色说明
         """
-        import openai
+        stream = stream and self.progress is not None
         
         # 优先使用配置中的API Key，否则使用环境变量
         api_key = self.config.get('apiKey') or os.getenv('OPENAI_API_KEY', '')
         
         if not api_key:
             # 如果没有配置API密钥，返回模拟响应
-            return self._mock_llm_response(prompt)
-        
-        # API配置
-        API_CONFIG = {
-            "gpt-4.1": {
-                "model": "gpt-4-turbo-preview",
-                "base_url": "https://api.openai.com/v1"
-            },
-            "gpt-5.1": {
-                "model": "gpt-4-turbo-preview",  # 实际使用时替换为GPT-5.1的模型名
-                "base_url": "https://api.openai.com/v1"
-            }
-        }
+            return self._stream_fallback(prompt) if stream else self._mock_llm_response(prompt)
         
         model_config = API_CONFIG.get(self.model, API_CONFIG['gpt-4.1'])
         
         try:
-            client = openai.OpenAI(
-                api_key=api_key,
-                base_url=model_config.get('base_url', 'https://api.openai.com/v1')
+            return chat_completion(
+                api_key,
+                model_config.get('base_url', 'https://api.openai.com/v1'),
+                {
+                    "model": model_config['model'],
+                    "messages": (prefix or PromptPrefix(SYSTEM_ROLE)).messages(prompt),
+                    "temperature": self.config.get('temperature', 0.7),
+                    "max_tokens": self.config.get('maxTokens', 4000),
+                    "top_p": self.config.get('topP', 0.9),
+                    "frequency_penalty": self.config.get('frequencyPenalty', 0.0),
+                    "presence_penalty": self.config.get('presencePenalty', 0.0)
+                },
+                on_token=self.progress.token if stream else None
             )
             
-            response = client.chat.completions.create(
-                model=model_config['model'],
-                messages=[
-                    {"role": "system", "content": "你是一个专业的LUA奇遇脚本生成专家，专门生成游戏Encounter脚本。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.config.get('temperature', 0.7),
-                max_tokens=self.config.get('maxTokens', 4000),
-                top_p=self.config.get('topP', 0.9),
-                frequency_penalty=self.config.get('frequencyPenalty', 0.0),
-                presence_penalty=self.config.get('presencePenalty', 0.0)
-            )
-            
-            return response.choices[0].message.content
-            
         except Exception as e:
             print(f"API调用错误: {e}")
-            return self._mock_llm_response(prompt)
+            return self._stream_fallback(prompt) if stream else self._mock_llm_response(prompt)
+    
+    def _stream_fallback(self, prompt: str) -> str:
+        """流式调用不可用时，丢弃已推送的部分输出并一次性推送模拟响应"""
+        response = self._mock_llm_response(prompt)
+        self.progress.emit("token_reset", {"stage": self.progress.current_stage})
+        self.progress.token(response)
+        return response
     
     def _mock_llm_response(self, prompt: str) -> str:
         """模拟LLM响应（用于测试）"""
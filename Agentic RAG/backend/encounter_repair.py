@@ -0,0 +1,303 @@
+"""
+奇遇代码的本地修复
+对 encounter_validation 检查出的问题按规则在AST节点上改写源码，能机械修复的问题不再交给LLM优化：
+- spawn_position / spawn_range / npc_data / spawn_type / code_block: World.SpawnEncounter 参数
+- code_comments: 移除代码块中的注释
+- player_approach / bracket_dialogue / animation: 玩家对话、对话方括号、动画名称
+- missing_exit / missing_guard: 代码块的 System.Exit() 和 _G.encX_done 防重复触发
+- missing_tail / spawn_not_called: 脚本末尾的 World.StartGame() / Time.Resume()、包装函数调用
+语法错误、缺少SpawnEncounter、未获取对象等语义问题无法机械修复，仍由LLM处理
+"""
+
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from encounter_validation import EncounterAnalysis, EncounterIssue, TAIL_CALLS, analyze_encounter
+from lua_parser import KEYWORDS, LuaSyntaxError, Node, call_name, dotted_name, strip_comments
+from lua_postprocess import DEFAULT_SPAWN_RANGE, LuaPostProcessor
+
+DEFAULT_POSITION = "{X=0, Y=0, Z=0}"
+DEFAULT_NPC_TEMPLATE = "Default"
+TAG_NPC_TEMPLATE = "NPC_Base"
+
+# 修复后重新检查的最大轮数（同一轮内位置重叠的修改留到下一轮）
+MAX_REPAIR_PASSES = 4
+
+
+class Edit(NamedTuple):
+    start: int
+    end: int
+    text: str
+
+
+class RepairResult(NamedTuple):
+    code: str
+    before: EncounterAnalysis        # 修复前的检查结果
+    after: EncounterAnalysis         # 修复后的检查结果
+    applied: Dict[str, int]          # 各规则的修复次数
+
+
+class EncounterRepairer:
+    """按问题类型执行修复规则，直到没有可修复的问题"""
+
+    def __init__(self, postprocessor: LuaPostProcessor, animation_library):
+        self.postprocessor = postprocessor
+        self.animation_library = frozenset(animation_library)
+        # 问题类型 -> 规则，按顺序执行（注释移除会改写整个代码块，最先执行）
+        self.rules: Dict[str, Callable[[EncounterAnalysis, EncounterIssue, List[str]], Optional[Edit]]] = {
+            "code_comments": self._strip_block_comments,
+            "spawn_position": self._fix_position,
+            "spawn_range": self._fix_range,
+            "npc_data": self._fix_npc_data,
+            "spawn_type": self._fix_type,
+            "code_block": self._fix_code_block,
+            "player_approach": self._fix_player_dialogue,
+            "bracket_dialogue": self._fix_bracket_dialogue,
+            "animation": self._fix_animation,
+            "missing_guard": self._add_guard,
+            "missing_exit": self._add_exit,
+            "missing_tail": self._add_tail,
+            "spawn_not_called": self._add_spawn_invocation,
+        }
+
+    def analyze(self, code: str) -> EncounterAnalysis:
+        return analyze_encounter(code, self.animation_library)
+
+    def repair(self, code: str, npc_tags: Optional[List[str]] = None,
+               analysis: Optional[EncounterAnalysis] = None) -> RepairResult:
+        """修复code中可机械修复的问题；analysis为code已有的检查结果"""
+        npc_tags = npc_tags or ["Tag_A"]
+        before = analysis if analysis is not None and analysis.source == code else self.analyze(code)
+        current = before
+        applied: Counter = Counter()
+
+        for _ in range(MAX_REPAIR_PASSES):
+            edits: List[Tuple[str, Edit]] = []
+            for rule, fix in self.rules.items():
+                for issue in current.issues:
+                    if issue.code != rule:
+                        continue
+                    edit = fix(current, issue, npc_tags)
+                    if edit is not None and not any(_overlaps(edit, other) for _, other in edits):
+                        edits.append((rule, edit))
+            if not edits:
+                break
+            code = _apply(code, [edit for _, edit in edits])
+            applied.update(rule for rule, _ in edits)
+            current = self.analyze(code)
+
+        return RepairResult(code, before, current, dict(applied))
+
+    # ---- World.SpawnEncounter 参数 ----
+
+    def _fix_position(self, analysis, issue, npc_tags):
+        return _replace(analysis, issue, issue.node, DEFAULT_POSITION)
+
+    def _fix_range(self, analysis, issue, npc_tags):
+        return _replace(analysis, issue, issue.node, DEFAULT_SPAWN_RANGE)
+
+    def _fix_npc_data(self, analysis, issue, npc_tags):
+        entries = []
+        if issue.node is not None and issue.node.kind == 'Table':
+            for key, value in issue.node.fields:
+                if key is None and value.kind == 'String':
+                    # 只列出了标签：{"Tag_A", "Tag_B"}
+                    entries.append((value.value, DEFAULT_NPC_TEMPLATE))
+                elif key is not None and key.kind == 'String':
+                    entries.append((key.value, value.value if value.kind == 'String' else DEFAULT_NPC_TEMPLATE))
+        if not entries:
+            entries = [(tag, TAG_NPC_TEMPLATE) for tag in npc_tags]
+
+        indent = _line_indent(analysis.source, issue.node.span[0]) if issue.node is not None else ""
+        items = ",\n".join(f"{indent}    {_table_key(key)} = {_quote(value)}" for key, value in entries)
+        return _replace(analysis, issue, issue.node, f"{{\n{items}\n{indent}}}")
+
+    def _fix_type(self, analysis, issue, npc_tags):
+        return _replace(analysis, issue, issue.node, _quote("EnterVolume"))
+
+    def _fix_code_block(self, analysis, issue, npc_tags):
+        node = issue.node
+        if node is None or node.kind != 'String' or ']]' in node.value or node.value.endswith(']'):
+            return None
+        return _replace(analysis, issue, node, f"[[\n{node.value}\n]]")
+
+    # ---- 代码块内容 ----
+
+    def _strip_block_comments(self, analysis, issue, npc_tags):
+        try:
+            stripped = strip_comments(analysis.code_block, long_strings=True)
+        except LuaSyntaxError:
+            return None
+        start = analysis.code_offset
+        return Edit(start, start + len(analysis.code_block), stripped)
+
+    def _fix_player_dialogue(self, analysis, issue, npc_tags):
+        node = issue.node
+        if not node.args:
+            return None
+        text = node.args[-1]
+        if text.kind == 'String':
+            text_source = _quote(_unbracket(text.value))
+        else:
+            text_source = _source(analysis, issue, text)
+        return _replace(analysis, issue, node, f'UI.ShowDialogue("Player", {text_source})')
+
+    def _fix_bracket_dialogue(self, analysis, issue, npc_tags):
+        return _replace(analysis, issue, issue.node, _quote(_unbracket(issue.node.value)))
+
+    def _fix_animation(self, analysis, issue, npc_tags):
+        resolved = self.postprocessor.resolve_animation(issue.node.value)
+        if resolved not in self.animation_library:
+            return None
+        return _replace(analysis, issue, issue.node, _quote(resolved))
+
+    def _add_guard(self, analysis, issue, npc_tags):
+        name = analysis.guard_name
+        check = f"if _G.{name} then return end"
+        assign = f"_G.{name} = true"
+        offset = analysis.code_offset
+        if analysis.guard_check is not None:
+            position = offset + analysis.guard_check.span[1]
+            return Edit(position, position, f"\n{assign}")
+        if analysis.guard_set is not None:
+            position = offset + analysis.guard_set.span[0]
+            return Edit(position, position, f"{check}\n")
+        return Edit(offset, offset, f"{check}\n{assign}\n\n")
+
+    def _add_exit(self, analysis, issue, npc_tags):
+        body = analysis.code_chunk.body
+        offset = analysis.code_offset
+        if not body:
+            return Edit(offset, offset, "System.Exit()\n")
+        last = body[-1]
+        if last.kind == 'Return':
+            # return必须是最后一条语句，System.Exit()插在它前面
+            position = offset + last.span[0]
+            return Edit(position, position, f"System.Exit()\n{_line_indent(analysis.code_block, last.span[0])}")
+        position = offset + last.span[1]
+        return Edit(position, position, "\n\nSystem.Exit()")
+
+    # ---- 脚本顶层 ----
+
+    def _add_tail(self, analysis, issue, npc_tags):
+        start_game, resume = (analysis.tail.get(name) for name in TAIL_CALLS)
+        if start_game is None and resume is None:
+            # 放在末尾的 UI.Toast("游戏开始") 之前
+            body = analysis.chunk.body
+            count = len(body)
+            while count and body[count - 1].kind == 'CallStat' and call_name(body[count - 1].call) == "UI.Toast":
+                count -= 1
+            if count:
+                position = body[count - 1].span[1]
+                return Edit(position, position, "\n\nWorld.StartGame()\nTime.Resume()")
+            position = body[0].span[0] if body else len(analysis.source)
+            return Edit(position, position, "World.StartGame()\nTime.Resume()\n\n")
+        # 另一个调用可能位于顶层调用的函数体中，按其所在行缩进
+        if start_game is None:
+            indent = _line_indent(analysis.source, resume.span[0])
+            return Edit(resume.span[0], resume.span[0], f"World.StartGame()\n{indent}")
+        indent = _line_indent(analysis.source, start_game.span[0])
+        return Edit(start_game.span[1], start_game.span[1], f"\n{indent}Time.Resume()")
+
+    def _add_spawn_invocation(self, analysis, issue, npc_tags):
+        wrapper = issue.node
+        name = wrapper.name if wrapper.kind == 'LocalFunction' else dotted_name(wrapper.target)
+        if not name:
+            return None
+        return Edit(wrapper.span[1], wrapper.span[1], f"\n\n{name}()")
+
+
+class RepairStats:
+    """进程内累计的本地修复统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.repairs = 0
+        self.rules: Counter = Counter()
+        self.llm_calls_avoided = 0
+        self.escalations: Counter = Counter()
+
+    def record_repair(self, applied: Dict[str, int], avoided: bool):
+        with self._lock:
+            self.repairs += 1
+            self.rules.update(applied)
+            self.llm_calls_avoided += int(avoided)
+
+    def record_escalation(self, issue_codes: List[str]):
+        with self._lock:
+            self.escalations.update(set(issue_codes))
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "repairs": self.repairs,
+                "rules": dict(self.rules),
+                "llmCallsAvoided": self.llm_calls_avoided,
+                "escalations": dict(self.escalations)
+            }
+
+
+_stats = RepairStats()
+
+
+def get_repair_stats() -> RepairStats:
+    return _stats
+
+
+def repair_stats() -> Dict[str, object]:
+    """返回各规则的累计修复次数、避免的LLM调用次数、交给LLM处理的问题类型"""
+    return _stats.stats()
+
+
+def _overlaps(a: Edit, b: Edit) -> bool:
+    if a.start == a.end or b.start == b.end:
+        # 插入与其他修改位置相同时也视为冲突，避免插入顺序不确定
+        return a.start <= b.end and b.start <= a.end
+    return a.start < b.end and b.start < a.end
+
+
+def _apply(code: str, edits: List[Edit]) -> str:
+    for edit in sorted(edits, key=lambda e: e.start, reverse=True):
+        code = code[:edit.start] + edit.text + code[edit.end:]
+    return code
+
+
+def _offset(analysis: EncounterAnalysis, issue: EncounterIssue) -> int:
+    return analysis.code_offset if issue.in_block else 0
+
+
+def _replace(analysis: EncounterAnalysis, issue: EncounterIssue, node: Optional[Node], text: str) -> Optional[Edit]:
+    if node is None or node.span is None:
+        return None
+    offset = _offset(analysis, issue)
+    return Edit(offset + node.span[0], offset + node.span[1], text)
+
+
+def _source(analysis: EncounterAnalysis, issue: EncounterIssue, node: Node) -> str:
+    text = analysis.code_block if issue.in_block else analysis.source
+    return text[node.span[0]:node.span[1]]
+
+
+def _line_indent(text: str, position: int) -> str:
+    line_start = text.rfind('\n', 0, position) + 1
+    line = text[line_start:position]
+    return line[:len(line) - len(line.lstrip(' \t'))]
+
+
+def _unbracket(text: str) -> str:
+    if text.startswith('[') and text.endswith(']') and len(text) > 2:
+        return text[1:-1]
+    return text
+
+
+def _quote(text: str) -> str:
+    escaped = text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+    return f'"{escaped}"'
+
+
+def _table_key(key: str) -> str:
+    if key.isidentifier() and key.isascii() and key not in KEYWORDS:
+        return key
+    return f"[{_quote(key)}]"
+
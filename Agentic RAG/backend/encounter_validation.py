@@ -0,0 +1,410 @@
+"""
+奇遇代码的结构校验
+基于 lua_parser 的AST，而不是对源码做正则匹配：
+- 找到 World.SpawnEncounter 调用，按作用域解析参数中的局部变量（loc、npcData、code），
+  Few-Shot示例的写法（ResolveEncounterLoc + 局部变量）与内联参数的写法都能识别
+- 第5个参数的 [[ ... ]] 代码块作为Lua代码再次解析，检查语法、注释、玩家对话、对话方括号、动画名称、
+  防重复触发（_G.encX_done）和 System.Exit()
+- 脚本顶层（含顶层调用的本脚本函数）是否执行 World.StartGame() / Time.Resume()，
+  以及包装函数 SpawnEncounter_XXX 是否被调用
+字符串和注释中出现的 "--"、"[文本]"、"player:ApproachAndSay" 不会误判；
+问题附带对应的AST节点，供 encounter_repair 按节点改写源码
+"""
+
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from lua_parser import LuaSyntaxError, Node, call_name, dotted_name, long_string_content, parse, tokenize
+
+SPAWN_FUNCTION = "World.SpawnEncounter"
+SPAWN_TYPE = "EnterVolume"
+MIN_SPAWN_RANGE = 100
+TAIL_CALLS = ("World.StartGame", "Time.Resume")
+
+# _validate_encounter_code 与 _validate_reference_format 分别关注的问题
+ENCOUNTER_CHECKS = frozenset((
+    "syntax", "missing_spawn", "spawn_args", "spawn_position", "spawn_range", "npc_data", "spawn_type",
+    "code_block", "code_syntax", "missing_get_by_id", "player_approach", "bracket_dialogue", "animation",
+    "missing_exit", "missing_guard", "missing_tail", "spawn_not_called"
+))
+REFERENCE_CHECKS = frozenset((
+    "syntax", "missing_spawn", "spawn_args", "spawn_position", "code_block", "code_syntax",
+    "code_comments", "player_approach", "bracket_dialogue", "animation"
+))
+
+_BRACKETED = re.compile(r'\[[^\]\n]+\]')
+_GUARD_PREFIX = re.compile(r'^(enc\d+)_')
+_DIALOGUE_METHODS = ("ApproachAndSay", "ShowDialogue")
+_PLAYER_NAMES = ("player", "Player")
+
+
+class EncounterIssue(NamedTuple):
+    code: str                    # 问题类型（见 ENCOUNTER_CHECKS / REFERENCE_CHECKS）
+    message: str
+    line: int = 0                # in_block时为代码块内的行号
+    node: Optional[Node] = None  # 问题对应的节点
+    in_block: bool = False       # node是否位于代码块内（span相对代码块内容）
+
+
+class SpawnCall(NamedTuple):
+    call: Node
+    env: Dict[str, Optional[Node]]  # 调用处可见的局部变量 -> 赋值表达式
+
+
+class EncounterAnalysis:
+    """一段奇遇代码的解析结果和发现的问题"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.chunk: Optional[Node] = None
+        self.spawns: List[SpawnCall] = []
+        self.npc_keys: List[str] = []
+        self.code_block: Optional[str] = None    # 第5个参数的代码块内容
+        self.code_offset = 0                     # 代码块内容在源码中的起始位置
+        self.code_chunk: Optional[Node] = None   # 代码块的AST
+        self.guard_check: Optional[Node] = None  # if _G.encX_done then return end
+        self.guard_set: Optional[Node] = None    # _G.encX_done = true
+        self.guard_name: Optional[str] = None
+        self.tail: Dict[str, Optional[Node]] = {}
+        self.issues: List[EncounterIssue] = []
+
+    def add(self, code: str, message: str, line: int = 0, node: Optional[Node] = None, in_block: bool = False):
+        self.issues.append(EncounterIssue(code, message, line, node, in_block))
+
+    def problems(self, checks: Iterable[str]) -> List[EncounterIssue]:
+        """返回属于checks的问题"""
+        checks = frozenset(checks)
+        return [issue for issue in self.issues if issue.code in checks]
+
+    @property
+    def encounter_valid(self) -> bool:
+        return not self.problems(ENCOUNTER_CHECKS)
+
+    @property
+    def reference_valid(self) -> bool:
+        return not self.problems(REFERENCE_CHECKS)
+
+    @property
+    def valid(self) -> bool:
+        return self.encounter_valid and self.reference_valid
+
+
+def analyze_encounter(source: str, animation_library: Iterable[str]) -> EncounterAnalysis:
+    """解析并检查奇遇代码"""
+    analysis = EncounterAnalysis(source)
+    try:
+        analysis.chunk = parse(source)
+    except LuaSyntaxError as e:
+        analysis.add("syntax", f"Lua语法错误: {e}", e.line)
+        return analysis
+
+    animation_library = frozenset(animation_library)
+    analysis.spawns = list(_find_calls(analysis.chunk.body, {}, SPAWN_FUNCTION))
+    if not analysis.spawns:
+        analysis.add("missing_spawn", f"缺少 {SPAWN_FUNCTION} 调用")
+    for spawn in analysis.spawns:
+        _check_spawn(analysis, spawn)
+    _check_script(analysis)
+
+    get_by_id = _check_calls(analysis, analysis.chunk, animation_library, False)
+    if analysis.code_chunk is not None:
+        get_by_id |= _check_calls(analysis, analysis.code_chunk, animation_library, True)
+        if not get_by_id:
+            analysis.add("missing_get_by_id", "代码块中没有使用 World.GetByID 获取对象")
+        _check_code_flow(analysis)
+    return analysis
+
+
+def resolve(node: Optional[Node], env: Dict[str, Optional[Node]], depth: int = 0) -> Optional[Node]:
+    """将局部变量名解析为其赋值表达式（多层赋值时逐层解析），括号表达式取其内部"""
+    while node is not None and depth < 16:
+        if node.kind == 'Paren':
+            node = node.expr
+        elif node.kind == 'Name' and node.name in env:
+            node = env[node.name]
+        else:
+            break
+        depth += 1
+    return node
+
+
+def guard_name_of(node: Optional[Node]) -> Optional[str]:
+    """_G.encX_done -> "encX_done"，其他表达式（包括不以 _done 结尾的全局变量）返回None"""
+    if node is not None and node.kind == 'Index' and node.key.kind == 'String' \
+            and node.key.value.endswith('_done') and node.obj.kind == 'Name' and node.obj.name == '_G':
+        return node.key.value
+    return None
+
+
+def default_guard_name(analysis: EncounterAnalysis) -> str:
+    """按npcData中的键（如 enc0_Alice）推断防重复触发变量名，默认 enc0_done"""
+    for key in analysis.npc_keys:
+        match = _GUARD_PREFIX.match(key)
+        if match:
+            return f"{match.group(1)}_done"
+    return "enc0_done"
+
+
+def _check_spawn(analysis: EncounterAnalysis, spawn: SpawnCall):
+    call, env = spawn
+    args = call.args
+    if len(args) < 5:
+        analysis.add("spawn_args", f"{SPAWN_FUNCTION} 需要5个参数，实际为{len(args)}个", call.line, call)
+
+    if args and not _is_location(args[0], env):
+        analysis.add("spawn_position", "第1个参数应为 {X=数值, Y=数值, Z=数值} 或 ResolveEncounterLoc() 返回的位置",
+                     call.line, args[0])
+
+    if len(args) > 1:
+        spawn_range = resolve(args[1], env)
+        if spawn_range is None or spawn_range.kind != 'Number':
+            analysis.add("spawn_range", "第2个参数（范围）应为数字", call.line, args[1])
+        elif spawn_range.value < MIN_SPAWN_RANGE:
+            analysis.add("spawn_range", f"第2个参数（范围）{spawn_range.value} 小于 {MIN_SPAWN_RANGE}",
+                         call.line, spawn_range)
+
+    if len(args) > 2:
+        npc_data = resolve(args[2], env)
+        if npc_data is not None and npc_data.kind == 'Table':
+            analysis.npc_keys = [key.value for key, _ in npc_data.fields if key is not None and key.kind == 'String']
+        if not _is_npc_data(npc_data):
+            analysis.add("npc_data", "第3个参数（npcData）应为至少包含一个 NPC标签 = \"模板\" 的表", call.line,
+                         npc_data if npc_data is not None and npc_data.kind == 'Table' else args[2])
+
+    if len(args) > 3:
+        spawn_type = resolve(args[3], env)
+        if spawn_type is None or spawn_type.kind != 'String' or spawn_type.value != SPAWN_TYPE:
+            analysis.add("spawn_type", f"第4个参数（类型）应为 \"{SPAWN_TYPE}\"", call.line,
+                         spawn_type if spawn_type is not None and spawn_type.kind == 'String' else args[3])
+
+    if len(args) > 4:
+        block = resolve(args[4], env)
+        if block is None or block.kind != 'String' or not block.long:
+            analysis.add("code_block", "第5个参数应为 [[ ... ]] 代码块", call.line,
+                         block if block is not None and block.kind == 'String' else args[4])
+        elif analysis.code_block is None:
+            _check_code_block(analysis, block)
+
+
+def _check_code_block(analysis: EncounterAnalysis, block: Node):
+    analysis.code_block = block.value
+    analysis.code_offset = long_string_content(analysis.source, block.span)[0]
+    try:
+        _, comments = tokenize(block.value)
+        if comments:
+            analysis.add("code_comments", f"代码块中包含{len(comments)}处注释（引擎不支持）", comments[0].line,
+                         in_block=True)
+        analysis.code_chunk = parse(block.value)
+    except LuaSyntaxError as e:
+        analysis.add("code_syntax", f"代码块Lua语法错误: {e}", e.line, in_block=True)
+
+
+def _check_script(analysis: EncounterAnalysis):
+    """脚本顶层：包装函数是否被调用、末尾的 World.StartGame() / Time.Resume()"""
+    body = analysis.chunk.body
+    tail_calls = _executed_tail_calls(body)
+    analysis.tail = {name: tail_calls.get(name) for name in TAIL_CALLS}
+    missing = [name for name, stmt in analysis.tail.items() if stmt is None]
+    if missing:
+        analysis.add("missing_tail", f"脚本末尾缺少 {', '.join(name + '()' for name in missing)}")
+
+    for spawn in analysis.spawns:
+        wrapper = next((stmt for stmt in body if stmt.kind in ('Function', 'LocalFunction')
+                        and any(node is spawn.call for node in stmt.walk())), None)
+        if wrapper is None:
+            continue
+        name = _function_name(wrapper)
+        called = any(
+            node.kind == 'Call' and call_name(node) == name
+            for stmt in body if stmt is not wrapper for node in stmt.walk()
+        )
+        if name and not called:
+            analysis.add("spawn_not_called", f"函数 {name} 定义后没有被调用", wrapper.line, wrapper)
+
+
+def _function_name(stmt: Node) -> Optional[str]:
+    return stmt.name if stmt.kind == 'LocalFunction' else dotted_name(stmt.target)
+
+
+def _executed_tail_calls(body: List[Node]) -> Dict[str, Node]:
+    """
+    脚本执行到的 World.StartGame() / Time.Resume() 调用语句：顶层语句中的调用，
+    以及顶层调用的本脚本函数（如 local function Start() ... end Start()）函数体中的调用（逐层解析）
+    """
+    functions = {}
+    for stmt in body:
+        if stmt.kind in ('Function', 'LocalFunction'):
+            functions.setdefault(_function_name(stmt), stmt)
+
+    found: Dict[str, Node] = {}
+    visited = set()
+    # 函数定义本身不执行，只有被调用时才展开其函数体（顶层语句优先）
+    pending = [stmt for stmt in body if stmt.kind not in ('Function', 'LocalFunction')]
+    for stmt in pending:
+        for node in stmt.walk():
+            if node.kind == 'CallStat' and call_name(node.call) in TAIL_CALLS:
+                found.setdefault(call_name(node.call), node)
+            elif node.kind == 'Call':
+                func = functions.get(call_name(node))
+                if func is not None and id(func) not in visited:
+                    visited.add(id(func))
+                    pending.extend(func.func.body)
+    return found
+
+
+def _check_code_flow(analysis: EncounterAnalysis):
+    """代码块顶层：防重复触发的 _G.encX_done 检查和赋值、System.Exit()"""
+    checks, sets = {}, {}
+    for stmt in analysis.code_chunk.body:
+        if stmt.kind == 'If' and len(stmt.clauses) == 1 and stmt.orelse is None:
+            test, body = stmt.clauses[0]
+            name = guard_name_of(test)
+            if name and len(body) == 1 and body[0].kind == 'Return':
+                checks.setdefault(name, stmt)
+        elif stmt.kind == 'Assign' and len(stmt.targets) == 1 and stmt.values and stmt.values[0].kind == 'True':
+            name = guard_name_of(stmt.targets[0])
+            if name:
+                sets.setdefault(name, stmt)
+
+    both = [name for name in checks if name in sets]
+    name = both[0] if both else next(iter(checks), None) or next(iter(sets), None)
+    analysis.guard_name = name or default_guard_name(analysis)
+    analysis.guard_check = checks.get(analysis.guard_name)
+    analysis.guard_set = sets.get(analysis.guard_name)
+    if not both:
+        analysis.add("missing_guard", f"代码块开头缺少防重复触发的 _G.{analysis.guard_name} 检查和赋值",
+                     in_block=True)
+
+    if not any(node.kind == 'Call' and call_name(node) == "System.Exit" for node in analysis.code_chunk.walk()):
+        analysis.add("missing_exit", "代码块中没有 System.Exit()", in_block=True)
+
+
+def _check_calls(analysis: EncounterAnalysis, chunk: Node, animation_library: frozenset, in_block: bool) -> bool:
+    """检查玩家对话、对话方括号、动画名称；返回是否调用了 World.GetByID"""
+    get_by_id = False
+    for node in chunk.walk():
+        if node.kind == 'Call':
+            get_by_id = get_by_id or call_name(node) == "World.GetByID"
+            method = _last_part(node.func)
+        elif node.kind == 'MethodCall':
+            method = node.method
+            if method == "ApproachAndSay" and node.obj.kind == 'Name' and node.obj.name in _PLAYER_NAMES:
+                analysis.add("player_approach", "玩家对话应使用 UI.ShowDialogue(\"Player\", ...)", node.line,
+                             node, in_block)
+                continue
+        else:
+            continue
+
+        if method in _DIALOGUE_METHODS and len(node.args) > 1:
+            text = node.args[1]
+            if text.kind == 'String' and _BRACKETED.fullmatch(text.value):
+                analysis.add("bracket_dialogue", f"对话内容不应使用方括号: \"{text.value}\"", node.line,
+                             text, in_block)
+        elif method == "PlayAnim" and node.args:
+            name = node.args[0]
+            if name.kind == 'String' and name.value not in animation_library:
+                analysis.add("animation", f"动画 \"{name.value}\" 不在素材库中", node.line, name, in_block)
+    return get_by_id
+
+
+def _last_part(func: Node) -> Optional[str]:
+    if func.kind == 'Name':
+        return func.name
+    if func.kind == 'Index' and func.key.kind == 'String':
+        return func.key.value
+    return None
+
+
+def _is_location(node: Node, env: Dict[str, Optional[Node]], depth: int = 0) -> bool:
+    """位置表 {X=数值, Y=数值, Z=数值}，或返回位置表的局部函数的调用结果"""
+    node = resolve(node, env)
+    if node is None or depth > 8:
+        return False
+    if node.kind == 'Table':
+        values = {}
+        for key, value in node.fields:
+            if key is not None and key.kind == 'String':
+                values[key.value] = value
+        return all(axis in values and _is_number(values[axis]) for axis in ("X", "Y", "Z"))
+    if node.kind == 'Call':
+        func = resolve(node.func, env)
+        if func is not None and func.kind == 'FunctionExpr':
+            returns = [stmt for stmt in func.body if stmt.kind == 'Return' and stmt.values]
+            # 函数体中的局部变量按函数自身的作用域解析
+            local_env = dict(env)
+            for stmt in func.body:
+                _bind(stmt, local_env)
+            return bool(returns) and _is_location(returns[-1].values[0], local_env, depth + 1)
+    return False
+
+
+def _is_number(node: Node) -> bool:
+    if node.kind == 'UnOp' and node.op == '-':
+        node = node.operand
+    return node.kind == 'Number'
+
+
+def _is_npc_data(node: Optional[Node]) -> bool:
+    if node is None or node.kind != 'Table':
+        return False
+    return any(
+        key is not None and key.kind == 'String' and value.kind == 'String'
+        for key, value in node.fields
+    )
+
+
+def _bind(stmt: Node, env: Dict[str, Optional[Node]]):
+    """记录语句声明或赋值的局部变量"""
+    if stmt.kind == 'Local':
+        for i, name in enumerate(stmt.names):
+            env[name] = stmt.values[i] if i < len(stmt.values) else None
+    elif stmt.kind == 'LocalFunction':
+        env[stmt.name] = stmt.func
+    elif stmt.kind == 'Function' and stmt.target.kind == 'Name':
+        env[stmt.target.name] = stmt.func
+    elif stmt.kind == 'Assign':
+        for i, target in enumerate(stmt.targets):
+            if target.kind == 'Name':
+                env[target.name] = stmt.values[i] if i < len(stmt.values) else None
+
+
+def _find_calls(body: List[Node], env: Dict[str, Optional[Node]], name: str):
+    """按语句顺序查找名为name的调用，同时记录调用处可见的局部变量"""
+    env = dict(env)
+    for stmt in body:
+        yield from _search(stmt, env, name)
+        _bind(stmt, env)
+
+
+def _search(node: Node, env: Dict[str, Optional[Node]], name: str):
+    if node.kind in ('Call', 'MethodCall') and call_name(node) == name:
+        yield SpawnCall(node, env)
+
+    if node.kind == 'FunctionExpr':
+        # 参数遮蔽外层同名变量
+        yield from _find_calls(node.body, {**env, **dict.fromkeys(node.params)}, name)
+        return
+    if node.kind in ('NumericFor', 'GenericFor'):
+        names = [node.var] if node.kind == 'NumericFor' else node.names
+        for child in (node.start, node.stop, node.step) if node.kind == 'NumericFor' else node.exprs:
+            if child is not None:
+                yield from _search(child, env, name)
+        yield from _find_calls(node.body, {**env, **dict.fromkeys(names)}, name)
+        return
+    if node.kind == 'If':
+        for test, body in node.clauses:
+            yield from _search(test, env, name)
+            yield from _find_calls(body, env, name)
+        if node.orelse is not None:
+            yield from _find_calls(node.orelse, env, name)
+        return
+    if node.kind in ('Do', 'While', 'Repeat'):
+        if node.kind == 'While':
+            yield from _search(node.test, env, name)
+        yield from _find_calls(node.body, env, name)
+        if node.kind == 'Repeat':
+            yield from _search(node.test, env, name)
+        return
+
+    for child in node.children():
+        yield from _search(child, env, name)
@@ -3,23 +3,31 @@
 处理gameplay_knowledge_base.md，构建向量数据库，实现RAG检索
 """
 
+import importlib.util
 import os
 import re
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+import threading
+from typing import List, Dict, Any, FrozenSet, Iterable, Optional, Tuple
+from dataclasses import dataclass, field
 
-try:
-    import chromadb
-    CHROMADB_AVAILABLE = True
-except ImportError:
-    CHROMADB_AVAILABLE = False
+from embedding_registry import get_embedding_model, encode_query, encode_queries, DEFAULT_EMBEDDING_MODEL
+from vector_index import NumpyVectorIndex, NUMPY_AVAILABLE, VECTOR_BACKENDS
+from embedding_store import EmbeddingStore
+from index_sync import prune_collections, stable_doc_ids, sync_collection, versioned_collection_name
+from context_budget import estimate_tokens
+from metrics import timed
+from keyword_matcher import KeywordMatcher
+from lexical_index import BM25Index
+from hybrid_search import HYBRID_SEARCH, hybrid_rank
+
+# chromadb和sentence-transformers（会连带加载torch）体积很大，
+# 这里只检查是否已安装，真正的导入推迟到首次初始化向量库时
+CHROMADB_AVAILABLE = importlib.util.find_spec("chromadb") is not None
+if not CHROMADB_AVAILABLE:
     print("警告: chromadb未安装，将使用内存存储。运行: pip install chromadb")
 
-try:
-    from sentence_transformers import SentenceTransformer
-    EMBEDDING_AVAILABLE = True
-except ImportError:
-    EMBEDDING_AVAILABLE = False
+EMBEDDING_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+if not EMBEDDING_AVAILABLE:
     print("警告: sentence-transformers未安装，将使用简单文本匹配。运行: pip install sentence-transformers")
 
 
@@ -36,6 +44,45 @@ class GameplayFunctionDoc:
     recommended_usage: str  # 推荐用法
     common_errors: str  # 常见错误
     tags: List[str]  # 功能标签
+    # 渲染后的文档片段：省略的可选字段 -> 文本（加载时预先渲染）
+    fragments: Dict[FrozenSet[str], str] = field(default_factory=dict, repr=False, compare=False)
+    # 各片段的token估算：省略的可选字段 -> token数（与fragments一同计算）
+    fragment_tokens: Dict[FrozenSet[str], int] = field(default_factory=dict, repr=False, compare=False)
+
+
+# 渲染后的整体文档文本缓存的条目上限（超出时清空）
+DOCS_TEXT_CACHE_SIZE = 256
+
+# 文档中涉及Performer模块或PlayAnim时附加的动画素材库
+ANIMATION_LIBRARY_DOC = (
+    "\n## 动画素材库（Animation Library）\n"
+    "**重要：PlayAnim必须使用以下动画名称，禁止使用素材库之外的动画名称**\n\n"
+    "### 基础动作\n"
+    "- Idle（待机）, Walk（行走）, Run（奔跑）\n\n"
+    "### 跳跃动作\n"
+    "- Jump_01（起跳_01）, Jump_02（凌空_02）, Jump_03（落地_03）\n\n"
+    "### 战斗动作\n"
+    "- Melee Attack_01/02/03（近战普攻）, Ranged Attack_01/02/03（远程普攻）\n\n"
+    "### 情绪动作\n"
+    "- Happy（开心）, Admiring（崇拜）, Shy（害羞）, Frustrated（沮丧）, Scared（恐惧）\n\n"
+    "### 交互动作\n"
+    "- Pick Up（拾取）, Hide（躲藏）, Eat（吃）, Drink（喝）, Sleep（睡）\n"
+    "- Sit（坐在椅子上）, Dialogue（说话）, Give（给予）, Point To（指向目标）\n"
+    "- Wave（挥手打招呼）, Sing（唱歌）, Dance（跳舞）\n\n"
+    "**常用动画推荐**：Wave（挥手）、Happy（开心）、Shy（害羞）、Scared（恐惧）、Drink（喝）、Sleep（睡）、Dialogue（说话）\n"
+)
+
+# 文档中涉及UI模块或对话函数时附加的玩家对话规则
+DIALOGUE_RULES_DOC = (
+    "\n## 对话规则（Dialogue Rules）\n"
+    "**重要：玩家对话必须使用UI.ShowDialogue，不能使用ApproachAndSay**\n\n"
+    "- NPC说话：使用 `npc:ApproachAndSay(player, \"文本\")` 或 `UI.ShowDialogue(\"NPC名称\", \"文本\")`\n"
+    "- 玩家说话：**必须使用** `UI.ShowDialogue(\"Player\", \"文本\")` 或 `UI.ShowDialogue(\"角色名\", \"文本\")`\n"
+    "- **禁止**使用 `player:ApproachAndSay()`，玩家没有ApproachAndSay方法\n"
+    "- **对话内容格式**：所有对话内容直接使用引号包裹，**不要使用方括号**\n"
+    "  - 正确示例：`npcA:ApproachAndSay(player, \"你好\")`\n"
+    "  - 错误示例：`npcA:ApproachAndSay(player, \"[你好]\")`\n"
+)
 
 
 class GameplayKnowledgeBase:
@@ -52,6 +99,9 @@ class GameplayKnowledgeBase:
         "Time": "环境时间控制"
     }
     
+    # 超出上下文预算时可省略的文档字段（按省略的先后顺序）
+    OPTIONAL_DOC_FIELDS = ("common_errors", "recommended_usage", "example")
+    
     # 功能标签到模块的映射（用于检索）
     FUNCTION_TO_MODULE = {
         # World模块
@@ -147,15 +197,56 @@ class GameplayKnowledgeBase:
         "夜晚": ["Time"]
     }
     
-    def __init__(self, knowledge_file: str = "gameplay_knowledge_base.md"):
-        """初始化知识库"""
+    # 补充关键词：提到NPC需要Performer和World，提到选择/对话需要UI，
+    # 提到战斗/敌人需要World，提到奖励/物品需要Performer
+    CONTEXT_KEYWORDS = {
+        "npc": ["Performer", "World"],
+        "角色": ["Performer", "World"],
+        "选择": ["UI"],
+        "对话": ["UI"],
+        "询问": ["UI"],
+        "ask": ["UI"],
+        "dialogue": ["UI"],
+        "战斗": ["World"],
+        "敌人": ["World"],
+        "攻击": ["World"],
+        "combat": ["World"],
+        "enemy": ["World"],
+        "奖励": ["Performer"],
+        "物品": ["Performer"],
+        "装备": ["Performer"],
+        "reward": ["Performer"],
+        "item": ["Performer"]
+    }
+    
+    def __init__(self, knowledge_file: str = "gameplay_knowledge_base.md", embedding_model_name: str = DEFAULT_EMBEDDING_MODEL,
+                 vector_backend: Optional[str] = None, hybrid_search: Optional[bool] = None):
+        """
+        初始化知识库
+        vector_backend: 检索后端，"chroma"（默认）或 "numpy"（进程内向量索引），
+                        未指定时读取环境变量 RAG_VECTOR_BACKEND
+        hybrid_search: 向量检索时是否同时执行BM25检索并做排名融合，未指定时读取环境变量 RAG_HYBRID_SEARCH
+        """
         self.knowledge_file = knowledge_file
+        self.embedding_model_name = embedding_model_name
+        self.vector_backend = (vector_backend or os.getenv('RAG_VECTOR_BACKEND', 'chroma')).lower()
+        if self.vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"未知的检索后端: {self.vector_backend}，可选: {VECTOR_BACKENDS}")
+        self.hybrid_search = HYBRID_SEARCH if hybrid_search is None else hybrid_search
         self.reference_document = "gameplay_document.md"  # 参考文档
         self.functions: List[GameplayFunctionDoc] = []
+        self.doc_ids: List[str] = []  # 与functions一一对应的向量库文档ID
+        self._id_to_index: Dict[str, int] = {}  # 文档ID -> functions下标
+        self._keyword_matcher = self._build_keyword_matcher()  # 关键词 -> 模块的匹配器（编译好的正则）
+        self._lexical_index = BM25Index([])  # 文本匹配回退使用的BM25倒排索引
+        self._module_headers: Dict[str, str] = {}  # 模块 -> 渲染后的模块标题
+        self._docs_text_cache: Dict[Tuple[Any, ...], str] = {}  # (函数, 省略字段) -> 整体文档文本
+        self.source_paths: List[str] = []  # 实际加载的源文件（用于热重载监视）
         self.reference_examples: str = ""  # 参考文档中的示例代码
         self.vector_db = None
         self.embedding_model = None
         self.collection = None
+        self.collection_name: Optional[str] = None  # 当前版本使用的ChromaDB集合名
         
         # 加载知识库文档
         self._load_knowledge_base()
@@ -163,8 +254,10 @@ class GameplayKnowledgeBase:
         # 加载参考文档（gameplay_document.md）
         self._load_reference_document()
         
-        # 初始化向量数据库
-        if CHROMADB_AVAILABLE:
+        # 初始化向量检索后端
+        if self.vector_backend == "numpy" and NUMPY_AVAILABLE:
+            self._init_numpy_index()
+        elif CHROMADB_AVAILABLE:
             self._init_vector_db()
         else:
             print("使用简单文本匹配模式")
@@ -188,6 +281,8 @@ class GameplayKnowledgeBase:
             print(f"警告: 知识库文件不存在，尝试的路径: {possible_paths}")
             return
         
+        self.source_paths.append(os.path.abspath(kb_path))
+        
         # 读取文件，处理BOM和编码问题
         try:
             # 尝试UTF-8 with BOM
@@ -209,9 +304,33 @@ class GameplayKnowledgeBase:
         
         # 解析Markdown内容
         self._parse_markdown(content)
+        self._build_lookup_tables()
         
         print(f"已加载 {len(self.functions)} 个奇遇API函数文档")
     
+    def _build_lookup_tables(self):
+        """构建文档ID查找表（ID由模块、函数名和签名派生，不依赖列表位置）和BM25倒排索引"""
+        self.doc_ids = stable_doc_ids([
+            f"{func.module}|{func.function_name}|{func.signature}" for func in self.functions
+        ])
+        self._id_to_index = {doc_id: idx for idx, doc_id in enumerate(self.doc_ids)}
+        self._lexical_index = BM25Index([self._build_lexical_text(func) for func in self.functions],
+                                        groups=[func.module for func in self.functions])
+        self._render_fragments()
+    
+    def _render_fragments(self):
+        """预先渲染每个函数文档在各精简级别（去掉前k个可选字段）下的片段，以及各模块标题"""
+        levels = [frozenset(self.OPTIONAL_DOC_FIELDS[:k]) for k in range(len(self.OPTIONAL_DOC_FIELDS) + 1)]
+        for func in self.functions:
+            func.fragments = {omit: self._render_function_doc(func, omit) for omit in levels}
+            func.fragment_tokens = {omit: estimate_tokens(text) for omit, text in func.fragments.items()}
+        self._module_headers = {func.module: self._render_module_header(func.module) for func in self.functions}
+        self._docs_text_cache = {}
+    
+    def _build_lexical_text(self, func: GameplayFunctionDoc) -> str:
+        """构建用于文本匹配的文档文本（函数名、签名、说明、推荐用法和标签）"""
+        return " ".join([func.function_name, func.signature, func.description, func.recommended_usage] + func.tags)
+    
     def _load_reference_document(self):
         """加载参考文档 gameplay_document.md，提取示例代码"""
         possible_paths = [
@@ -230,6 +349,8 @@ class GameplayKnowledgeBase:
             print(f"警告: 参考文档不存在，尝试的路径: {possible_paths}")
             return
         
+        self.source_paths.append(os.path.abspath(doc_path))
+        
         # 读取文件
         try:
             with open(doc_path, 'r', encoding='utf-8-sig') as f:
@@ -549,57 +670,88 @@ UI.Toast("游戏开始")
         
         return list(set(tags))
     
+    def _init_numpy_index(self):
+        """初始化进程内NumPy向量索引（不依赖ChromaDB）"""
+        if not EMBEDDING_AVAILABLE or not self.functions:
+            return
+        
+        try:
+            self.embedding_model = get_embedding_model(self.embedding_model_name)
+            
+            documents = [self._build_document_text(func) for func in self.functions]
+            embeddings = self._encode_documents(documents)
+            
+            # 向量缓存中的矩阵已按行归一化，索引直接使用（全部命中时为内存映射，不复制）
+            index = NumpyVectorIndex()
+            index.build(
+                ids=self.doc_ids,
+                embeddings=embeddings,
+                modules=[func.module for func in self.functions],
+                normalized=True
+            )
+            self.collection = index
+            print(f"NumPy向量索引已初始化，包含 {index.count()} 个文档")
+        except Exception as e:
+            print(f"初始化NumPy向量索引时出错: {e}")
+            self.collection = None
+    
     def _init_vector_db(self):
         """初始化向量数据库"""
         if not CHROMADB_AVAILABLE:
             return
         
         try:
+            # 初始化嵌入模型（进程内共享，与地图知识库共用同一实例）
+            # 必须在索引之前加载，否则新建集合时会在没有向量的情况下写入文档
+            if EMBEDDING_AVAILABLE:
+                self.embedding_model = get_embedding_model(self.embedding_model_name)
+            
+            import chromadb
+            
             # 创建持久化客户端
             db_path = os.path.join(os.path.dirname(__file__), "chroma_db_gameplay")
             self.vector_db = chromadb.PersistentClient(path=db_path)
             
-            # 创建或获取集合
-            collection_name = "gameplay_functions"
-            try:
-                self.collection = self.vector_db.get_collection(name=collection_name)
-                # 检查集合中是否有文档
-                count = self.collection.count()
-                if count == 0 and len(self.functions) > 0:
-                    # 如果集合存在但为空，且已加载函数，则重新索引
-                    print(f"集合 {collection_name} 存在但为空，重新索引...")
-                    self._index_functions()
-                else:
-                    print(f"已加载现有知识库集合: {collection_name}，包含 {count} 个文档")
-            except:
-                self.collection = self.vector_db.create_collection(name=collection_name)
-                print(f"创建新知识库集合: {collection_name}")
-                # 索引函数文档
-                if len(self.functions) > 0:
-                    self._index_functions()
+            # 创建或获取当前版本的集合（集合名带内容摘要，热重载时不改动旧版本的集合）
+            self.collection_name = versioned_collection_name(
+                "gameplay_functions", self.doc_ids, [self._build_document_text(func) for func in self.functions],
+                self.embedding_model_name
+            )
+            self.collection = self.vector_db.get_or_create_collection(name=self.collection_name)
             
-            # 初始化嵌入模型
-            if EMBEDDING_AVAILABLE:
-                self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-                print("嵌入模型已加载")
+            # 按文档哈希增量同步（只处理新增、变化和删除的文档）
+            if len(self.functions) > 0:
+                self._sync_index()
+            print(f"已加载知识库集合: {self.collection_name}，包含 {self.collection.count()} 个文档")
         except Exception as e:
             print(f"初始化向量数据库时出错: {e}")
             self.vector_db = None
+            self.collection = None
     
-    def _index_functions(self):
-        """将函数文档索引到向量数据库"""
-        if not self.collection or not self.functions:
+    def has_vector_index(self) -> bool:
+        """向量检索后端是否可用"""
+        return bool(self.collection and EMBEDDING_AVAILABLE and self.embedding_model)
+    
+    def prune_index_versions(self, keep: Iterable[str] = ()):
+        """删除ChromaDB中除当前版本和keep以外的其他版本集合（numpy后端无需处理）"""
+        if not self.vector_db or not self.collection_name:
             return
-        
-        print("开始索引奇遇API函数文档...")
-        
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for idx, func in enumerate(self.functions):
-            # 构建文档文本
-            doc_text = f"""
+        removed = prune_collections(self.vector_db, "gameplay_functions", {self.collection_name, *keep})
+        if removed:
+            print(f"[INFO] 已删除旧版本向量集合: {', '.join(removed)}")
+    
+    def drop_index(self):
+        """删除当前版本的ChromaDB集合（新版本未通过校验、不会被使用时清理）"""
+        if not self.vector_db or not self.collection_name:
+            return
+        try:
+            self.vector_db.delete_collection(self.collection_name)
+        except Exception as e:
+            print(f"[WARN] 删除向量集合 {self.collection_name} 失败: {e}")
+    
+    def _build_document_text(self, func: GameplayFunctionDoc) -> str:
+        """构建用于嵌入的文档文本"""
+        doc_text = f"""
 模块: {func.module}
 函数: {func.function_name}
 签名: {func.signature}
@@ -610,73 +762,80 @@ UI.Toast("游戏开始")
 推荐用法: {func.recommended_usage}
 标签: {', '.join(func.tags)}
 """
-            documents.append(doc_text.strip())
+        return doc_text.strip()
+    
+    def _encode_documents(self, documents: List[str]):
+        """编码文档文本（经过磁盘向量缓存，只对文本发生变化的文档重新编码）"""
+        if not NUMPY_AVAILABLE:
+            return self.embedding_model.encode(documents)
+        
+        store = EmbeddingStore("gameplay_functions", self.embedding_model_name)
+        embeddings = store.get_embeddings(documents, self.embedding_model.encode)
+        print(f"文档向量: 复用缓存 {store.last_reused} 个，重新编码 {store.last_encoded} 个")
+        return embeddings
+    
+    def _sync_index(self):
+        """将函数文档增量同步到向量数据库"""
+        if not self.collection or not self.functions:
+            return
+        
+        documents = []
+        metadatas = []
+        ids = []
+        
+        for doc_id, func in zip(self.doc_ids, self.functions):
+            documents.append(self._build_document_text(func))
             metadatas.append({
                 "module": func.module,
                 "function_name": func.function_name,
                 "signature": func.signature,
                 "category": func.module
             })
-            ids.append(f"func_{idx}")
+            ids.append(doc_id)
         
-        # 批量添加
-        if EMBEDDING_AVAILABLE and self.embedding_model:
-            # 使用嵌入模型生成向量
-            embeddings = self.embedding_model.encode(documents).tolist()
-            self.collection.add(
-                embeddings=embeddings,
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-        else:
-            # 使用文本匹配
-            self.collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
+        # 有嵌入模型时使用共享模型编码（经过向量缓存），否则交给ChromaDB默认嵌入函数
+        embed = self._encode_documents if EMBEDDING_AVAILABLE and self.embedding_model else None
+        stats = sync_collection(self.collection, ids, documents, metadatas, embed=embed)
         
-        print(f"已索引 {len(self.functions)} 个函数文档")
+        print(f"向量数据库同步完成: 更新 {stats['upserted']} 个，删除 {stats['deleted']} 个，未变化 {stats['unchanged']} 个")
+    
+    def _build_keyword_matcher(self) -> KeywordMatcher:
+        """合并 FUNCTION_TO_MODULE 和 CONTEXT_KEYWORDS 构建关键词匹配器"""
+        keywords: Dict[str, set] = {}
+        for table in (self.FUNCTION_TO_MODULE, self.CONTEXT_KEYWORDS):
+            for keyword, modules in table.items():
+                keywords.setdefault(keyword.lower(), set()).update(modules)
+        return KeywordMatcher(keywords)
     
     def identify_required_modules(self, user_input: str, npc_tags: List[str] = None) -> List[str]:
         """
         识别用户需求中需要的功能模块
         返回模块列表，如 ["World", "UI", "Performer"]
         """
-        modules = set()
-        text = user_input.lower()
+        # 根据关键词和补充关键词识别模块（编译好的正则，一次扫描）
+        modules = self._keyword_matcher.match(user_input)
         
-        # 根据关键词识别模块
-        for keyword, module_list in self.FUNCTION_TO_MODULE.items():
-            if keyword.lower() in text:
-                modules.update(module_list)
-        
-        # 如果提到NPC，通常需要Performer和World
-        if npc_tags or "npc" in text or "角色" in text:
+        # 指定了NPC标签时需要Performer和World
+        if npc_tags:
             modules.add("Performer")
             modules.add("World")
         
-        # 如果提到选择、对话，需要UI
-        if any(kw in text for kw in ["选择", "对话", "询问", "选择", "ask", "dialogue"]):
-            modules.add("UI")
-        
-        # 如果提到战斗、敌人，需要World
-        if any(kw in text for kw in ["战斗", "敌人", "攻击", "combat", "enemy"]):
-            modules.add("World")
-        
-        # 如果提到奖励，需要Performer
-        if any(kw in text for kw in ["奖励", "物品", "装备", "reward", "item"]):
-            modules.add("Performer")
-        
         # 默认包含System（用于Exit）
         modules.add("System")
         
         return list(modules) if modules else ["World", "UI", "Performer", "System"]
     
+    def warm_queries(self, queries: List[str]):
+        """预先批量编码查询向量并写入LRU缓存（批量生成时多个条目共享一次编码）"""
+        queries = [q for q in queries if q]
+        if queries and self.collection and EMBEDDING_AVAILABLE and self.embedding_model:
+            encode_queries(queries, self.embedding_model_name)
+    
+    @timed("retrieve_functions")
     def retrieve_functions(self, modules: List[str] = None, query: str = "", top_k: int = 30) -> List[GameplayFunctionDoc]:
         """
         检索相关函数文档
+        启用混合检索时，向量检索与BM25检索的排名经过倒数排名融合
         """
         if not self.functions:
             return []
@@ -684,28 +843,22 @@ UI.Toast("游戏开始")
         # 如果使用向量数据库
         if self.collection and EMBEDDING_AVAILABLE and self.embedding_model:
             try:
-                # 生成查询向量
-                query_embedding = self.embedding_model.encode([query]).tolist()[0]
-                
-                # 构建过滤条件
-                where = None
-                if modules:
-                    where = {"module": {"$in": modules}}
-                
-                # 检索
-                results = self.collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=min(top_k, len(self.functions)),
-                    where=where
-                )
+                if self.hybrid_search and query:
+                    rows = hybrid_rank(
+                        lambda n: [self._id_to_index[doc_id] for doc_id in self._vector_search_ids(query, modules, n)
+                                   if doc_id in self._id_to_index],
+                        lambda n: self._lexical_search_rows(query, modules, n),
+                        len(self.functions),
+                        top_k
+                    )
+                    return [self.functions[idx] for idx in rows]
                 
                 # 转换为函数文档
                 retrieved_functions = []
-                if results['ids'] and len(results['ids'][0]) > 0:
-                    for idx_str in results['ids'][0]:
-                        func_idx = int(idx_str.split('_')[1])
-                        if func_idx < len(self.functions):
-                            retrieved_functions.append(self.functions[func_idx])
+                for doc_id in self._vector_search_ids(query, modules, top_k):
+                    func_idx = self._id_to_index.get(doc_id)
+                    if func_idx is not None:
+                        retrieved_functions.append(self.functions[func_idx])
                 
                 return retrieved_functions
             except Exception as e:
@@ -714,103 +867,155 @@ UI.Toast("游戏开始")
         # 文本匹配回退
         return self._text_search(modules, query, top_k)
     
+    def _vector_search_ids(self, query: str, modules: Optional[List[str]], n_results: int) -> List[str]:
+        """向量检索，返回按相似度降序的文档ID"""
+        # 生成查询向量（经过进程内LRU缓存）
+        with timed("embedding_encode"):
+            query_embedding = encode_query(query, self.embedding_model_name).tolist()
+        
+        # 构建过滤条件
+        where = None
+        if modules:
+            where = {"module": {"$in": modules}}
+        
+        # 检索
+        with timed("vector_query"):
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=min(n_results, len(self.functions)),
+                where=where
+            )
+        return results['ids'][0] if results['ids'] else []
+    
+    def _lexical_search_rows(self, query: str, modules: Optional[List[str]], top_k: int) -> List[int]:
+        """BM25检索，返回按得分降序的函数下标"""
+        with timed("lexical_search"):
+            hits = self._lexical_index.search(query, top_k, set(modules) if modules else None)
+        return [idx for idx, _ in hits]
+    
     def _text_search(self, modules: List[str] = None, query: str = "", top_k: int = 30) -> List[GameplayFunctionDoc]:
-        """文本匹配搜索"""
-        scored_functions = []
-        query_lower = query.lower()
-        
-        for func in self.functions:
-            # 模块过滤
-            if modules and func.module not in modules:
-                continue
-            
-            score = 0
-            text = (func.function_name + " " + func.description + " " + func.signature).lower()
-            
-            # 关键词匹配
-            for keyword in query_lower.split():
-                if keyword in text:
-                    score += 1
-            
-            if score > 0:
-                scored_functions.append((score, func))
-        
-        # 按分数排序
-        scored_functions.sort(key=lambda x: x[0], reverse=True)
-        return [f for _, f in scored_functions[:top_k]]
+        """BM25文本匹配（中文按两字切分，API名按驼峰拆分）"""
+        return [self.functions[idx] for idx in self._lexical_search_rows(query, modules, top_k)]
+    
+    def function_doc_tokens(self, func: GameplayFunctionDoc, omit_fields: Iterable[str] = ()) -> int:
+        """单个函数文档渲染结果的token估算（加载时与文档片段一同计算）"""
+        omit = frozenset(omit_fields).intersection(self.OPTIONAL_DOC_FIELDS)
+        tokens = func.fragment_tokens.get(omit)
+        if tokens is None:
+            tokens = func.fragment_tokens[omit] = estimate_tokens(self.format_function_doc(func, omit))
+        return tokens
+    
+    def format_function_doc(self, func: GameplayFunctionDoc, omit_fields: Iterable[str] = ()) -> str:
+        """返回单个函数文档的渲染结果；omit_fields 中的可选字段（见 OPTIONAL_DOC_FIELDS）不输出"""
+        omit = frozenset(omit_fields).intersection(self.OPTIONAL_DOC_FIELDS)
+        fragment = func.fragments.get(omit)
+        if fragment is None:
+            fragment = func.fragments[omit] = self._render_function_doc(func, omit)
+        return fragment
     
-    def get_function_docs_text(self, functions: List[GameplayFunctionDoc]) -> str:
-        """将函数文档列表转换为文本格式（用于LLM提示词）"""
+    def _render_function_doc(self, func: GameplayFunctionDoc, omit_fields: FrozenSet[str]) -> str:
+        """渲染单个函数文档"""
+        doc_text = f"""
+### {func.function_name}
+签名: {func.signature}
+说明: {func.description}
+参数: {func.parameters}
+返回值: {func.return_value}
+"""
+        if "example" not in omit_fields:
+            doc_text += f"示例:\n{func.example}\n"
+        if "recommended_usage" not in omit_fields:
+            doc_text += f"推荐用法:\n{func.recommended_usage}\n"
+        if func.common_errors and "common_errors" not in omit_fields:
+            doc_text += f"常见错误: {func.common_errors}\n"
+        return doc_text
+    
+    def _render_module_header(self, module: str) -> str:
+        """渲染模块标题"""
+        return f"\n## {module} 模块\n"
+    
+    def get_function_docs_text(self, functions: List[GameplayFunctionDoc],
+                               omit_fields: Optional[List[Iterable[str]]] = None) -> str:
+        """
+        将函数文档列表转换为文本格式（用于LLM提示词）
+        omit_fields: 与functions一一对应，每个函数文档省略的可选字段（用于按token预算精简）
+        相同的函数和省略字段直接返回缓存的文本
+        """
         if not functions:
             return "未找到相关API函数文档。"
         
-        docs_text = ""
+        key = (tuple(id(func) for func in functions),
+               tuple(frozenset(fields) for fields in omit_fields) if omit_fields else None)
+        text = self._docs_text_cache.get(key)
+        if text is None:
+            text = self._join_function_docs(functions, omit_fields)
+            if len(self._docs_text_cache) >= DOCS_TEXT_CACHE_SIZE:
+                self._docs_text_cache.clear()
+            self._docs_text_cache[key] = text
+        return text
+    
+    def _join_function_docs(self, functions: List[GameplayFunctionDoc],
+                            omit_fields: Optional[List[Iterable[str]]]) -> str:
+        """按模块分组拼接预先渲染的模块标题和文档片段，按需附加动画素材库和对话规则"""
+        text_parts = []
         current_module = None
         
-        for func in functions:
+        for i, func in enumerate(functions):
             # 添加模块标题
             if func.module != current_module:
-                docs_text += f"\n## {func.module} 模块\n"
                 current_module = func.module
+                header = self._module_headers.get(current_module)
+                text_parts.append(header if header is not None else self._render_module_header(current_module))
             
-            docs_text += f"""
-### {func.function_name}
-签名: {func.signature}
-说明: {func.description}
-参数: {func.parameters}
-返回值: {func.return_value}
-示例:
-{func.example}
-推荐用法:
-{func.recommended_usage}
-"""
-            if func.common_errors:
-                docs_text += f"常见错误: {func.common_errors}\n"
+            text_parts.append(self.format_function_doc(func, omit_fields[i] if omit_fields else ()))
         
         # 如果涉及Performer模块（包含PlayAnim），添加动画素材库信息
-        has_performer = any(func.module == "Performer" for func in functions)
-        has_playanim = any("PlayAnim" in func.function_name for func in functions)
-        
-        if has_performer or has_playanim:
-            docs_text += "\n## 动画素材库（Animation Library）\n"
-            docs_text += "**重要：PlayAnim必须使用以下动画名称，禁止使用素材库之外的动画名称**\n\n"
-            docs_text += "### 基础动作\n"
-            docs_text += "- Idle（待机）, Walk（行走）, Run（奔跑）\n\n"
-            docs_text += "### 跳跃动作\n"
-            docs_text += "- Jump_01（起跳_01）, Jump_02（凌空_02）, Jump_03（落地_03）\n\n"
-            docs_text += "### 战斗动作\n"
-            docs_text += "- Melee Attack_01/02/03（近战普攻）, Ranged Attack_01/02/03（远程普攻）\n\n"
-            docs_text += "### 情绪动作\n"
-            docs_text += "- Happy（开心）, Admiring（崇拜）, Shy（害羞）, Frustrated（沮丧）, Scared（恐惧）\n\n"
-            docs_text += "### 交互动作\n"
-            docs_text += "- Pick Up（拾取）, Hide（躲藏）, Eat（吃）, Drink（喝）, Sleep（睡）\n"
-            docs_text += "- Sit（坐在椅子上）, Dialogue（说话）, Give（给予）, Point To（指向目标）\n"
-            docs_text += "- Wave（挥手打招呼）, Sing（唱歌）, Dance（跳舞）\n\n"
-            docs_text += "**常用动画推荐**：Wave（挥手）、Happy（开心）、Shy（害羞）、Scared（恐惧）、Drink（喝）、Sleep（睡）、Dialogue（说话）\n"
+        if any(func.module == "Performer" or "PlayAnim" in func.function_name for func in functions):
+            text_parts.append(ANIMATION_LIBRARY_DOC)
         
         # 如果涉及UI模块，添加玩家对话规则
-        has_ui = any(func.module == "UI" for func in functions)
-        has_dialogue = any("ShowDialogue" in func.function_name or "ApproachAndSay" in func.function_name for func in functions)
-        
-        if has_ui or has_dialogue:
-            docs_text += "\n## 对话规则（Dialogue Rules）\n"
-            docs_text += "**重要：玩家对话必须使用UI.ShowDialogue，不能使用ApproachAndSay**\n\n"
-            docs_text += "- NPC说话：使用 `npc:ApproachAndSay(player, \"文本\")` 或 `UI.ShowDialogue(\"NPC名称\", \"文本\")`\n"
-            docs_text += "- 玩家说话：**必须使用** `UI.ShowDialogue(\"Player\", \"文本\")` 或 `UI.ShowDialogue(\"角色名\", \"文本\")`\n"
-            docs_text += "- **禁止**使用 `player:ApproachAndSay()`，玩家没有ApproachAndSay方法\n"
-            docs_text += "- **对话内容格式**：所有对话内容直接使用引号包裹，**不要使用方括号**\n"
-            docs_text += "  - 正确示例：`npcA:ApproachAndSay(player, \"你好\")`\n"
-            docs_text += "  - 错误示例：`npcA:ApproachAndSay(player, \"[你好]\")`\n"
-        
-        return docs_text
+        if any(func.module == "UI" or "ShowDialogue" in func.function_name or "ApproachAndSay" in func.function_name
+               for func in functions):
+            text_parts.append(DIALOGUE_RULES_DOC)
+        
+        return "".join(text_parts)
 
 
 # 全局知识库实例
 _gameplay_kb_instance = None
+_gameplay_kb_lock = threading.Lock()
 
 def get_gameplay_knowledge_base() -> GameplayKnowledgeBase:
     """获取全局奇遇知识库实例（单例模式）"""
     global _gameplay_kb_instance
     if _gameplay_kb_instance is None:
-        _gameplay_kb_instance = GameplayKnowledgeBase()
+        with _gameplay_kb_lock:
+            if _gameplay_kb_instance is None:
+                _gameplay_kb_instance = GameplayKnowledgeBase()
+                # 进程内首个实例：此前版本的集合已无人使用
+                _gameplay_kb_instance.prune_index_versions()
+    return _gameplay_kb_instance
+
+def current_gameplay_knowledge_base() -> Optional[GameplayKnowledgeBase]:
+    """返回已加载的奇遇知识库实例（未加载时返回None，不触发加载）"""
     return _gameplay_kb_instance
+
+def reload_gameplay_knowledge_base() -> GameplayKnowledgeBase:
+    """
+    重新构建奇遇知识库（函数文档、参考示例、向量索引）并原子替换单例
+    新实例完整构建后才替换，进行中的请求继续使用各自持有的旧实例（及其向量集合）；
+    新实例没有函数文档或向量索引未能初始化时（如文档正在写入）抛出RuntimeError并保留旧实例
+    """
+    global _gameplay_kb_instance
+    old_kb = _gameplay_kb_instance
+    new_kb = GameplayKnowledgeBase()
+    if not new_kb.functions or (old_kb is not None and old_kb.has_vector_index() and not new_kb.has_vector_index()):
+        if old_kb is None or new_kb.collection_name != old_kb.collection_name:
+            new_kb.drop_index()
+        raise RuntimeError(f"新奇遇知识库不可用（函数文档 {len(new_kb.functions)} 个，"
+                           f"向量索引{'已' if new_kb.has_vector_index() else '未'}初始化），保留当前版本")
+    with _gameplay_kb_lock:
+        _gameplay_kb_instance = new_kb
+    # 上一版本的集合保留给仍持有旧实例的请求，更早的版本已无人使用
+    new_kb.prune_index_versions(keep=[old_kb.collection_name] if old_kb and old_kb.collection_name else [])
+    return new_kb
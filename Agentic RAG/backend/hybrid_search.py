@@ -0,0 +1,95 @@
+"""
+混合检索
+词法检索（BM25）与向量检索并行执行，用倒数排名融合（RRF）合并两路排名：
+score(d) = Σ 1 / (k + rank(d))，rank从1开始。请求中精确出现的API名（如 ApproachAndSay）由词法检索召回，
+语义相近的描述由向量检索召回；融合只依赖名次，不需要对两路得分做归一化
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+from metrics import bound_labels, current_labels, timed
+from vector_index import NUMPY_AVAILABLE
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+
+# 设置为1时，有向量检索的知识库同时执行词法检索并融合结果
+HYBRID_SEARCH = os.getenv('RAG_HYBRID_SEARCH', '0') == '1'
+# RRF的平滑常数，越大排名靠后的文档权重衰减越慢
+RRF_K = int(os.getenv('RAG_RRF_K', '60'))
+# 每一路参与融合的候选数（至少为top_k）
+HYBRID_CANDIDATES = int(os.getenv('RAG_HYBRID_CANDIDATES', '50'))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """词法检索使用的共享线程池（首次混合检索时创建）"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical")
+    return _executor
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], doc_count: int, top_k: int,
+                           k: int = RRF_K) -> List[int]:
+    """
+    融合多路排名（每路为按相关度降序的文档下标），返回融合后的前top_k个下标
+    得分相同时按文档下标排序
+    """
+    if top_k <= 0 or doc_count <= 0:
+        return []
+
+    if not NUMPY_AVAILABLE:
+        scores = {}
+        for ranking in rankings:
+            for rank, idx in enumerate(ranking, start=1):
+                scores[idx] = scores.get(idx, 0.0) + 1.0 / (k + rank)
+        return [idx for idx, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]]
+
+    scores = np.zeros(doc_count, dtype=np.float64)
+    for ranking in rankings:
+        if len(ranking):
+            rows = np.asarray(ranking, dtype=np.intp)
+            np.add.at(scores, rows, 1.0 / (k + np.arange(1, rows.size + 1, dtype=np.float64)))
+
+    candidates = np.flatnonzero(scores)
+    if candidates.size > top_k:
+        # 先取出第top_k名的得分，只对不低于该得分的文档排序
+        threshold = np.partition(scores[candidates], candidates.size - top_k)[candidates.size - top_k]
+        candidates = candidates[scores[candidates] >= threshold]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:top_k]].tolist()
+
+
+def _run_lexical(labels, lexical_search: Callable[[int], List[int]], depth: int) -> List[int]:
+    with bound_labels(labels):
+        return lexical_search(depth)
+
+
+def hybrid_rank(vector_search: Callable[[int], List[int]], lexical_search: Callable[[int], List[int]],
+                doc_count: int, top_k: int) -> List[int]:
+    """
+    并行执行两路检索并融合
+    vector_search / lexical_search 接收候选数，返回按相关度降序的文档下标；
+    词法检索在线程池中执行，向量检索（查询编码和矩阵运算）在当前线程执行
+    """
+    depth = max(top_k, HYBRID_CANDIDATES)
+    future = _get_executor().submit(_run_lexical, current_labels(), lexical_search, depth)
+    try:
+        vector_rows = vector_search(depth)
+    except BaseException:
+        # 向量检索失败时不等待词法检索（未开始则取消，已在执行则丢弃其结果和异常），直接抛出原异常
+        future.cancel()
+        raise
+    lexical_rows = future.result()
+
+    with timed("rank_fusion"):
+        return reciprocal_rank_fusion([lexical_rows, vector_rows], doc_count, top_k)
@@ -0,0 +1,93 @@
+"""
+向量库增量同步
+文档ID由函数签名等稳定字段派生（不依赖列表位置），
+通过比较每篇文档的文本哈希，只对新增/变化的文档upsert，删除已不存在的文档。
+每个知识库版本使用独立的集合（集合名带内容摘要），热重载构建新版本时不会改动旧实例正在查询的集合
+"""
+
+import hashlib
+from typing import Any, Callable, Container, Dict, List, Optional
+
+from embedding_store import text_hash
+
+
+def stable_doc_ids(keys: List[str], prefix: str = "func") -> List[str]:
+    """
+    根据稳定键（如 模块 + 函数签名）生成文档ID
+    键重复时追加序号，保证ID唯一且在文档顺序不变时保持稳定
+    """
+    ids = []
+    occurrences: Dict[str, int] = {}
+    for key in keys:
+        base = f"{prefix}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+        n = occurrences.get(base, 0)
+        occurrences[base] = n + 1
+        ids.append(base if n == 0 else f"{base}_{n}")
+    return ids
+
+
+def versioned_collection_name(base: str, ids: List[str], documents: List[str], model_name: str = "") -> str:
+    """
+    根据文档ID、文档文本和嵌入模型生成集合名：<base>-<摘要>
+    内容不变时重启复用同一集合，内容变化时得到新集合
+    """
+    digest = hashlib.sha256(model_name.encode('utf-8'))
+    for doc_id, doc in zip(ids, documents):
+        digest.update(f"\n{doc_id}:{text_hash(doc)}".encode('utf-8'))
+    return f"{base}-{digest.hexdigest()[:16]}"
+
+
+def prune_collections(client: Any, base: str, keep: Container[str]) -> List[str]:
+    """
+    删除同一知识库不在keep中的其他版本集合（包括不带版本后缀的旧集合）
+    返回被删除的集合名
+    """
+    removed = []
+    for collection in client.list_collections():
+        # chromadb 0.4/0.5 返回集合对象，0.6起返回集合名
+        name = collection if isinstance(collection, str) else collection.name
+        if name in keep or not (name == base or name.startswith(base + "-")):
+            continue
+        try:
+            client.delete_collection(name)
+            removed.append(name)
+        except Exception as e:
+            print(f"[WARN] 删除旧向量集合 {name} 失败: {e}")
+    return removed
+
+
+def sync_collection(collection: Any, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+                    embed: Optional[Callable[[List[str]], Any]] = None) -> Dict[str, int]:
+    """
+    将ChromaDB集合与当前文档增量同步
+    embed: 编码函数，接收全部文档文本，返回与之对应的向量矩阵（应使用向量缓存，
+           未变化的文档不会重新编码）；为None时由ChromaDB自带的嵌入函数处理
+    返回 {"upserted": n, "deleted": n, "unchanged": n}
+    """
+    hashes = [text_hash(doc) for doc in documents]
+
+    existing = collection.get(include=["metadatas"])
+    stored = {
+        doc_id: (metadata or {}).get("doc_hash")
+        for doc_id, metadata in zip(existing.get("ids", []), existing.get("metadatas") or [])
+    }
+
+    changed = [i for i, doc_id in enumerate(ids) if stored.get(doc_id) != hashes[i]]
+    current = set(ids)
+    removed = [doc_id for doc_id in stored if doc_id not in current]
+
+    if removed:
+        collection.delete(ids=removed)
+
+    if changed:
+        payload = {
+            "ids": [ids[i] for i in changed],
+            "documents": [documents[i] for i in changed],
+            "metadatas": [dict(metadatas[i], doc_hash=hashes[i]) for i in changed]
+        }
+        if embed is not None:
+            vectors = embed(documents)
+            payload["embeddings"] = [vectors[i].tolist() for i in changed]
+        collection.upsert(**payload)
+
+    return {"upserted": len(changed), "deleted": len(removed), "unchanged": len(ids) - len(changed)}
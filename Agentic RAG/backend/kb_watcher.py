@@ -0,0 +1,122 @@
+"""
+知识源热重载
+后台线程轮询知识源文件（rule_extracted.json、gameplay_knowledge_base.md、gameplay_document.md）的
+修改时间，发生变化时在请求路径之外重建知识库，构建完成后原子替换全局实例。
+进行中的请求持有旧实例的引用，始终看到一致的旧版本。
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+
+# 轮询间隔（秒）
+DEFAULT_POLL_INTERVAL = float(os.getenv('RAG_KB_WATCH_INTERVAL', '2.0'))
+# 检测到变化后等待文件写入稳定的时间（秒）
+DEFAULT_DEBOUNCE = 0.5
+
+
+def _file_signature(paths: List[str]) -> Tuple:
+    """文件签名：(路径, 修改时间, 大小)，文件不存在时记为None"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+class _WatchEntry:
+    """单个知识库的监视配置"""
+
+    def __init__(self, name: str, get_instance: Callable[[], Optional[Any]], reload: Callable[[], Any]):
+        self.name = name
+        self.get_instance = get_instance
+        self.reload = reload
+        self.instance = None
+        self.signature: Optional[Tuple] = None
+
+
+class KnowledgeSourceWatcher:
+    """
+    知识源文件监视器
+    get_instance 返回当前已加载的知识库实例（未加载时返回None，不触发加载），
+    实例的 source_paths 属性列出其依赖的源文件；
+    reload 负责构建新实例并替换全局实例
+    """
+
+    def __init__(self, interval: float = DEFAULT_POLL_INTERVAL, debounce: float = DEFAULT_DEBOUNCE):
+        self.interval = interval
+        self.debounce = debounce
+        self.reload_count = 0
+        self._entries: List[_WatchEntry] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, name: str, get_instance: Callable[[], Optional[Any]], reload: Callable[[], Any]):
+        """注册一个需要监视的知识库"""
+        self._entries.append(_WatchEntry(name, get_instance, reload))
+
+    def start(self):
+        """启动后台监视线程（守护线程，不阻止进程退出）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="kb-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止监视线程"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check_once()
+
+    def check_once(self) -> List[str]:
+        """检查一次所有知识源，返回本次重新加载的知识库名称"""
+        reloaded = []
+        for entry in self._entries:
+            instance = entry.get_instance()
+            if instance is None:
+                continue
+
+            paths = list(getattr(instance, "source_paths", []))
+            signature = _file_signature(paths)
+
+            # 实例被替换（首次监视或其他地方触发了重建）时只记录基线
+            if instance is not entry.instance:
+                entry.instance = instance
+                entry.signature = signature
+                continue
+
+            if signature == entry.signature:
+                continue
+
+            # 等待文件写入完成：签名在去抖间隔内保持不变才重建
+            time.sleep(self.debounce)
+            if _file_signature(paths) != signature:
+                continue
+
+            print(f"[INFO] 检测到知识源变化，重新加载: {entry.name}")
+            start = time.perf_counter()
+            try:
+                new_instance = entry.reload()
+            except Exception as e:
+                # 重建失败时保留旧实例继续服务，记录签名避免反复重试同一版本
+                print(f"[ERROR] 重新加载 {entry.name} 失败: {e}")
+                entry.signature = signature
+                continue
+
+            # 记录重建前的签名：重建期间如果文件再次变化，下一轮会再次重载
+            entry.instance = new_instance
+            entry.signature = signature
+            self.reload_count += 1
+            reloaded.append(entry.name)
+            print(f"[INFO] {entry.name} 已热重载，耗时 {time.perf_counter() - start:.2f}s")
+        return reloaded
@@ -0,0 +1,83 @@
+"""
+关键词匹配
+知识库加载时把 {关键词: 模块列表} 编译为一个正则：关键词按前缀树合并为嵌套的分支，
+同一位置优先匹配最长的关键词；识别模块时在C实现的正则引擎中扫描输入（中英文混合，不区分大小写）。
+每次命中后从该命中的下一个字符继续查找，互相重叠的关键词都能找到；
+作为命中关键词前缀的较短关键词在构建时合并到长关键词的值中
+"""
+
+import re
+from typing import Dict, FrozenSet, Hashable, Iterable, Mapping, Optional, Set
+
+# 前缀树中标记关键词结尾的键
+_END = ""
+
+
+def _trie_pattern(node: Dict[str, dict]) -> str:
+    """前缀树 -> 正则；某个关键词在此结束时其余分支可选（贪婪匹配，优先更长的关键词）"""
+    branches = []
+    leaves = []
+    for char, child in node.items():
+        if char == _END:
+            continue
+        if len(child) == 1 and _END in child:
+            leaves.append(re.escape(char))
+        else:
+            branches.append(re.escape(char) + _trie_pattern(child))
+    if leaves:
+        branches.append(leaves[0] if len(leaves) == 1 else "[" + "".join(leaves) + "]")
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if _END in node:
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+
+class KeywordMatcher:
+    """关键词 -> 值集合 的匹配器；match() 返回文本中出现的所有关键词对应值的并集"""
+
+    def __init__(self, keywords: Mapping[str, Iterable[Hashable]]):
+        values: Dict[str, Set[Hashable]] = {}
+        for keyword, keyword_values in keywords.items():
+            if keyword:
+                values.setdefault(keyword.lower(), set()).update(keyword_values)
+
+        trie: Dict[str, dict] = {}
+        for keyword in values:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[_END] = {}
+
+        # 同一位置只返回最长的关键词，作为其前缀的关键词同时命中
+        self._values: Dict[str, FrozenSet[Hashable]] = {
+            keyword: frozenset().union(*(values[keyword[:end]] for end in range(1, len(keyword) + 1)
+                                         if keyword[:end] in values))
+            for keyword in values
+        }
+        self._pattern: Optional[re.Pattern] = re.compile(_trie_pattern(trie)) if trie else None
+        self._all_values = frozenset().union(*self._values.values())
+        self.keyword_count = len(keywords)
+
+    def match(self, text: str) -> Set[Hashable]:
+        """扫描text，返回命中关键词的值；所有值都已命中时提前结束"""
+        found: Set[Hashable] = set()
+        if self._pattern is None:
+            return found
+
+        search, values = self._pattern.search, self._values
+        total = len(self._all_values)
+        seen = set()
+        text = text.lower()
+
+        hit = search(text)
+        while hit is not None:
+            keyword = hit.group()
+            if keyword not in seen:
+                seen.add(keyword)
+                found |= values[keyword]
+                if len(found) == total:
+                    break
+            # 从命中位置的下一个字符继续，起点落在本次命中内部的关键词也能找到
+            hit = search(text, hit.start() + 1)
+
+        return found
@@ -3,25 +3,32 @@
 处理规则文档，构建向量数据库，实现RAG检索
 """
 
+import importlib.util
 import json
 import os
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+import threading
+from typing import List, Dict, Any, FrozenSet, Iterable, Optional, Tuple
+from dataclasses import dataclass, field
 import re
 
-try:
-    import chromadb
-    from chromadb.config import Settings
-    CHROMADB_AVAILABLE = True
-except ImportError:
-    CHROMADB_AVAILABLE = False
+from embedding_registry import get_embedding_model, encode_query, encode_queries, DEFAULT_EMBEDDING_MODEL
+from vector_index import NumpyVectorIndex, NUMPY_AVAILABLE, VECTOR_BACKENDS
+from embedding_store import EmbeddingStore
+from index_sync import prune_collections, stable_doc_ids, sync_collection, versioned_collection_name
+from context_budget import estimate_tokens
+from metrics import timed
+from keyword_matcher import KeywordMatcher
+from lexical_index import BM25Index
+from hybrid_search import HYBRID_SEARCH, hybrid_rank
+
+# chromadb和sentence-transformers（会连带加载torch）体积很大，
+# 这里只检查是否已安装，真正的导入推迟到首次初始化向量库时
+CHROMADB_AVAILABLE = importlib.util.find_spec("chromadb") is not None
+if not CHROMADB_AVAILABLE:
     print("警告: chromadb未安装，将使用内存存储。运行: pip install chromadb")
 
-try:
-    from sentence_transformers import SentenceTransformer
-    EMBEDDING_AVAILABLE = True
-except ImportError:
-    EMBEDDING_AVAILABLE = False
+EMBEDDING_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+if not EMBEDDING_AVAILABLE:
     print("警告: sentence-transformers未安装，将使用简单文本匹配。运行: pip install sentence-transformers")
 
 
@@ -38,6 +45,14 @@ class FunctionDoc:
     atomicity: str  # ★★★, ★★☆等
     llm_suitability: str  # 极高、高、中等
     tags: List[str]  # 功能标签
+    # 渲染后的文档片段：省略的可选字段 -> 文本（加载时预先渲染）
+    fragments: Dict[FrozenSet[str], str] = field(default_factory=dict, repr=False, compare=False)
+    # 各片段的token估算：省略的可选字段 -> token数（与fragments一同计算）
+    fragment_tokens: Dict[FrozenSet[str], int] = field(default_factory=dict, repr=False, compare=False)
+
+
+# 渲染后的整体文档文本缓存的条目上限（超出时清空）
+DOCS_TEXT_CACHE_SIZE = 256
 
 
 class KnowledgeBase:
@@ -56,6 +71,9 @@ class KnowledgeBase:
         "R1-R6": "运行时API"
     }
     
+    # 超出上下文预算时可省略的文档字段（按省略的先后顺序）
+    OPTIONAL_DOC_FIELDS = ("example",)
+    
     # 功能标签到模块的映射（用于检索）
     FUNCTION_TO_MODULE = {
         # 地图创建
@@ -143,18 +161,41 @@ class KnowledgeBase:
         "Spawn": ["R1-R6"],
     }
     
-    def __init__(self, rule_file: str = "rule_extracted.json"):
-        """初始化知识库"""
+    def __init__(self, rule_file: str = "rule_extracted.json", embedding_model_name: str = DEFAULT_EMBEDDING_MODEL,
+                 vector_backend: Optional[str] = None, hybrid_search: Optional[bool] = None):
+        """
+        初始化知识库
+        vector_backend: 检索后端，"chroma"（默认）或 "numpy"（进程内向量索引），
+                        未指定时读取环境变量 RAG_VECTOR_BACKEND
+        hybrid_search: 向量检索时是否同时执行BM25检索并做排名融合，未指定时读取环境变量 RAG_HYBRID_SEARCH
+        """
         self.rule_file = rule_file
+        self.embedding_model_name = embedding_model_name
+        self.vector_backend = (vector_backend or os.getenv('RAG_VECTOR_BACKEND', 'chroma')).lower()
+        if self.vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"未知的检索后端: {self.vector_backend}，可选: {VECTOR_BACKENDS}")
+        self.hybrid_search = HYBRID_SEARCH if hybrid_search is None else hybrid_search
         self.functions: List[FunctionDoc] = []
+        self.source_paths: List[str] = []  # 实际加载的源文件（用于热重载监视）
+        self.doc_ids: List[str] = []  # 与functions一一对应的向量库文档ID
+        self._id_to_index: Dict[str, int] = {}  # 文档ID -> functions下标
+        self._module_index: Dict[str, List[int]] = {}  # 模块 -> functions下标列表（按文件顺序）
+        self._keyword_matcher = KeywordMatcher(self.FUNCTION_TO_MODULE)  # 关键词 -> 模块的匹配器（编译好的正则）
+        self._lexical_index = BM25Index([])  # 文本匹配回退使用的BM25倒排索引
+        self._module_headers: Dict[str, str] = {}  # 模块 -> 渲染后的模块标题
+        self._docs_text_cache: Dict[Tuple[Any, ...], str] = {}  # (函数, 省略字段) -> 整体文档文本
         self.vector_db = None
         self.embedding_model = None
+        self._chroma_client = None
+        self.collection_name: Optional[str] = None  # 当前版本使用的ChromaDB集合名
         
         # 加载规则文档
         self._load_rules()
         
-        # 初始化向量数据库
-        if CHROMADB_AVAILABLE:
+        # 初始化向量检索后端
+        if self.vector_backend == "numpy" and NUMPY_AVAILABLE:
+            self._init_numpy_index()
+        elif CHROMADB_AVAILABLE:
             self._init_vector_db()
         else:
             print("使用简单文本匹配模式")
@@ -178,6 +219,8 @@ class KnowledgeBase:
             print(f"警告: 规则文件不存在，尝试的路径: {possible_paths}")
             return
         
+        self.source_paths = [os.path.abspath(rule_path)]
+        
         with open(rule_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
@@ -215,8 +258,44 @@ class KnowledgeBase:
                 except Exception as e:
                     print(f"解析函数文档时出错 (表格{table_idx}, 行{row_idx}): {e}")
         
+        self._build_lookup_tables()
+        
         print(f"已加载 {len(self.functions)} 个函数文档")
     
+    def _build_lookup_tables(self):
+        """构建文档ID和模块的查找表，检索时无需线性扫描functions"""
+        # 文档ID由模块和函数签名派生，规则文件增删条目不会导致其他文档ID变化
+        self.doc_ids = stable_doc_ids([f"{func.module}|{func.lua_signature}" for func in self.functions])
+        self._id_to_index = {doc_id: idx for idx, doc_id in enumerate(self.doc_ids)}
+        self._module_index = {}
+        for idx, func in enumerate(self.functions):
+            self._module_index.setdefault(func.module, []).append(idx)
+        self._lexical_index = BM25Index([self._build_lexical_text(func) for func in self.functions],
+                                        groups=[func.module for func in self.functions])
+        self._render_fragments()
+    
+    def _render_fragments(self):
+        """预先渲染每个函数文档在各精简级别（去掉前k个可选字段）下的片段，以及各模块标题"""
+        levels = [frozenset(self.OPTIONAL_DOC_FIELDS[:k]) for k in range(len(self.OPTIONAL_DOC_FIELDS) + 1)]
+        for func in self.functions:
+            func.fragments = {omit: self._render_function_doc(func, omit) for omit in levels}
+            func.fragment_tokens = {omit: estimate_tokens(text) for omit, text in func.fragments.items()}
+        self._module_headers = {module: self._render_module_header(module) for module in self._module_index}
+        self._docs_text_cache = {}
+    
+    def _build_lexical_text(self, func: FunctionDoc) -> str:
+        """构建用于文本匹配的文档文本（不含示例代码，避免示例中的通用调用稀释得分）"""
+        return " ".join([func.lua_signature, func.description, func.parameters, func.category] + func.tags)
+    
+    def _indices_for_modules(self, modules: List[str]) -> List[int]:
+        """返回指定模块下的函数下标（按文件顺序）"""
+        if len(modules) == 1:
+            return self._module_index.get(modules[0], [])
+        wanted = set(modules)
+        indices = [idx for module, idx_list in self._module_index.items() if module in wanted for idx in idx_list]
+        indices.sort()
+        return indices
+    
     def _extract_category(self, lua_sig: str) -> str:
         """从函数签名提取类别"""
         if "CreateMap" in lua_sig:
@@ -266,36 +345,64 @@ class KnowledgeBase:
         
         return list(set(tags))
     
-    def _init_vector_db(self):
-        """初始化向量数据库"""
-        if not CHROMADB_AVAILABLE:
-            return
-        
-        # 初始化嵌入模型
+    def _load_embedding_model(self):
+        """加载嵌入模型（进程内共享，与奇遇知识库共用同一实例）"""
         if EMBEDDING_AVAILABLE:
             try:
-                self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-                print("已加载多语言嵌入模型")
+                self.embedding_model = get_embedding_model(self.embedding_model_name)
             except Exception as e:
                 print(f"加载嵌入模型失败: {e}，使用简单文本匹配")
                 self.embedding_model = None
         else:
             self.embedding_model = None
+    
+    def _init_numpy_index(self):
+        """初始化进程内NumPy向量索引（不依赖ChromaDB）"""
+        self._load_embedding_model()
+        if not self.embedding_model or not self.functions:
+            return
+        
+        documents = [self._build_document_text(func) for func in self.functions]
+        embeddings = self._encode_documents(documents)
+        
+        # 向量缓存中的矩阵已按行归一化，索引直接使用（全部命中时为内存映射，不复制）
+        index = NumpyVectorIndex()
+        index.build(
+            ids=self.doc_ids,
+            embeddings=embeddings,
+            modules=[func.module for func in self.functions],
+            normalized=True
+        )
+        self.vector_db = index
+        print(f"NumPy向量索引已初始化，包含 {index.count()} 个文档")
+    
+    def _init_vector_db(self):
+        """初始化向量数据库"""
+        if not CHROMADB_AVAILABLE:
+            return
+        
+        # 初始化嵌入模型
+        self._load_embedding_model()
         
         # 初始化ChromaDB（使用新版本API）
         try:
+            import chromadb
+            
             # 使用新版本的ChromaDB客户端
-            client = chromadb.PersistentClient(path="./chroma_db")
+            self._chroma_client = chromadb.PersistentClient(path="./chroma_db")
             
-            # 获取或创建集合
-            self.vector_db = client.get_or_create_collection(
-                name="lua_functions",
+            # 获取或创建当前版本的集合（集合名带内容摘要，热重载时不改动旧版本的集合）
+            self.collection_name = versioned_collection_name(
+                "lua_functions", self.doc_ids, [self._build_document_text(func) for func in self.functions],
+                self.embedding_model_name
+            )
+            self.vector_db = self._chroma_client.get_or_create_collection(
+                name=self.collection_name,
                 metadata={"description": "LUA API function documents"}
             )
             
-            # 如果集合为空，添加文档
-            if self.vector_db.count() == 0:
-                self._index_functions()
+            # 按文档哈希增量同步（只处理新增、变化和删除的文档）
+            self._sync_index()
             
             print(f"向量数据库已初始化，包含 {self.vector_db.count()} 个文档")
             
@@ -303,18 +410,30 @@ class KnowledgeBase:
             print(f"初始化向量数据库失败: {e}")
             self.vector_db = None
     
-    def _index_functions(self):
-        """将函数文档索引到向量数据库"""
-        if not self.vector_db or not self.embedding_model:
+    def has_vector_index(self) -> bool:
+        """向量检索后端是否可用"""
+        return bool(self.vector_db and self.embedding_model)
+    
+    def prune_index_versions(self, keep: Iterable[str] = ()):
+        """删除ChromaDB中除当前版本和keep以外的其他版本集合（numpy后端无需处理）"""
+        if not self._chroma_client or not self.collection_name:
             return
-        
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for idx, func in enumerate(self.functions):
-            # 构建文档文本
-            doc_text = f"""
+        removed = prune_collections(self._chroma_client, "lua_functions", {self.collection_name, *keep})
+        if removed:
+            print(f"[INFO] 已删除旧版本向量集合: {', '.join(removed)}")
+    
+    def drop_index(self):
+        """删除当前版本的ChromaDB集合（新版本未通过校验、不会被使用时清理）"""
+        if not self._chroma_client or not self.collection_name:
+            return
+        try:
+            self._chroma_client.delete_collection(self.collection_name)
+        except Exception as e:
+            print(f"[WARN] 删除向量集合 {self.collection_name} 失败: {e}")
+    
+    def _build_document_text(self, func: FunctionDoc) -> str:
+        """构建用于嵌入的文档文本"""
+        doc_text = f"""
 函数: {func.lua_signature}
 说明: {func.description}
 参数: {func.parameters}
@@ -323,7 +442,29 @@ class KnowledgeBase:
 类别: {func.category}
 标签: {', '.join(func.tags)}
 """
-            documents.append(doc_text.strip())
+        return doc_text.strip()
+    
+    def _encode_documents(self, documents: List[str]):
+        """编码文档文本（经过磁盘向量缓存，只对文本发生变化的文档重新编码）"""
+        if not NUMPY_AVAILABLE:
+            return self.embedding_model.encode(documents)
+        
+        store = EmbeddingStore("lua_functions", self.embedding_model_name)
+        embeddings = store.get_embeddings(documents, self.embedding_model.encode)
+        print(f"文档向量: 复用缓存 {store.last_reused} 个，重新编码 {store.last_encoded} 个")
+        return embeddings
+    
+    def _sync_index(self):
+        """将函数文档增量同步到向量数据库"""
+        if not self.vector_db or not self.embedding_model:
+            return
+        
+        documents = []
+        metadatas = []
+        ids = []
+        
+        for doc_id, func in zip(self.doc_ids, self.functions):
+            documents.append(self._build_document_text(func))
             
             metadata = {
                 "lua_signature": func.lua_signature,
@@ -332,30 +473,17 @@ class KnowledgeBase:
                 "tags": ",".join(func.tags)
             }
             metadatas.append(metadata)
-            ids.append(f"func_{idx}")
-        
-        # 生成嵌入向量
-        embeddings = self.embedding_model.encode(documents).tolist()
+            ids.append(doc_id)
         
-        # 添加到数据库
-        self.vector_db.add(
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
+        # 只有存在变化时才会编码（且经过向量缓存）
+        stats = sync_collection(self.vector_db, ids, documents, metadatas, embed=self._encode_documents)
         
-        print(f"已索引 {len(documents)} 个函数文档")
+        print(f"向量数据库同步完成: 更新 {stats['upserted']} 个，删除 {stats['deleted']} 个，未变化 {stats['unchanged']} 个")
     
     def identify_required_modules(self, user_input: str) -> List[str]:
         """识别用户需求中需要的功能模块"""
-        user_lower = user_input.lower()
-        required_modules = set()
-        
-        # 基于关键词匹配
-        for keyword, modules in self.FUNCTION_TO_MODULE.items():
-            if keyword.lower() in user_lower:
-                required_modules.update(modules)
+        # 基于关键词匹配（编译好的正则，一次扫描）
+        required_modules = self._keyword_matcher.match(user_input)
         
         # 如果没有匹配到，返回核心模块
         if not required_modules:
@@ -363,122 +491,204 @@ class KnowledgeBase:
         
         return sorted(list(required_modules))
     
+    def warm_queries(self, queries: List[str]):
+        """预先批量编码查询向量并写入LRU缓存（批量生成时多个条目共享一次编码）"""
+        queries = [q for q in queries if q]
+        if queries and self.vector_db and self.embedding_model:
+            encode_queries(queries, self.embedding_model_name)
+    
+    @timed("retrieve_functions")
     def retrieve_functions(self, modules: List[str] = None, query: str = None, top_k: int = 20) -> List[FunctionDoc]:
-        """检索相关函数"""
-        results = []
-        
-        # 如果指定了模块，先按模块过滤
+        """
+        检索相关函数
+        语义检索时结果按相似度排序（启用混合检索时按与BM25排名融合后的顺序）；否则按BM25得分排序
+        """
+        # 如果指定了模块，先按模块过滤（使用预先构建的模块索引）
         if modules:
-            filtered_funcs = [f for f in self.functions if f.module in modules]
+            candidate_indices = self._indices_for_modules(modules)
+            filtered_funcs = [self.functions[idx] for idx in candidate_indices]
         else:
+            candidate_indices = None
             filtered_funcs = self.functions
         
         # 如果有查询词，进行语义检索
         if query and self.vector_db and self.embedding_model:
             try:
-                # 生成查询向量
-                query_embedding = self.embedding_model.encode([query]).tolist()[0]
-                
-                # 检索
-                db_results = self.vector_db.query(
-                    query_embeddings=[query_embedding],
-                    n_results=min(top_k, len(filtered_funcs)),
-                    where={"module": {"$in": modules}} if modules else None
-                )
-                
-                # 匹配结果
-                retrieved_ids = db_results['ids'][0] if db_results['ids'] else []
-                retrieved_funcs = {}
-                
-                for func_id in retrieved_ids:
-                    idx = int(func_id.split('_')[1])
-                    if idx < len(self.functions):
-                        retrieved_funcs[idx] = self.functions[idx]
-                
-                # 合并模块过滤和语义检索的结果
-                for func in filtered_funcs:
-                    func_idx = self.functions.index(func)
-                    if func_idx in retrieved_funcs or not query:
-                        results.append(func)
-                
-                # 去重
-                seen = set()
-                unique_results = []
-                for func in results:
-                    sig = func.lua_signature
-                    if sig not in seen:
-                        seen.add(sig)
-                        unique_results.append(func)
-                
-                results = unique_results[:top_k]
+                if self.hybrid_search:
+                    # 融合后保留全部候选，由 _merge_ranked_results 去重并截取top_k
+                    rows = hybrid_rank(
+                        lambda n: [self._id_to_index[doc_id]
+                                   for doc_id in self._vector_search_ids(query, modules, min(n, len(filtered_funcs)))
+                                   if doc_id in self._id_to_index],
+                        lambda n: self._lexical_search_rows(query, modules, n),
+                        len(self.functions),
+                        len(filtered_funcs)
+                    )
+                    retrieved_ids = [self.doc_ids[idx] for idx in rows]
+                else:
+                    retrieved_ids = self._vector_search_ids(query, modules, min(top_k, len(filtered_funcs)))
+                return self._merge_ranked_results(retrieved_ids, candidate_indices, top_k)
                 
             except Exception as e:
                 print(f"向量检索失败: {e}，使用文本匹配")
-                results = self._text_search(filtered_funcs, query, top_k)
-        else:
-            # 简单文本搜索
-            results = self._text_search(filtered_funcs, query, top_k)
+                return self._text_search(filtered_funcs, modules, query, top_k)
+        
+        # BM25文本匹配
+        return self._text_search(filtered_funcs, modules, query, top_k)
+    
+    def _vector_search_ids(self, query: str, modules: Optional[List[str]], n_results: int) -> List[str]:
+        """向量检索，返回按相似度降序的文档ID"""
+        # 生成查询向量（经过进程内LRU缓存）
+        with timed("embedding_encode"):
+            query_embedding = encode_query(query, self.embedding_model_name).tolist()
+        
+        with timed("vector_query"):
+            db_results = self.vector_db.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                where={"module": {"$in": modules}} if modules else None
+            )
+        return db_results['ids'][0] if db_results['ids'] else []
+    
+    def _lexical_search_rows(self, query: str, modules: Optional[List[str]], top_k: int) -> List[int]:
+        """BM25检索，返回按得分降序的函数下标"""
+        with timed("lexical_search"):
+            hits = self._lexical_index.search(query, top_k, set(modules) if modules else None)
+        return [idx for idx, _ in hits]
+    
+    def _merge_ranked_results(self, retrieved_ids: List[str], candidate_indices: Optional[List[int]], top_k: int) -> List[FunctionDoc]:
+        """
+        将向量检索返回的文档ID映射回函数文档
+        保持相似度排序，过滤不在候选模块内的结果，并按函数签名去重
+        """
+        allowed = set(candidate_indices) if candidate_indices is not None else None
+        seen = set()
+        results = []
+        
+        for func_id in retrieved_ids:
+            idx = self._id_to_index.get(func_id)
+            if idx is None or (allowed is not None and idx not in allowed):
+                continue
+            func = self.functions[idx]
+            if func.lua_signature in seen:
+                continue
+            seen.add(func.lua_signature)
+            results.append(func)
+            if len(results) >= top_k:
+                break
         
         return results
     
-    def _text_search(self, funcs: List[FunctionDoc], query: str, top_k: int) -> List[FunctionDoc]:
-        """简单文本搜索"""
+    def _text_search(self, funcs: List[FunctionDoc], modules: Optional[List[str]],
+                     query: str, top_k: int) -> List[FunctionDoc]:
+        """BM25文本匹配（funcs为按modules过滤后的候选函数，查询为空时按文件顺序返回）"""
         if not query:
             return funcs[:top_k]
-        
-        query_lower = query.lower()
-        scored_funcs = []
-        
-        for func in funcs:
-            score = 0
-            text = (func.lua_signature + " " + func.description + " " + func.category).lower()
-            
-            # 关键词匹配
-            for tag in func.tags:
-                if tag.lower() in query_lower:
-                    score += 2
-            
-            if query_lower in text:
-                score += 1
-            
-            if score > 0:
-                scored_funcs.append((score, func))
-        
-        # 按分数排序
-        scored_funcs.sort(key=lambda x: x[0], reverse=True)
-        
-        return [f for _, f in scored_funcs[:top_k]]
+        return [self.functions[idx] for idx in self._lexical_search_rows(query, modules, top_k)]
+    
+    def function_doc_tokens(self, func: FunctionDoc, omit_fields: Iterable[str] = ()) -> int:
+        """单个函数文档渲染结果的token估算（加载时与文档片段一同计算）"""
+        omit = frozenset(omit_fields).intersection(self.OPTIONAL_DOC_FIELDS)
+        tokens = func.fragment_tokens.get(omit)
+        if tokens is None:
+            tokens = func.fragment_tokens[omit] = estimate_tokens(self.format_function_doc(func, omit))
+        return tokens
+    
+    def format_function_doc(self, func: FunctionDoc, omit_fields: Iterable[str] = ()) -> str:
+        """返回单个函数文档的渲染结果；omit_fields 中的可选字段（见 OPTIONAL_DOC_FIELDS）不输出"""
+        omit = frozenset(omit_fields).intersection(self.OPTIONAL_DOC_FIELDS)
+        fragment = func.fragments.get(omit)
+        if fragment is None:
+            fragment = func.fragments[omit] = self._render_function_doc(func, omit)
+        return fragment
+    
+    def _render_function_doc(self, func: FunctionDoc, omit_fields: FrozenSet[str]) -> str:
+        """渲染单个函数文档"""
+        lines = [
+            f"### {func.lua_signature}",
+            f"**说明**: {func.description}",
+            f"**参数**: {func.parameters}",
+        ]
+        if func.example and "example" not in omit_fields:
+            lines.append(f"**示例**: {func.example}")
+        lines.append("")
+        return "\n".join(lines)
+    
+    def _render_module_header(self, module: str) -> str:
+        """渲染模块标题"""
+        return f"\n## {self.MODULE_MAPPING.get(module, module)} ({module})\n"
     
-    def get_function_docs_text(self, functions: List[FunctionDoc]) -> str:
-        """将函数文档转换为文本格式，用于注入到提示词"""
+    def get_function_docs_text(self, functions: List[FunctionDoc],
+                               omit_fields: Optional[List[Iterable[str]]] = None) -> str:
+        """
+        将函数文档转换为文本格式，用于注入到提示词
+        omit_fields: 与functions一一对应，每个函数文档省略的可选字段（用于按token预算精简）
+        相同的函数和省略字段直接返回缓存的文本
+        """
         if not functions:
             return ""
         
+        key = (tuple(id(func) for func in functions),
+               tuple(frozenset(fields) for fields in omit_fields) if omit_fields else None)
+        text = self._docs_text_cache.get(key)
+        if text is None:
+            text = self._join_function_docs(functions, omit_fields)
+            if len(self._docs_text_cache) >= DOCS_TEXT_CACHE_SIZE:
+                self._docs_text_cache.clear()
+            self._docs_text_cache[key] = text
+        return text
+    
+    def _join_function_docs(self, functions: List[FunctionDoc], omit_fields: Optional[List[Iterable[str]]]) -> str:
+        """按模块分组拼接预先渲染的模块标题和文档片段"""
         text_parts = []
         current_module = None
         
-        for func in functions:
+        for i, func in enumerate(functions):
             if func.module != current_module:
                 current_module = func.module
-                module_name = self.MODULE_MAPPING.get(current_module, current_module)
-                text_parts.append(f"\n## {module_name} ({current_module})\n")
+                header = self._module_headers.get(current_module)
+                text_parts.append(header if header is not None else self._render_module_header(current_module))
             
-            text_parts.append(f"### {func.lua_signature}")
-            text_parts.append(f"**说明**: {func.description}")
-            text_parts.append(f"**参数**: {func.parameters}")
-            if func.example:
-                text_parts.append(f"**示例**: {func.example}")
-            text_parts.append("")
+            text_parts.append(self.format_function_doc(func, omit_fields[i] if omit_fields else ()))
         
         return "\n".join(text_parts)
 
 
 # 全局知识库实例
 _kb_instance = None
+_kb_lock = threading.Lock()
 
 def get_knowledge_base() -> KnowledgeBase:
     """获取知识库单例"""
     global _kb_instance
     if _kb_instance is None:
-        _kb_instance = KnowledgeBase()
+        with _kb_lock:
+            if _kb_instance is None:
+                _kb_instance = KnowledgeBase()
+                # 进程内首个实例：此前版本的集合已无人使用
+                _kb_instance.prune_index_versions()
+    return _kb_instance
+
+def current_knowledge_base() -> Optional[KnowledgeBase]:
+    """返回已加载的知识库实例（未加载时返回None，不触发加载）"""
     return _kb_instance
+
+def reload_knowledge_base() -> KnowledgeBase:
+    """
+    重新构建知识库并原子替换单例
+    新实例完整构建后才替换，进行中的请求继续使用各自持有的旧实例（及其向量集合）；
+    新实例没有函数文档或向量索引未能初始化时（如规则文件正在写入）抛出RuntimeError并保留旧实例
+    """
+    global _kb_instance
+    old_kb = _kb_instance
+    new_kb = KnowledgeBase()
+    if not new_kb.functions or (old_kb is not None and old_kb.has_vector_index() and not new_kb.has_vector_index()):
+        if old_kb is None or new_kb.collection_name != old_kb.collection_name:
+            new_kb.drop_index()
+        raise RuntimeError(f"新知识库不可用（函数文档 {len(new_kb.functions)} 个，"
+                           f"向量索引{'已' if new_kb.has_vector_index() else '未'}初始化），保留当前版本")
+    with _kb_lock:
+        _kb_instance = new_kb
+    # 上一版本的集合保留给仍持有旧实例的请求，更早的版本已无人使用
+    new_kb.prune_index_versions(keep=[old_kb.collection_name] if old_kb and old_kb.collection_name else [])
+    return new_kb
@@ -0,0 +1,92 @@
+"""
+BM25词法索引
+没有嵌入模型时的文本检索：知识库加载时把每个函数文档分词后建立倒排索引，
+查询只访问查询词的倒排列表，耗时与命中文档数有关，与文档总数无关。
+分词同时适用中英文：
+- 中文按相邻两字切分（单字成段时保留单字），不依赖分词词典
+- 英文和API名按驼峰、下划线、数字拆分（AddEnemySpawn -> add, enemy, spawn），并保留完整名称
+"""
+
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Container, Dict, List, Optional, Sequence, Tuple
+
+# 中日韩统一表意文字（含扩展A区和兼容区）与ASCII词
+_TOKEN_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[A-Za-z0-9_]+')
+# 驼峰拆分：NPCName -> NPC, Name；AddEnemySpawn -> Add, Enemy, Spawn
+_WORD_PART = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切分为小写词项（中文两字一组，英文按驼峰拆分）"""
+    tokens: List[str] = []
+    if not text:
+        return tokens
+
+    for run in _TOKEN_RUN.findall(text):
+        if run[0].isascii():
+            parts = _WORD_PART.findall(run)
+            tokens.extend(part.lower() for part in parts)
+            if len(parts) > 1:
+                # 完整的API名，精确提到函数名时得分更高
+                tokens.append(run.lower())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    文档下标 -> BM25得分 的倒排索引
+    每个倒排项在构建时预先算好 idf * 词频归一化 的得分，查询只需累加
+    """
+
+    def __init__(self, documents: Sequence[str], groups: Optional[Sequence[str]] = None,
+                 k1: float = 1.2, b: float = 0.75):
+        """groups: 与documents一一对应的分组（如模块名），检索时可按分组过滤"""
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(documents)
+
+        term_freqs = [Counter(tokenize(doc)) for doc in documents]
+        lengths = [sum(freqs.values()) for freqs in term_freqs]
+        avg_length = (sum(lengths) / self.doc_count) if self.doc_count else 0.0
+
+        doc_freq: Counter = Counter()
+        for freqs in term_freqs:
+            doc_freq.update(freqs.keys())
+
+        postings: Dict[str, List[Tuple[int, float]]] = {}
+        for idx, freqs in enumerate(term_freqs):
+            norm = k1 * (1 - b + b * lengths[idx] / avg_length) if avg_length else k1
+            for term, tf in freqs.items():
+                df = doc_freq[term]
+                idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+                postings.setdefault(term, []).append((idx, idf * tf * (k1 + 1) / (tf + norm)))
+
+        self._postings = postings
+        self._groups = list(groups) if groups is not None else None
+        self.term_count = len(postings)
+
+    def search(self, query: str, top_k: int,
+               groups: Optional[Container[str]] = None) -> List[Tuple[int, float]]:
+        """
+        返回得分最高的top_k个 (文档下标, 得分)，得分相同时按文档下标排序
+        groups: 只返回属于这些分组的文档，None表示不限制
+        """
+        if top_k <= 0:
+            return []
+
+        doc_groups = self._groups if groups is not None else None
+        scores: Dict[int, float] = {}
+        for term, weight in Counter(tokenize(query)).items():
+            for idx, score in self._postings.get(term, ()):
+                if doc_groups is not None and doc_groups[idx] not in groups:
+                    continue
+                scores[idx] = scores.get(idx, 0.0) + score * weight
+
+        return heapq.nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,228 @@
+"""
+LLM响应缓存
+以 (base_url, 模型, 消息, 采样参数) 的哈希为键，将完成结果保存在SQLite中，
+支持TTL过期和按总大小的LRU淘汰；temperature > 0 时默认不使用缓存（输出本身是随机的）
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+# 是否启用缓存（默认关闭）
+LLM_CACHE_ENABLED = os.getenv('RAG_LLM_CACHE', '0') == '1'
+# temperature > 0 时是否也使用缓存
+LLM_CACHE_NONDETERMINISTIC = os.getenv('RAG_LLM_CACHE_NONDETERMINISTIC', '0') == '1'
+# 缓存文件，默认位于backend/llm_cache/responses.sqlite3
+LLM_CACHE_PATH = os.getenv(
+    'RAG_LLM_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache", "responses.sqlite3")
+)
+# 条目有效期（秒），默认7天；<=0 表示不过期
+LLM_CACHE_TTL = float(os.getenv('RAG_LLM_CACHE_TTL', str(7 * 24 * 3600)))
+# 缓存总大小上限（MB），超出时淘汰最久未使用的条目
+LLM_CACHE_MAX_MB = float(os.getenv('RAG_LLM_CACHE_MAX_MB', '256'))
+
+# 参与缓存键计算的采样参数
+KEY_PARAMS = ("temperature", "top_p", "max_tokens", "frequency_penalty", "presence_penalty")
+
+
+def cache_key(base_url: str, params: Dict[str, Any]) -> str:
+    """缓存键：base_url、模型、消息和采样参数的规范化JSON的SHA-256"""
+    payload = {
+        "base_url": (base_url or "").rstrip('/'),
+        "model": params.get("model"),
+        "messages": params.get("messages"),
+    }
+    for name in KEY_PARAMS:
+        payload[name] = params.get(name)
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite存储的LLM响应缓存
+    每个线程使用独立的连接（WAL模式，多线程/多进程可同时读写）
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL, max_mb: float = LLM_CACHE_MAX_MB,
+                 enabled: bool = LLM_CACHE_ENABLED, nondeterministic: bool = LLM_CACHE_NONDETERMINISTIC):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = enabled
+        self.nondeterministic = nondeterministic
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evicted = 0
+        self.saved_seconds = 0.0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    init_conn = sqlite3.connect(self.path, timeout=10)
+                    init_conn.execute("PRAGMA journal_mode=WAL")
+                    init_conn.execute("""
+                        CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT PRIMARY KEY,
+                            response TEXT NOT NULL,
+                            created REAL NOT NULL,
+                            last_access REAL NOT NULL,
+                            size INTEGER NOT NULL,
+                            latency REAL NOT NULL,
+                            hits INTEGER NOT NULL DEFAULT 0
+                        )
+                    """)
+                    init_conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+                    init_conn.commit()
+                    init_conn.close()
+                    self._initialized = True
+
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        return conn
+
+    def should_cache(self, params: Dict[str, Any]) -> bool:
+        """是否对本次调用使用缓存；temperature > 0 时除非显式允许否则绕过"""
+        if not self.enabled:
+            return False
+        if (params.get("temperature") or 0) > 0 and not self.nondeterministic:
+            with self._stats_lock:
+                self.bypassed += 1
+            return False
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存；过期条目视为未命中并删除"""
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT response, created, latency FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl > 0 and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                row = None
+            if row is not None:
+                conn.execute(
+                    "UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"读取LLM缓存失败: {e}")
+            row = None
+
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += row[2]
+        print(f"[INFO] LLM缓存命中，节省 {row[2]:.2f}s")
+        return row[0]
+
+    def put(self, key: str, response: str, latency: float):
+        """写入缓存（latency为本次实际调用耗时，命中时计为节省的时间），必要时按LRU淘汰"""
+        if not response:
+            return
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_access, size, latency, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, response, now, now, size, latency)
+            )
+            conn.commit()
+            self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"写入LLM缓存失败: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """删除过期条目；总大小超出上限时按最久未使用的顺序删除"""
+        removed = 0
+        if self.ttl > 0:
+            removed += conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            keys = []
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                keys.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+            removed += len(keys)
+
+        if removed:
+            conn.commit()
+            with self._stats_lock:
+                self.evicted += removed
+
+    def clear(self):
+        """清空缓存并重置计数"""
+        try:
+            conn = self._connection()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"清空LLM缓存失败: {e}")
+        with self._stats_lock:
+            self.hits = self.misses = self.bypassed = self.evicted = 0
+            self.saved_seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        entries, total_bytes = 0, 0
+        if self.enabled:
+            try:
+                entries, total_bytes = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+            except sqlite3.Error:
+                pass
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "nondeterministic": self.nondeterministic,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evicted": self.evicted,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "entries": entries,
+                "size_bytes": total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl
+            }
+
+
+_response_cache = LLMResponseCache()
+
+
+def get_response_cache() -> LLMResponseCache:
+    """获取进程内共享的LLM响应缓存"""
+    return _response_cache
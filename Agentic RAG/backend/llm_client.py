@@ -0,0 +1,239 @@
+"""
+LLM客户端连接池
+进程内按 (api_key, base_url) 共享OpenAI客户端，底层httpx连接保持keep-alive，
+各阶段、各请求的LLM调用复用已建立的连接，不再每次重新建立TCP/TLS连接；
+每次调用的耗时、token用量和重试次数记录到 metrics
+"""
+
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from llm_cache import cache_key, get_response_cache
+from metrics import record_llm_call
+
+
+# 每个客户端的最大连接数 / 最大空闲keep-alive连接数
+POOL_MAX_CONNECTIONS = int(os.getenv('RAG_LLM_POOL_SIZE', '20'))
+POOL_MAX_KEEPALIVE = int(os.getenv('RAG_LLM_POOL_KEEPALIVE', str(POOL_MAX_CONNECTIONS)))
+# 空闲连接的保持时间（秒）
+KEEPALIVE_EXPIRY = float(os.getenv('RAG_LLM_KEEPALIVE_EXPIRY', '60'))
+# 请求超时（秒）：整体读写超时与建立连接超时
+# 默认与OpenAI SDK一致（600秒），非流式的长输出在较慢的服务上也能完成；超时后还会按 MAX_RETRIES 整体重试
+REQUEST_TIMEOUT = float(os.getenv('RAG_LLM_TIMEOUT', '600'))
+CONNECT_TIMEOUT = float(os.getenv('RAG_LLM_CONNECT_TIMEOUT', '10'))
+# OpenAI SDK内置的重试次数
+MAX_RETRIES = int(os.getenv('RAG_LLM_MAX_RETRIES', '2'))
+# 流式调用时请求在最后一块返回usage（stream_options.include_usage），不支持该参数的服务可设置为0
+STREAM_USAGE = os.getenv('RAG_LLM_STREAM_USAGE', '1') != '0'
+
+# 进程内同时进行的LLM调用上限（<=0表示不限制，默认不限制），所有请求共享；
+# 批量生成另有各自的上限（request_llm_limit），不会占满交互请求的名额
+LLM_MAX_CONCURRENCY = int(os.getenv('RAG_LLM_MAX_CONCURRENCY', '0'))
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+_clients: Dict[Tuple[str, str], Any] = {}
+_clients_lock = threading.Lock()
+
+# 当前线程本次LLM调用发出的HTTP请求数（SDK重试在调用线程内同步进行）
+_attempts = threading.local()
+
+
+def _count_attempt(request: Any):
+    _attempts.count = getattr(_attempts, "count", 0) + 1
+
+
+class ConcurrencyLimiter:
+    """LLM调用并发限制，记录当前/峰值并发数和累计等待时间"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self.wait_seconds = 0.0
+        self._semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def slot(self):
+        """占用一个并发名额，名额用尽时阻塞等待"""
+        if self._semaphore is not None:
+            start = time.perf_counter()
+            self._semaphore.acquire()
+            waited = time.perf_counter() - start
+        else:
+            waited = 0.0
+        with self._lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            self.wait_seconds += waited
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            if self._semaphore is not None:
+                self._semaphore.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "peak": self.peak,
+                "wait_seconds": round(self.wait_seconds, 3)
+            }
+
+
+_limiter = ConcurrencyLimiter(LLM_MAX_CONCURRENCY)
+# 当前请求自己的并发限制（如一次批量生成的所有条目共享），None表示只受进程级上限约束
+_request_limiter: ContextVar[Optional[ConcurrencyLimiter]] = ContextVar("llm_request_limiter", default=None)
+
+
+def llm_slot():
+    """占用一个LLM并发名额（with llm_slot(): ...）"""
+    return _limiter.slot()
+
+
+@contextmanager
+def request_llm_limit(limiter: ConcurrencyLimiter):
+    """
+    在当前上下文中使用请求级的LLM并发限制（批量生成的每个工作线程进入同一个limiter）
+    StagePipeline 提交的阶段继承调用方的上下文，阶段内的LLM调用同样受该限制
+    """
+    token = _request_limiter.set(limiter)
+    try:
+        yield limiter
+    finally:
+        _request_limiter.reset(token)
+
+
+def _pool_key(api_key: str, base_url: str) -> Tuple[str, str]:
+    """连接池键：API Key只保存哈希，避免明文常驻在键中"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest(), base_url.rstrip('/')
+
+
+def _create_client(api_key: str, base_url: str) -> Any:
+    """创建带连接池的OpenAI客户端"""
+    import httpx
+    import openai
+
+    timeout = httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+    http_client = httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        ),
+        event_hooks={"request": [_count_attempt]}
+    )
+    return openai.OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=timeout,
+        max_retries=MAX_RETRIES,
+        http_client=http_client
+    )
+
+
+def get_openai_client(api_key: str, base_url: str = DEFAULT_BASE_URL) -> Any:
+    """
+    获取共享的OpenAI客户端
+    相同 (api_key, base_url) 在进程内只创建一次，客户端本身是线程安全的，可被并发请求共用
+    """
+    base_url = base_url or DEFAULT_BASE_URL
+    key = _pool_key(api_key, base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        # 双重检查：等待锁期间其他线程可能已创建
+        client = _clients.get(key)
+        if client is None:
+            client = _create_client(api_key, base_url)
+            _clients[key] = client
+    return client
+
+
+def collect_stream(stream: Iterable[Any], on_token: Callable[[str], None]) -> Tuple[str, Any]:
+    """
+    消费 stream=True 的chat.completions响应：逐块回调增量文本
+    返回 (完整文本, usage)；服务未在最后一块返回usage时为None
+    """
+    parts = []
+    usage = None
+    for chunk in stream:
+        # 较旧的SDK未声明chunk.usage字段，此时为原始字典
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_token(delta)
+    return "".join(parts), usage
+
+
+def chat_completion(api_key: str, base_url: str, params: Dict[str, Any],
+                    on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    调用chat.completions并返回文本
+    params: model、messages及采样参数；on_token不为None时使用流式接口并逐块回调
+    经过LLM响应缓存（启用且参数满足条件时）和进程级并发限制
+    """
+    cache = get_response_cache()
+    key = cache_key(base_url, params) if cache.should_cache(params) else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            record_llm_call("cache_hit")
+            if on_token is not None:
+                on_token(cached)
+            return cached
+
+    # 复用进程内共享的客户端（keep-alive连接池）
+    client = get_openai_client(api_key, base_url)
+
+    options: Dict[str, Any] = {"stream": on_token is not None}
+    if on_token is not None and STREAM_USAGE:
+        options["extra_body"] = {"stream_options": {"include_usage": True}}
+
+    # 先占用请求级名额（批量生成），再占用进程级名额（未配置上限时不等待）
+    request_limiter = _request_limiter.get()
+    with request_limiter.slot() if request_limiter is not None else nullcontext(), llm_slot():
+        _attempts.count = 0
+        start = time.perf_counter()
+        try:
+            response = client.chat.completions.create(**params, **options)
+            if on_token is not None:
+                text, usage = collect_stream(response, on_token)
+            else:
+                text, usage = response.choices[0].message.content, response.usage
+        except Exception:
+            record_llm_call("error", time.perf_counter() - start, retries=max(_attempts.count - 1, 0))
+            raise
+        latency = time.perf_counter() - start
+    record_llm_call("ok", latency, usage, retries=max(_attempts.count - 1, 0))
+
+    if key is not None:
+        cache.put(key, text, latency)
+    return text
+
+
+def close_clients():
+    """关闭所有客户端及其连接（进程退出或更换配置时调用）"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            print(f"关闭LLM客户端失败: {e}")
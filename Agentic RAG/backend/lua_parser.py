@@ -0,0 +1,768 @@
+"""
+Lua 5.x 词法/语法分析
+纯Python实现（不依赖Lua解释器），按Lua 5.4语法把源码解析为AST：
+- tokenize(): 词法分析，注释单独记录位置（长字符串、长注释支持 [==[ ]==] 任意层级）
+- parse(): 语法分析，返回Chunk节点；语法错误抛出 LuaSyntaxError（包含行号）
+- strip_comments(): 按词法结果精确移除注释，字符串中的 "--" 不受影响
+
+goto的标签是否存在、局部变量<const>是否被赋值等语义检查不在此处进行
+"""
+
+import re
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class LuaSyntaxError(ValueError):
+    """Lua词法或语法错误"""
+
+    def __init__(self, message: str, line: int):
+        super().__init__(f"第{line}行: {message}")
+        self.message = message
+        self.line = line
+
+
+class Token(NamedTuple):
+    kind: str      # name / keyword / number / string / op / eof
+    value: Any     # 名称、关键字、运算符为原文；number为数值；string为解码后的文本
+    line: int
+    start: int     # 在源码中的起止位置
+    end: int
+    long: bool = False  # string是否为长字符串 [[ ... ]]
+
+
+class Comment(NamedTuple):
+    text: str      # 包含 "--" 的注释原文
+    line: int
+    start: int
+    end: int
+
+
+KEYWORDS = frozenset((
+    "and", "break", "do", "else", "elseif", "end", "false", "for", "function", "goto", "if", "in",
+    "local", "nil", "not", "or", "repeat", "return", "then", "true", "until", "while"
+))
+
+# 按最长匹配排列
+_OPERATORS = (
+    "...", "..", "==", "~=", "<=", ">=", "<<", ">>", "//", "::",
+    "+", "-", "*", "/", "%", "^", "#", "&", "~", "|", "<", ">", "=",
+    "(", ")", "{", "}", "[", "]", ";", ":", ",", "."
+)
+
+_TOKEN_SCANNER = re.compile(
+    r'(?P<space>[ \t\r\f\v]+)'
+    r'|(?P<newline>\n)'
+    r'|(?P<comment>--)'
+    r'|(?P<name>[A-Za-z_][A-Za-z0-9_]*)'
+    r'|(?P<number>0[xX](?:[0-9a-fA-F]*\.[0-9a-fA-F]+|[0-9a-fA-F]+\.?)(?:[pP][+-]?[0-9]+)?'
+    r'|(?:[0-9]+\.[0-9]*|\.[0-9]+|[0-9]+)(?:[eE][+-]?[0-9]+)?)'
+    r'|(?P<long_open>\[=*\[)'
+    r'|(?P<quote>["\'])'
+    r'|(?P<op>' + '|'.join(re.escape(op) for op in _OPERATORS) + r')'
+)
+_LONG_OPEN = re.compile(r'\[(=*)\[')
+_NUMBER_TAIL = re.compile(r'[A-Za-z0-9_.]+')
+_STRING_RUN = {'"': re.compile(r'[^"\\\n]+'), "'": re.compile(r"[^'\\\n]+")}
+_HEX_ESCAPE = re.compile(r'[0-9a-fA-F]{2}')
+_UNICODE_ESCAPE = re.compile(r'\{([0-9a-fA-F]+)\}')
+_DECIMAL_ESCAPE = re.compile(r'[0-9]{1,3}')
+
+_SIMPLE_ESCAPES = {
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v',
+    '\\': '\\', '"': '"', "'": "'", '\n': '\n'
+}
+
+
+def tokenize(source: str) -> Tuple[List[Token], List[Comment]]:
+    """词法分析，返回 (tokens, comments)；tokens以eof结尾"""
+    tokens: List[Token] = []
+    comments: List[Comment] = []
+    pos = 0
+    line = 1
+    length = len(source)
+
+    # 首行的 #! 行（与lua解释器一致）
+    if source.startswith('#'):
+        pos = source.find('\n')
+        pos = length if pos == -1 else pos
+
+    while pos < length:
+        match = _TOKEN_SCANNER.match(source, pos)
+        if match is None:
+            raise LuaSyntaxError(f"无法识别的字符 {source[pos]!r}", line)
+        kind = match.lastgroup
+        start, end = match.span()
+
+        if kind == 'space':
+            pass
+        elif kind == 'newline':
+            line += 1
+        elif kind == 'comment':
+            long_match = _LONG_OPEN.match(source, end)
+            if long_match:
+                end, _ = _read_long_bracket(source, long_match, line, "注释")
+            else:
+                end = source.find('\n', end)
+                end = length if end == -1 else end
+            comments.append(Comment(source[start:end], line, start, end))
+            line += source.count('\n', start, end)
+        elif kind == 'name':
+            text = match.group()
+            tokens.append(Token('keyword' if text in KEYWORDS else 'name', text, line, start, end))
+        elif kind == 'number':
+            # 数字后紧跟字母、数字或点（如 3..2、12abc）为非法数字
+            tail = _NUMBER_TAIL.match(source, end)
+            if tail:
+                end = tail.end()
+                raise LuaSyntaxError(f"非法的数字 {source[start:end]!r}", line)
+            tokens.append(Token('number', _parse_number(match.group()), line, start, end))
+        elif kind == 'long_open':
+            end, value = _read_long_bracket(source, _LONG_OPEN.match(source, start), line, "字符串")
+            tokens.append(Token('string', value, line, start, end, True))
+            line += source.count('\n', start, end)
+        elif kind == 'quote':
+            end, value = _read_quoted_string(source, start, line)
+            tokens.append(Token('string', value, line, start, end))
+            line += source.count('\n', start, end)
+        else:
+            tokens.append(Token('op', match.group(), line, start, end))
+        pos = end
+
+    tokens.append(Token('eof', '<eof>', line, length, length))
+    return tokens, comments
+
+
+def _read_long_bracket(source: str, open_match: "re.Match", line: int, what: str) -> Tuple[int, str]:
+    """读取 [==[ ... ]==]，返回 (结束位置, 内容)；紧跟开括号的换行不计入内容"""
+    close = f"]{open_match.group(1)}]"
+    content_start = open_match.end()
+    close_pos = source.find(close, content_start)
+    if close_pos == -1:
+        raise LuaSyntaxError(f"长{what}未闭合（缺少 {close}）", line)
+    content = source[content_start:close_pos]
+    if content.startswith('\r\n'):
+        content = content[2:]
+    elif content.startswith('\n'):
+        content = content[1:]
+    return close_pos + len(close), content
+
+
+def _read_quoted_string(source: str, start: int, line: int) -> Tuple[int, str]:
+    """读取 "..." 或 '...'，返回 (结束位置, 解码后的内容)"""
+    quote = source[start]
+    pos = start + 1
+    length = len(source)
+    parts: List[str] = []
+    while True:
+        if pos >= length:
+            raise LuaSyntaxError("字符串未闭合", line)
+        char = source[pos]
+        if char == quote:
+            return pos + 1, ''.join(parts)
+        if char == '\n':
+            raise LuaSyntaxError("字符串未闭合（字符串内不能直接换行）", line)
+        if char != '\\':
+            run = _STRING_RUN[quote].match(source, pos)
+            parts.append(run.group())
+            pos = run.end()
+            continue
+
+        # 转义序列
+        escape = source[pos + 1:pos + 2]
+        if escape in _SIMPLE_ESCAPES:
+            parts.append(_SIMPLE_ESCAPES[escape])
+            line += escape == '\n'
+            pos += 2
+        elif escape == 'x':
+            digits = source[pos + 2:pos + 4]
+            if not _HEX_ESCAPE.fullmatch(digits):
+                raise LuaSyntaxError("非法的转义序列 \\x（需要2位十六进制数）", line)
+            parts.append(chr(int(digits, 16)))
+            pos += 4
+        elif escape == 'z':
+            pos += 2
+            while pos < length and source[pos] in ' \t\r\n\f\v':
+                line += source[pos] == '\n'
+                pos += 1
+        elif escape == 'u':
+            match = _UNICODE_ESCAPE.match(source, pos + 2)
+            if not match or int(match.group(1), 16) > 0x7FFFFFFF:
+                raise LuaSyntaxError("非法的转义序列 \\u", line)
+            parts.append(chr(min(int(match.group(1), 16), 0x10FFFF)))
+            pos = match.end()
+        elif '0' <= escape <= '9':
+            digits = _DECIMAL_ESCAPE.match(source, pos + 1).group()
+            if int(digits) > 255:
+                raise LuaSyntaxError(f"转义序列 \\{digits} 超出范围", line)
+            parts.append(chr(int(digits)))
+            pos += 1 + len(digits)
+        else:
+            raise LuaSyntaxError(f"非法的转义序列 \\{escape}", line)
+
+
+def _parse_number(text: str) -> float:
+    lower = text.lower()
+    if lower.startswith('0x'):
+        if '.' in lower or 'p' in lower:
+            return float.fromhex(text)
+        return int(text, 16)
+    if '.' in lower or 'e' in lower:
+        return float(text)
+    return int(text)
+
+
+def strip_comments(source: str, long_strings: bool = False) -> str:
+    """
+    移除源码中的所有注释（长注释、行尾注释）
+    只包含注释的行整行移除，行尾注释连同其前面的空白一起移除；词法错误时抛出 LuaSyntaxError
+    long_strings=True 时同时移除长字符串 [[ ... ]] 内嵌代码中的注释（内容不是合法Lua词法时保持原样）
+    """
+    tokens, comments = tokenize(source)
+    if comments:
+        source = _remove_spans(source, comments)
+        if long_strings:
+            tokens, _ = tokenize(source)
+    if not long_strings:
+        return source
+
+    parts: List[str] = []
+    pos = 0
+    for token in tokens:
+        if not token.long:
+            continue
+        content_start = _LONG_OPEN.match(source, token.start).end()
+        content_end = token.end - (content_start - token.start)
+        try:
+            content = strip_comments(source[content_start:content_end], long_strings=True)
+        except LuaSyntaxError:
+            continue
+        parts.append(source[pos:content_start])
+        parts.append(content)
+        pos = content_end
+    parts.append(source[pos:])
+    return ''.join(parts)
+
+
+def _remove_spans(source: str, comments: List[Comment]) -> str:
+    parts: List[str] = []
+    pos = 0
+    length = len(source)
+    for comment in comments:
+        line_start = source.rfind('\n', 0, comment.start) + 1
+        line_end = source.find('\n', comment.end)
+        line_end = length if line_end == -1 else line_end
+        trailing = not source[comment.end:line_end].strip()
+        if trailing and line_start >= pos and not source[line_start:comment.start].strip():
+            # 整行都是注释：连同缩进和换行一起移除
+            parts.append(source[pos:line_start])
+            pos = min(line_end + 1, length)
+            continue
+        before = source[pos:comment.start]
+        if trailing:
+            before = before.rstrip(' \t')
+        elif before[-1:] not in ('', ' ', '\t', '\n') and source[comment.end] not in ' \t':
+            # 代码中间的长注释：保留一个空格，避免前后两个记号连在一起
+            before += ' '
+        parts.append(before)
+        pos = comment.end
+    parts.append(source[pos:])
+    return ''.join(parts)
+
+
+class Node:
+    """
+    AST节点：kind为节点类型，line为起始行，其余字段随类型不同：
+    语句 - Local(names, attribs, values) LocalFunction(name, func) Function(target, func)
+           Assign(targets, values) CallStat(call) Do(body) While(test, body) Repeat(body, test)
+           If(clauses=[(test, body)], orelse) NumericFor(var, start, stop, step, body)
+           GenericFor(names, exprs, body) Return(values) Break() Goto(label) Label(name)
+    表达式 - Nil True False Vararg Number(value) String(value, long) Name(name)
+           FunctionExpr(params, vararg, body) Table(fields=[(key, value)]，数组项的key为None)
+           BinOp(op, left, right) UnOp(op, operand) Index(obj, key) Call(func, args)
+           MethodCall(obj, method, args) Paren(expr)
+    Chunk(body) 为整个源码块，body为语句列表
+    语句和表达式节点的span为其在源码中的 (起始位置, 结束位置)，用于按节点改写源码
+    """
+
+    def __init__(self, kind: str, line: int, **fields: Any):
+        self.kind = kind
+        self.line = line
+        self.span: Optional[Tuple[int, int]] = None
+        self.__dict__.update(fields)
+
+    def children(self) -> Iterator["Node"]:
+        """直接子节点（按字段顺序）"""
+        for name, value in self.__dict__.items():
+            if name not in _NODE_ATTRIBUTES:
+                yield from _iter_nodes(value)
+
+    def walk(self) -> Iterator["Node"]:
+        """先序遍历自身及所有子孙节点"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(node.children())))
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{k}={v!r}" for k, v in self.__dict__.items() if k not in _NODE_ATTRIBUTES)
+        return f"{self.kind}({fields})"
+
+
+_NODE_ATTRIBUTES = frozenset(('kind', 'line', 'span'))
+
+
+def _iter_nodes(value: Any) -> Iterator[Node]:
+    if isinstance(value, Node):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _iter_nodes(item)
+
+
+# 二元运算符优先级 (左, 右)，与Lua 5.4的lparser.c一致
+_BINARY_PRIORITY = {
+    "or": (1, 1), "and": (2, 2),
+    "<": (3, 3), ">": (3, 3), "<=": (3, 3), ">=": (3, 3), "~=": (3, 3), "==": (3, 3),
+    "|": (4, 4), "~": (5, 5), "&": (6, 6), "<<": (7, 7), ">>": (7, 7),
+    "..": (9, 8), "+": (10, 10), "-": (10, 10),
+    "*": (11, 11), "/": (11, 11), "//": (11, 11), "%": (11, 11),
+    "^": (14, 13)
+}
+_UNARY_OPERATORS = frozenset(("not", "-", "#", "~"))
+_UNARY_PRIORITY = 12
+_BLOCK_END = frozenset(("else", "elseif", "end", "until", "<eof>"))
+
+
+class _Parser:
+    def __init__(self, tokens: List[Token]):
+        self.tokens = tokens
+        self.pos = 0
+        self.token = tokens[0]
+        # 每层函数：[是否可变参数, 循环嵌套层数]
+        self.functions: List[List[Any]] = []
+
+    # ---- 基本操作 ----
+
+    def advance(self) -> Token:
+        token = self.token
+        self.pos += 1
+        self.token = self.tokens[self.pos]
+        return token
+
+    def check(self, value: str) -> bool:
+        return self.token.kind in ('op', 'keyword') and self.token.value == value
+
+    def accept(self, value: str) -> bool:
+        if self.check(value):
+            self.advance()
+            return True
+        return False
+
+    def expect(self, value: str, opener: Optional[Token] = None) -> Token:
+        if not self.check(value):
+            if opener is not None and opener.line != self.token.line:
+                self.error(f"缺少 '{value}'（与第{opener.line}行的 '{opener.value}' 对应）")
+            self.error(f"缺少 '{value}'")
+        return self.advance()
+
+    def expect_name(self) -> str:
+        if self.token.kind != 'name':
+            self.error("缺少名称")
+        return self.advance().value
+
+    def finish(self, node: Node, start: int) -> Node:
+        """记录节点从第start个记号到上一个记号的源码范围"""
+        node.span = (self.tokens[start].start, self.tokens[self.pos - 1].end)
+        return node
+
+    def error(self, message: str):
+        token = self.token
+        near = token.value if token.kind != 'string' else '<字符串>'
+        raise LuaSyntaxError(f"{message}，位于 '{near}' 附近", token.line)
+
+    # ---- 语句 ----
+
+    def parse_chunk(self) -> Node:
+        self.functions.append([True, 0])
+        body = self.parse_block()
+        if self.token.kind != 'eof':
+            self.error("多余的 '{}'".format(self.token.value))
+        self.functions.pop()
+        return Node('Chunk', 1, body=body)
+
+    def parse_block(self) -> List[Node]:
+        body: List[Node] = []
+        while not self.at_block_end():
+            start = self.pos
+            if self.check('return'):
+                body.append(self.finish(self.parse_return(), start))
+                break
+            statement = self.parse_statement()
+            if statement is not None:
+                body.append(self.finish(statement, start))
+        return body
+
+    def parse_return(self) -> Node:
+        line = self.advance().line
+        values: List[Node] = []
+        if not self.at_block_end() and not self.check(';'):
+            values = self.parse_exprlist()
+        self.accept(';')
+        if not self.at_block_end():
+            self.error("return 必须是代码块的最后一条语句")
+        return Node('Return', line, values=values)
+
+    def at_block_end(self) -> bool:
+        return self.token.kind in ('keyword', 'eof') and self.token.value in _BLOCK_END
+
+    def parse_statement(self) -> Optional[Node]:
+        token = self.token
+        line = token.line
+        if token.kind == 'op':
+            if token.value == ';':
+                self.advance()
+                return None
+            if token.value == '::':
+                self.advance()
+                name = self.expect_name()
+                self.expect('::')
+                return Node('Label', line, name=name)
+        elif token.kind == 'keyword':
+            handler = getattr(self, f"parse_{token.value}_statement", None)
+            if handler is not None:
+                return handler()
+        return self.parse_expression_statement()
+
+    def parse_if_statement(self) -> Node:
+        opener = self.advance()
+        clauses = []
+        test = self.parse_expr()
+        self.expect('then')
+        clauses.append((test, self.parse_block()))
+        orelse: Optional[List[Node]] = None
+        while True:
+            if self.accept('elseif'):
+                test = self.parse_expr()
+                self.expect('then')
+                clauses.append((test, self.parse_block()))
+            elif self.accept('else'):
+                orelse = self.parse_block()
+                self.expect('end', opener)
+                break
+            else:
+                self.expect('end', opener)
+                break
+        return Node('If', opener.line, clauses=clauses, orelse=orelse)
+
+    def parse_while_statement(self) -> Node:
+        opener = self.advance()
+        test = self.parse_expr()
+        self.expect('do')
+        body = self.parse_loop_body()
+        self.expect('end', opener)
+        return Node('While', opener.line, test=test, body=body)
+
+    def parse_do_statement(self) -> Node:
+        opener = self.advance()
+        body = self.parse_block()
+        self.expect('end', opener)
+        return Node('Do', opener.line, body=body)
+
+    def parse_repeat_statement(self) -> Node:
+        opener = self.advance()
+        body = self.parse_loop_body()
+        self.expect('until', opener)
+        return Node('Repeat', opener.line, body=body, test=self.parse_expr())
+
+    def parse_for_statement(self) -> Node:
+        opener = self.advance()
+        first = self.expect_name()
+        if self.accept('='):
+            start = self.parse_expr()
+            self.expect(',')
+            stop = self.parse_expr()
+            step = self.parse_expr() if self.accept(',') else None
+            self.expect('do')
+            body = self.parse_loop_body()
+            self.expect('end', opener)
+            return Node('NumericFor', opener.line, var=first, start=start, stop=stop, step=step, body=body)
+
+        names = [first]
+        while self.accept(','):
+            names.append(self.expect_name())
+        self.expect('in')
+        exprs = self.parse_exprlist()
+        self.expect('do')
+        body = self.parse_loop_body()
+        self.expect('end', opener)
+        return Node('GenericFor', opener.line, names=names, exprs=exprs, body=body)
+
+    def parse_loop_body(self) -> List[Node]:
+        self.functions[-1][1] += 1
+        body = self.parse_block()
+        self.functions[-1][1] -= 1
+        return body
+
+    def parse_function_statement(self) -> Node:
+        line = self.advance().line
+        target = Node('Name', self.token.line, name=self.expect_name())
+        method = None
+        while self.check('.') or self.check(':'):
+            is_method = self.advance().value == ':'
+            key_line = self.token.line
+            key = Node('String', key_line, value=self.expect_name(), long=False)
+            if is_method:
+                method = key.value
+                break
+            target = Node('Index', key_line, obj=target, key=key)
+        func = self.parse_function_body(line, is_method=method is not None)
+        if method is not None:
+            target = Node('Index', line, obj=target, key=Node('String', line, value=method, long=False))
+        return Node('Function', line, target=target, func=func)
+
+    def parse_local_statement(self) -> Node:
+        line = self.advance().line
+        if self.accept('function'):
+            name = self.expect_name()
+            return Node('LocalFunction', line, name=name, func=self.parse_function_body(line))
+
+        names, attribs = [], []
+        while True:
+            names.append(self.expect_name())
+            attrib = None
+            if self.accept('<'):
+                attrib = self.expect_name()
+                if attrib not in ('const', 'close'):
+                    self.error(f"未知的属性 '{attrib}'")
+                self.expect('>')
+            attribs.append(attrib)
+            if not self.accept(','):
+                break
+        values = self.parse_exprlist() if self.accept('=') else []
+        return Node('Local', line, names=names, attribs=attribs, values=values)
+
+    def parse_return_statement(self) -> Node:
+        return self.parse_return()
+
+    def parse_break_statement(self) -> Node:
+        token = self.advance()
+        if not self.functions[-1][1]:
+            raise LuaSyntaxError("break 不在循环内", token.line)
+        return Node('Break', token.line)
+
+    def parse_goto_statement(self) -> Node:
+        line = self.advance().line
+        return Node('Goto', line, label=self.expect_name())
+
+    def parse_expression_statement(self) -> Node:
+        line = self.token.line
+        expr = self.parse_suffixed_expr()
+        if self.check('=') or self.check(','):
+            targets = [expr]
+            while self.accept(','):
+                targets.append(self.parse_suffixed_expr())
+            for target in targets:
+                if target.kind not in ('Name', 'Index'):
+                    self.error("赋值语句左侧不能是表达式")
+            self.expect('=')
+            return Node('Assign', line, targets=targets, values=self.parse_exprlist())
+        if expr.kind not in ('Call', 'MethodCall'):
+            self.error("语法错误（表达式不能单独作为语句）")
+        return Node('CallStat', line, call=expr)
+
+    # ---- 表达式 ----
+
+    def parse_exprlist(self) -> List[Node]:
+        exprs = [self.parse_expr()]
+        while self.accept(','):
+            exprs.append(self.parse_expr())
+        return exprs
+
+    def parse_expr(self, limit: int = 0) -> Node:
+        start = self.pos
+        token = self.token
+        if token.kind in ('op', 'keyword') and token.value in _UNARY_OPERATORS:
+            self.advance()
+            left = Node('UnOp', token.line, op=token.value, operand=self.parse_expr(_UNARY_PRIORITY))
+        else:
+            left = self.parse_simple_expr()
+
+        while True:
+            token = self.token
+            priority = _BINARY_PRIORITY.get(token.value) if token.kind in ('op', 'keyword') else None
+            if priority is None or priority[0] <= limit:
+                return self.finish(left, start)
+            self.advance()
+            right = self.parse_expr(priority[1])
+            left = self.finish(Node('BinOp', token.line, op=token.value, left=left, right=right), start)
+
+    def parse_simple_expr(self) -> Node:
+        token = self.token
+        line = token.line
+        if token.kind == 'number':
+            self.advance()
+            return Node('Number', line, value=token.value)
+        if token.kind == 'string':
+            self.advance()
+            return Node('String', line, value=token.value, long=token.long)
+        if token.kind == 'keyword':
+            if token.value in ('nil', 'true', 'false'):
+                self.advance()
+                return Node(token.value.capitalize(), line)
+            if token.value == 'function':
+                self.advance()
+                return self.parse_function_body(line)
+        elif token.kind == 'op':
+            if token.value == '...':
+                if not self.functions[-1][0]:
+                    self.error("不能在非可变参数函数中使用 '...'")
+                self.advance()
+                return Node('Vararg', line)
+            if token.value == '{':
+                return self.parse_table()
+        return self.parse_suffixed_expr()
+
+    def parse_primary_expr(self) -> Node:
+        token = self.token
+        if token.kind == 'name':
+            self.advance()
+            return Node('Name', token.line, name=token.value)
+        if self.check('('):
+            opener = self.advance()
+            expr = self.parse_expr()
+            self.expect(')', opener)
+            return Node('Paren', opener.line, expr=expr)
+        self.error("语法错误（缺少表达式）")
+
+    def parse_suffixed_expr(self) -> Node:
+        start = self.pos
+        expr = self.parse_primary_expr()
+        while True:
+            self.finish(expr, start)
+            token = self.token
+            if token.kind == 'op':
+                if token.value == '.':
+                    self.advance()
+                    key = Node('String', self.token.line, value=self.expect_name(), long=False)
+                    expr = Node('Index', token.line, obj=expr, key=key)
+                    continue
+                if token.value == '[':
+                    self.advance()
+                    key = self.parse_expr()
+                    self.expect(']', token)
+                    expr = Node('Index', token.line, obj=expr, key=key)
+                    continue
+                if token.value == ':':
+                    self.advance()
+                    method = self.expect_name()
+                    expr = Node('MethodCall', token.line, obj=expr, method=method, args=self.parse_call_args())
+                    continue
+                if token.value in ('(', '{'):
+                    expr = Node('Call', token.line, func=expr, args=self.parse_call_args())
+                    continue
+            elif token.kind == 'string':
+                expr = Node('Call', token.line, func=expr, args=self.parse_call_args())
+                continue
+            return expr
+
+    def parse_call_args(self) -> List[Node]:
+        token = self.token
+        if token.kind == 'string':
+            self.advance()
+            return [self.finish(Node('String', token.line, value=token.value, long=token.long), self.pos - 1)]
+        if self.check('{'):
+            return [self.parse_table()]
+        if not self.check('('):
+            self.error("缺少函数参数")
+        self.advance()
+        args = [] if self.check(')') else self.parse_exprlist()
+        self.expect(')', token)
+        return args
+
+    def parse_table(self) -> Node:
+        start = self.pos
+        opener = self.expect('{')
+        fields: List[Tuple[Optional[Node], Node]] = []
+        while not self.check('}'):
+            token = self.token
+            if token.kind == 'name' and self.tokens[self.pos + 1].value == '=' \
+                    and self.tokens[self.pos + 1].kind == 'op':
+                self.advance()
+                self.advance()
+                fields.append((Node('String', token.line, value=token.value, long=False), self.parse_expr()))
+            elif self.check('['):
+                self.advance()
+                key = self.parse_expr()
+                self.expect(']', token)
+                self.expect('=')
+                fields.append((key, self.parse_expr()))
+            else:
+                fields.append((None, self.parse_expr()))
+            if not (self.accept(',') or self.accept(';')):
+                break
+        self.expect('}', opener)
+        return self.finish(Node('Table', opener.line, fields=fields), start)
+
+    def parse_function_body(self, line: int, is_method: bool = False) -> Node:
+        opener = self.expect('(')
+        params: List[str] = ['self'] if is_method else []
+        vararg = False
+        if not self.check(')'):
+            while True:
+                if self.accept('...'):
+                    vararg = True
+                    break
+                params.append(self.expect_name())
+                if not self.accept(','):
+                    break
+        self.expect(')', opener)
+        self.functions.append([vararg, 0])
+        body = self.parse_block()
+        self.functions.pop()
+        self.expect('end', Token('keyword', 'function', line, 0, 0))
+        return Node('FunctionExpr', line, params=params, vararg=vararg, body=body)
+
+
+def parse(source: str) -> Node:
+    """解析Lua源码，返回Chunk节点；语法错误时抛出 LuaSyntaxError"""
+    tokens, _ = tokenize(source)
+    return _Parser(tokens).parse_chunk()
+
+
+def long_string_content(source: str, span: Tuple[int, int]) -> Tuple[int, int]:
+    """长字符串记号 [==[ ... ]==] 的内容在源码中的范围（不含紧跟开括号的换行）"""
+    start, end = span
+    open_end = _LONG_OPEN.match(source, start).end()
+    if source.startswith('\r\n', open_end):
+        content_start = open_end + 2
+    elif source.startswith('\n', open_end):
+        content_start = open_end + 1
+    else:
+        content_start = open_end
+    return content_start, end - (open_end - start)
+
+
+def call_name(node: Node) -> Optional[str]:
+    """
+    返回调用的点分名称：World.SpawnEncounter(...) -> "World.SpawnEncounter"，
+    npc:PlayAnim(...) -> "npc:PlayAnim"；被调用对象不是名称链时返回None
+    """
+    if node.kind == 'MethodCall':
+        owner = dotted_name(node.obj)
+        return f"{owner}:{node.method}" if owner else None
+    if node.kind == 'Call':
+        return dotted_name(node.func)
+    return None
+
+
+def dotted_name(node: Node) -> Optional[str]:
+    """Name / Index链（键为字符串）转为点分名称，否则返回None"""
+    parts = []
+    while node.kind == 'Index' and node.key.kind == 'String':
+        parts.append(node.key.value)
+        node = node.obj
+    if node.kind != 'Name':
+        return None
+    parts.append(node.name)
+    return '.'.join(reversed(parts))
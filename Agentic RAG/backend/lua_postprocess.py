@@ -0,0 +1,169 @@
+"""
+生成的Lua代码后处理
+所有正则在模块加载时编译，动画别名表预先构建；
+代码问题修正（玩家对话、对话方括号、动画名称）由一个合并的扫描正则在整段代码上单遍完成，
+不再逐行执行多次 re.search/re.sub
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# 动画名称的常见错误写法 -> 素材库名称（按顺序匹配：包含该写法，或以其最后一段结尾）
+ANIMATION_ALIASES: Tuple[Tuple[str, str], ...] = (
+    ("Alice_Wave", "Wave"),
+    ("Boss_Happy", "Happy"),
+    ("Alice_Angry", "Frustrated"),
+    ("Alice_Drink", "Drink"),
+    ("Alice_Stun", "Scared"),
+    ("Alice_Sleep", "Sleep"),
+    ("Alice_Shy", "Shy"),
+    ("Uncle_Happy", "Happy"),
+    ("Angry", "Frustrated"),
+    ("Sad", "Frustrated"),
+    ("Cry", "Frustrated"),
+)
+
+# 别名表未命中时按关键词映射（按顺序匹配，关键词为小写）
+ANIMATION_KEYWORDS: Tuple[Tuple[Tuple[str, ...], str], ...] = (
+    (("wave", "挥手"), "Wave"),
+    (("happy", "开心"), "Happy"),
+    (("shy", "害羞"), "Shy"),
+    (("scared", "恐惧", "stun"), "Scared"),
+    (("drink", "喝"), "Drink"),
+    (("sleep", "睡"), "Sleep"),
+    (("frustrated", "angry", "沮丧", "生气"), "Frustrated"),
+    (("dialogue", "说话"), "Dialogue"),
+)
+
+# 动画名称映射缓存的上限（生成代码中的动画名称种类很少，超出时清空）
+ANIMATION_CACHE_SIZE = 4096
+
+# 同一行内的空白（扫描整段代码时不跨行，与逐行处理一致）
+_WS = r'[^\S\n]*'
+
+# 代码问题修正的合并扫描（同一位置按顺序尝试）：
+# player  - player:ApproachAndSay(...) 改为 UI.ShowDialogue("Player", ...)
+# anim    - PlayAnim("名称") 中的动画名称
+# bracket - 函数调用第二个参数中的方括号 "[文本]" -> "文本"
+_ISSUE_SCANNER = re.compile(
+    rf'(?P<player>player:ApproachAndSay{_WS}\((?P<player_args>[^)\n]+)\))'
+    rf'|(?P<anim>(?P<anim_head>PlayAnim{_WS}\({_WS}")(?P<anim_name>[^"\n]+)(?P<anim_tail>"{_WS}\)))'
+    rf'|(?P<bracket>(?P<bracket_head>(?:ApproachAndSay{_WS}\(|ShowDialogue{_WS}\(|\w+\()[^,\n]+,{_WS})'
+    rf'"\[(?P<bracket_text>[^\]\n]+)\]")'
+)
+_BRACKETED_TEXT = re.compile(r'\[([^\]\n]+)\]')
+
+# World.SpawnEncounter参数修正
+_SPAWN_POS = r'World\.SpawnEncounter\s*\(\s*\{X=\d+,\s*Y=\d+,\s*Z=\d+\}\s*,\s*'
+_SPAWN_RANGE = re.compile(rf'{_SPAWN_POS}(\d+)\s*,')
+_SPAWN_EMPTY_NPC = re.compile(rf'{_SPAWN_POS}\d+\s*,\s*(\{{\}})\s*,')
+_SPAWN_POS_ANY = re.compile(r'World\.SpawnEncounter\s*\(\s*\{X=([^,]+),\s*Y=([^,]+),\s*Z=([^}]+)\}')
+_SPAWN_FIRST_ARG = re.compile(r'World\.SpawnEncounter\s*\(\s*[^,]+')
+_SPAWN_TYPE = re.compile(r'World\.SpawnEncounter\s*\([^,]+,[^,]+,[^,]+,\s*"([^"]+)"')
+
+DEFAULT_SPAWN_RANGE = "450"
+DEFAULT_SPAWN_POS = "World.SpawnEncounter(\n    {X=0, Y=0, Z=0}"
+
+
+class LuaPostProcessor:
+    """
+    生成代码的后处理器
+    fix_code_issues: 玩家对话、对话方括号、动画名称（单遍扫描）
+    fix_syntax_errors: World.SpawnEncounter的范围、npcData、位置、类型参数
+    """
+
+    def __init__(self, animation_library: Iterable[str]):
+        self.animation_library = frozenset(animation_library)
+        self._animation_cache: Dict[str, str] = {}
+
+    def resolve_animation(self, name: str) -> str:
+        """将动画名称映射到素材库名称（无法映射时原样返回）"""
+        resolved = self._animation_cache.get(name)
+        if resolved is None:
+            if len(self._animation_cache) >= ANIMATION_CACHE_SIZE:
+                self._animation_cache.clear()
+            resolved = self._animation_cache[name] = self._map_animation(name)
+        return resolved
+
+    def _map_animation(self, name: str) -> str:
+        if name in self.animation_library:
+            return name
+        for alias, target in ANIMATION_ALIASES:
+            if alias in name or name.endswith(alias.split('_')[-1]):
+                return target
+        lower = name.lower()
+        for keywords, target in ANIMATION_KEYWORDS:
+            if any(keyword in lower for keyword in keywords):
+                return target
+        return name
+
+    def fix_code_issues(self, code: str) -> str:
+        """
+        修正代码问题：
+        1. 将玩家对话从ApproachAndSay改为UI.ShowDialogue
+        2. 修正动画名称，确保使用素材库中的名称
+        3. 移除对话内容中的方括号（如 "[文本]" -> "文本"）
+        """
+        return _ISSUE_SCANNER.sub(self._rewrite_issue, code)
+
+    def _rewrite_issue(self, match: "re.Match") -> str:
+        if match.group('player') is not None:
+            # 参数格式假设为：npc, "text"
+            params = [p.strip().strip('"\'') for p in match.group('player_args').split(',')]
+            if len(params) < 2:
+                return match.group(0)
+            text = params[-1].strip('"\'')
+            bracketed = _BRACKETED_TEXT.fullmatch(text)
+            if bracketed:
+                text = bracketed.group(1)
+            return f'UI.ShowDialogue("Player", "{text}")'
+
+        if match.group('anim') is not None:
+            name = match.group('anim_name')
+            resolved = self.resolve_animation(name)
+            if resolved == name:
+                return match.group(0)
+            return f"{match.group('anim_head')}{resolved}{match.group('anim_tail')}"
+
+        return f'{match.group("bracket_head")}"{match.group("bracket_text")}"'
+
+    def fix_syntax_errors(self, code: str, npc_tags: Optional[List[str]] = None) -> str:
+        """
+        修正语法错误（最高优先级）
+        确保World.SpawnEncounter的语法完全正确
+        """
+        if not npc_tags:
+            npc_tags = ["Tag_A"]
+
+        # 1. 修正range参数：太小时改为450
+        match = _SPAWN_RANGE.search(code)
+        if match and int(match.group(1)) < 100:
+            code = _replace_group(code, match, 1, DEFAULT_SPAWN_RANGE)
+
+        # 2. 修正npcData参数：如果为空字典，添加默认NPC
+        match = _SPAWN_EMPTY_NPC.search(code)
+        if match:
+            npc_map = "{\n"
+            for tag in npc_tags:
+                npc_map += f'        ["{tag}"] = "NPC_Base",\n'
+            npc_map = npc_map.rstrip(",\n") + "\n    }"
+            code = _replace_group(code, match, 1, npc_map)
+
+        # 3. 确保位置参数格式正确，否则修正为 {X=0, Y=0, Z=0}
+        if not _SPAWN_POS_ANY.search(code):
+            match = _SPAWN_FIRST_ARG.search(code)
+            if match:
+                code = code[:match.start()] + DEFAULT_SPAWN_POS + code[match.end():]
+
+        # 4. 确保类型参数是 "EnterVolume"
+        match = _SPAWN_TYPE.search(code)
+        if match and match.group(1) != "EnterVolume":
+            code = _replace_group(code, match, 1, "EnterVolume")
+
+        return code
+
+
+def _replace_group(code: str, match: "re.Match", group: int, text: str) -> str:
+    """替换匹配中第group组的内容"""
+    return code[:match.start(group)] + text + code[match.end(group):]
@@ -0,0 +1,299 @@
+"""
+生成过程指标
+记录各阶段耗时、阶段内操作（查询编码、向量检索、提示词组装、代码修复等）耗时、
+LLM调用的耗时/token用量/重试次数，按 mode、agent_mode、stage 标签汇总，
+由 /api/metrics 以Prometheus文本格式输出（不依赖prometheus_client）
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# 耗时直方图的桶（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 单次LLM调用token数直方图的桶
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# 不在任何生成阶段内（如批量预编码）时使用的标签值
+UNKNOWN = "none"
+# agent_mode 标签的取值（来自请求的 config.agentMode），其余值归为 other，避免任意输入产生新的时间序列
+AGENT_MODES = ("standard", "iterative", "multi-agent")
+OTHER = "other"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name) or UNKNOWN) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """分桶累计的观测值（Prometheus的 _bucket / _sum / _count）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float]):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数（不累计，最后一个为+Inf）, 总和, 次数]
+        self._values: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内的指标集合，按注册顺序输出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标重复: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str]) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str],
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+STAGE_LABELS = ("mode", "agent_mode", "stage")
+
+REQUESTS = _registry.counter(
+    "rag_requests_total", "生成请求数", ("mode", "agent_mode", "status"))
+REQUEST_SECONDS = _registry.histogram(
+    "rag_request_duration_seconds", "生成请求耗时", ("mode", "agent_mode"))
+STAGE_SECONDS = _registry.histogram(
+    "rag_stage_duration_seconds", "生成阶段耗时", STAGE_LABELS)
+OPERATION_SECONDS = _registry.histogram(
+    "rag_operation_duration_seconds", "阶段内操作耗时（检索、编码、向量查询、提示词组装、代码修复）",
+    STAGE_LABELS + ("operation",))
+LLM_CALLS = _registry.counter(
+    "rag_llm_calls_total", "LLM调用次数（result: ok / error / cache_hit）", STAGE_LABELS + ("result",))
+LLM_SECONDS = _registry.histogram(
+    "rag_llm_call_duration_seconds", "LLM调用耗时（含SDK重试，不含并发排队）", STAGE_LABELS)
+LLM_TOKENS = _registry.histogram(
+    "rag_llm_tokens", "单次LLM调用的token数（来自响应的usage；type: prompt / completion / cached）",
+    STAGE_LABELS + ("type",), buckets=TOKEN_BUCKETS)
+LLM_RETRIES = _registry.counter(
+    "rag_llm_retries_total", "LLM调用的HTTP重试次数", STAGE_LABELS)
+RETRIEVAL_CACHE = _registry.counter(
+    "rag_retrieval_cache_total", "请求内检索上下文的查找次数（kind: modules / retrieval / docs；result: hit / miss）",
+    STAGE_LABELS + ("kind", "result"))
+RETRIEVAL_SAVED_SECONDS = _registry.counter(
+    "rag_retrieval_saved_seconds_total", "请求内检索上下文命中时省去的计算耗时（按首次计算的耗时估算）",
+    STAGE_LABELS + ("kind",))
+
+
+class _Labels(threading.local):
+    """当前线程所在的生成阶段（嵌套阶段以栈保存）"""
+
+    def __init__(self):
+        self.stack: List[Dict[str, str]] = []
+
+
+_local = _Labels()
+
+
+def current_labels() -> Dict[str, str]:
+    """当前线程的 mode / agent_mode / stage 标签；不在阶段内时为 none"""
+    if _local.stack:
+        return dict(_local.stack[-1])
+    return {name: UNKNOWN for name in STAGE_LABELS}
+
+
+def agent_mode_label(agent_mode: Any) -> str:
+    """把 agent_mode 归一化为有限的标签值（未知时保留 none）"""
+    return agent_mode if agent_mode in AGENT_MODES or agent_mode == UNKNOWN else OTHER
+
+
+@contextmanager
+def stage_metrics(mode: str, agent_mode: str, stage: str) -> Iterator[None]:
+    """记录一个生成阶段的耗时；阶段内的操作和LLM调用使用该阶段的标签"""
+    labels = {"mode": mode, "agent_mode": agent_mode_label(agent_mode), "stage": stage}
+    _local.stack.append(labels)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, **labels)
+        _local.stack.pop()
+
+
+@contextmanager
+def bound_labels(labels: Dict[str, str]) -> Iterator[None]:
+    """在工作线程中沿用提交任务时的阶段标签（不记录阶段耗时），labels来自 current_labels()"""
+    _local.stack.append(dict(labels))
+    try:
+        yield
+    finally:
+        _local.stack.pop()
+
+
+@contextmanager
+def timed(operation: str) -> Iterator[None]:
+    """记录阶段内一个操作的耗时（标签取当前阶段）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        OPERATION_SECONDS.observe(time.perf_counter() - start, operation=operation, **current_labels())
+
+
+@contextmanager
+def request_metrics(mode: str, agent_mode: str) -> Iterator[None]:
+    """记录一次生成请求的耗时和结果"""
+    agent_mode = agent_mode_label(agent_mode)
+    start = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, mode=mode, agent_mode=agent_mode)
+        REQUESTS.inc(mode=mode, agent_mode=agent_mode, status=status)
+
+
+def _usage_value(usage: Any, name: str) -> Optional[int]:
+    if usage is None:
+        return None
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return value if isinstance(value, (int, float)) else None
+
+
+def _cached_tokens(usage: Any) -> Optional[int]:
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    return _usage_value(details, "cached_tokens")
+
+
+def record_llm_call(result: str, duration: Optional[float] = None, usage: Any = None, retries: int = 0):
+    """
+    记录一次LLM调用
+    result: ok / error / cache_hit；usage为响应的usage字段（对象或字典，流式响应未返回时为None）
+    """
+    labels = current_labels()
+    LLM_CALLS.inc(result=result, **labels)
+    if duration is not None:
+        LLM_SECONDS.observe(duration, **labels)
+    if retries:
+        LLM_RETRIES.inc(retries, **labels)
+    for kind, value in (("prompt", _usage_value(usage, "prompt_tokens")),
+                        ("completion", _usage_value(usage, "completion_tokens")),
+                        ("cached", _cached_tokens(usage) if usage is not None else None)):
+        if value is not None:
+            LLM_TOKENS.observe(value, type=kind, **labels)
+
+
+def record_retrieval_cache(kind: str, hit: bool, saved_seconds: float = 0.0):
+    """记录一次请求内检索上下文的查找；命中时saved_seconds为省去的计算耗时"""
+    labels = current_labels()
+    RETRIEVAL_CACHE.inc(kind=kind, result="hit" if hit else "miss", **labels)
+    if hit:
+        RETRIEVAL_SAVED_SECONDS.inc(saved_seconds, kind=kind, **labels)
+
+
+def render_metrics() -> str:
+    """返回所有指标的Prometheus文本格式"""
+    return _registry.render()
@@ -0,0 +1,136 @@
+"""
+阶段依赖图调度器
+生成流程声明为有向无环图：每个节点声明其依赖的节点，
+依赖全部完成的节点立即提交到线程池执行，相互独立的LLM调用并发进行；记录每个节点的耗时
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+# 设置为0时按拓扑顺序串行执行（用于对比和排查问题）
+PIPELINE_PARALLEL = os.getenv('RAG_PIPELINE_PARALLEL', '1') != '0'
+
+
+class StageNode:
+    """图中的一个阶段：func接收已完成阶段的结果字典，返回本阶段结果"""
+
+    def __init__(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class StagePipeline:
+    """
+    阶段依赖图
+    run() 返回 {阶段名: 结果}；timings 记录每个阶段相对开始时刻的起止时间和耗时（毫秒）
+    任一阶段抛出异常时不再提交新阶段，等待已提交的阶段结束后重新抛出该异常
+    """
+
+    def __init__(self, parallel: Optional[bool] = None):
+        self.parallel = PIPELINE_PARALLEL if parallel is None else parallel
+        self.nodes: Dict[str, StageNode] = {}
+        self.timings: Dict[str, Dict[str, Any]] = {}
+        self._started_at = 0.0
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = ()) -> "StagePipeline":
+        """添加阶段（依赖的阶段可以稍后添加，run时统一检查）"""
+        if name in self.nodes:
+            raise ValueError(f"阶段重复: {name}")
+        self.nodes[name] = StageNode(name, func, deps)
+        return self
+
+    def _topological_order(self) -> List[str]:
+        """按依赖关系排序（同时检查未知依赖和环）"""
+        order = []
+        state: Dict[str, int] = {}  # 1: 访问中, 2: 已完成
+
+        def visit(name: str, path: List[str]):
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"阶段依赖存在环: {' -> '.join(path + [name])}")
+            node = self.nodes.get(name)
+            if node is None:
+                raise ValueError(f"未知的依赖阶段: {name}（被 {path[-1] if path else '?'} 依赖）")
+            state[name] = 1
+            for dep in node.deps:
+                visit(dep, path + [name])
+            state[name] = 2
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name, [])
+        return order
+
+    def _execute(self, node: StageNode, results: Dict[str, Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return node.func(results)
+        finally:
+            end = time.perf_counter()
+            self.timings[node.name] = {
+                "start_ms": round((start - self._started_at) * 1000, 1),
+                "end_ms": round((end - self._started_at) * 1000, 1),
+                "duration_ms": round((end - start) * 1000, 1),
+                "thread": threading.current_thread().name
+            }
+
+    def run(self) -> Dict[str, Any]:
+        """执行所有阶段，返回各阶段结果"""
+        order = self._topological_order()
+        self.timings = {}
+        self._started_at = time.perf_counter()
+        results: Dict[str, Any] = {}
+
+        if not self.parallel or len(order) <= 1:
+            for name in order:
+                results[name] = self._execute(self.nodes[name], results)
+            return results
+
+        pending = list(order)
+        running = {}
+        error: Optional[BaseException] = None
+
+        with ThreadPoolExecutor(max_workers=len(order), thread_name_prefix="stage") as executor:
+            while pending or running:
+                if error is None:
+                    # 提交所有依赖已完成的阶段；results只在调度线程中写入，提交时传入快照
+                    # 阶段在调用方上下文的副本中执行（沿用请求级设置，如批量生成的LLM并发限制）
+                    ready = [name for name in pending if all(dep in results for dep in self.nodes[name].deps)]
+                    for name in ready:
+                        pending.remove(name)
+                        context = contextvars.copy_context()
+                        future = executor.submit(context.run, self._execute, self.nodes[name], dict(results))
+                        running[future] = name
+                elif not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+
+        if error is not None:
+            raise error
+        return results
+
+    def critical_path_ms(self) -> float:
+        """最近一次运行的总耗时（最后一个阶段结束的时刻）"""
+        return max((t["end_ms"] for t in self.timings.values()), default=0.0)
+
+    def summary(self) -> str:
+        """按开始时间排列的阶段耗时摘要"""
+        ordered = sorted(self.timings.items(), key=lambda item: item[1]["start_ms"])
+        return ", ".join(
+            f"{name} {t['duration_ms'] / 1000:.2f}s@{t['start_ms'] / 1000:.2f}s" for name, t in ordered
+        )
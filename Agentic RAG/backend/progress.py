@@ -0,0 +1,118 @@
+"""
+生成进度事件
+生成过程中各阶段的开始/结束（含耗时）以及LLM输出的token以事件形式写入线程安全队列，
+由 /api/generate/stream 以Server-Sent Events的格式推送给前端；阶段同时记录到 metrics 的阶段指标
+"""
+
+import functools
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from metrics import UNKNOWN, stage_metrics
+
+
+# 队列空闲多久（秒）发送一次SSE注释保持连接
+HEARTBEAT_INTERVAL = 15.0
+
+_END = object()
+
+
+class ProgressReporter:
+    """
+    生成进度收集器
+    生成线程调用 stage()/token()/emit() 写入事件，响应线程通过 sse_events() 读取
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stage_timings: Dict[str, float] = {}
+        self._events: "queue.Queue[Any]" = queue.Queue()
+        self._local = threading.local()
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started_at) * 1000, 1)
+
+    def emit(self, event: str, data: Optional[Dict[str, Any]] = None):
+        """写入一个事件"""
+        payload = dict(data or {})
+        payload.setdefault("elapsed_ms", self.elapsed_ms())
+        self._events.put((event, payload))
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        """当前线程正在执行的阶段"""
+        stack = getattr(self._local, "stages", None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def stage(self, name: str):
+        """阶段计时：进入时发送stage_start，退出时发送stage_end（包含耗时和是否出错）"""
+        stack = getattr(self._local, "stages", None)
+        if stack is None:
+            stack = self._local.stages = []
+        stack.append(name)
+        self.emit("stage_start", {"stage": name})
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            duration_ms = round((time.perf_counter() - start) * 1000, 1)
+            stack.pop()
+            # 同名阶段（如多轮refine）累计耗时
+            self.stage_timings[name] = round(self.stage_timings.get(name, 0.0) + duration_ms, 1)
+            self.emit("stage_end", {"stage": name, "duration_ms": duration_ms, "ok": ok})
+
+    def token(self, text: str):
+        """LLM流式输出的增量文本"""
+        if text:
+            self.emit("token", {"stage": self.current_stage, "text": text})
+
+    def close(self):
+        """生成结束（无论成功与否），sse_events() 随之结束"""
+        self._events.put(_END)
+
+    def sse_events(self, heartbeat: float = HEARTBEAT_INTERVAL) -> Iterator[str]:
+        """按SSE格式逐条产出事件，直到 close() 被调用"""
+        while True:
+            try:
+                item = self._events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is _END:
+                return
+            event, payload = item
+            yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@contextmanager
+def stage_of(owner: Any, name: str):
+    """
+    owner上名为name的阶段上下文：记录阶段指标（标签取owner的mode、agent_mode），
+    并在owner.progress（设置时）上发送阶段事件
+    """
+    progress = getattr(owner, "progress", None)
+    with stage_metrics(getattr(owner, "mode", UNKNOWN), getattr(owner, "agent_mode", UNKNOWN), name):
+        with progress.stage(name) if progress is not None else nullcontext():
+            yield
+
+
+def stage(name: str) -> Callable:
+    """
+    方法装饰器：将该方法记录为一个阶段（阶段指标，以及实例的 progress 上的阶段事件）
+    """
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with stage_of(self, name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
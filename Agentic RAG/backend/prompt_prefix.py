@@ -0,0 +1,95 @@
+"""
+提示词静态前缀
+Few-Shot示例、动画素材库、参考文档示例、默认API列表等不随请求变化的内容放在system消息中，
+每个知识库版本只构建一次；请求相关的可变内容（用户需求、检索到的函数文档、上一阶段结果）放在其后的user消息中。
+所有调用以相同的前缀开头，LLM服务端（或本地推理服务）的前缀缓存可以复用已计算的前缀
+"""
+
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, List
+
+from context_budget import estimate_tokens
+
+
+# 设置为0时使用旧布局：静态内容附加在user消息的可变内容之后（用于对比前缀缓存效果）
+PROMPT_PREFIX_ENABLED = os.getenv('RAG_PROMPT_PREFIX', '1') != '0'
+
+
+class PromptPrefix:
+    """
+    静态前缀：role为角色说明，body为静态参考资料
+    messages() 按当前布局组装消息
+    """
+
+    def __init__(self, role: str, body: str = ""):
+        self.role = role
+        self.body = body
+        self.text = f"{role}\n\n{body}" if body else role
+        self.tokens = estimate_tokens(self.text)
+
+    def messages(self, prompt: str, enabled: bool = None) -> List[Dict[str, str]]:
+        """返回chat.completions的messages"""
+        enabled = PROMPT_PREFIX_ENABLED if enabled is None else enabled
+        if enabled or not self.body:
+            return [
+                {"role": "system", "content": self.text},
+                {"role": "user", "content": prompt}
+            ]
+        # 旧布局：可变内容在前，静态内容在后
+        return [
+            {"role": "system", "content": self.role},
+            {"role": "user", "content": f"{prompt}\n\n{self.body}"}
+        ]
+
+
+class PromptPrefixCache:
+    """
+    按知识库实例缓存构建好的前缀
+    知识库热重载后新实例会重新构建前缀，旧实例被回收时其前缀随之释放
+    """
+
+    def __init__(self):
+        self._prefixes: "weakref.WeakKeyDictionary[Any, Dict[str, PromptPrefix]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, kb: Any, name: str, builder: Callable[[Any], PromptPrefix]) -> PromptPrefix:
+        """返回知识库kb上名为name的前缀，首次访问时调用builder(kb)构建"""
+        prefixes = self._prefixes.get(kb)
+        if prefixes is not None and name in prefixes:
+            return prefixes[name]
+
+        with self._lock:
+            prefixes = self._prefixes.setdefault(kb, {})
+            if name not in prefixes:
+                prefixes[name] = builder(kb)
+                self.builds += 1
+                print(f"[INFO] 提示词前缀[{name}]已构建，约 {prefixes[name].tokens} tokens")
+            return prefixes[name]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": PROMPT_PREFIX_ENABLED,
+                "builds": self.builds,
+                "prefixes": {
+                    name: prefix.tokens
+                    for prefixes in self._prefixes.values()
+                    for name, prefix in prefixes.items()
+                }
+            }
+
+
+_prefix_cache = PromptPrefixCache()
+
+
+def get_prompt_prefix(kb: Any, name: str, builder: Callable[[Any], PromptPrefix]) -> PromptPrefix:
+    """获取知识库kb当前版本的静态前缀"""
+    return _prefix_cache.get(kb, name, builder)
+
+
+def prompt_prefix_stats() -> Dict[str, Any]:
+    """返回前缀构建次数和各前缀的token估算"""
+    return _prefix_cache.stats()
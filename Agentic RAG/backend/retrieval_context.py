@@ -0,0 +1,87 @@
+"""
+请求内检索上下文
+一次奇遇生成的各阶段（thinking、decomposition、code、每轮refine）都会识别模块、检索函数并渲染函数文档，
+查询往往相同或相近。检索上下文在单次请求内按 (查询, 模块, top_k) 缓存模块识别、检索结果和渲染后的文档，
+并统计命中次数和省去的耗时（按首次计算的耗时估算）。
+接口与知识库相同（identify_required_modules / retrieve_functions / format_function_doc /
+function_doc_tokens / get_function_docs_text / OPTIONAL_DOC_FIELDS），可直接替代知识库传给 ContextAssembler.add_docs
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from metrics import record_retrieval_cache
+
+# 缓存的内容类别：模块识别、检索结果、整体文档文本
+KINDS = ("modules", "retrieval", "docs")
+
+
+class RetrievalContext:
+    """单次请求内的检索缓存（各阶段可能在不同线程中并发使用）"""
+
+    def __init__(self, kb: Any):
+        self.kb = kb
+        self.OPTIONAL_DOC_FIELDS = kb.OPTIONAL_DOC_FIELDS
+        self._values: Dict[Tuple[Hashable, ...], Any] = {}
+        self._costs: Dict[Tuple[Hashable, ...], float] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, Any]] = {kind: {"hits": 0, "misses": 0, "savedMs": 0.0} for kind in KINDS}
+
+    def _memoize(self, kind: str, key: Tuple[Hashable, ...], compute: Callable[[], Any]) -> Any:
+        cache_key = (kind,) + key
+        with self._lock:
+            found = cache_key in self._values
+            if found:
+                value = self._values[cache_key]
+                saved_ms = self._costs[cache_key]
+                entry = self.stats[kind]
+                entry["hits"] += 1
+                entry["savedMs"] += saved_ms
+        if found:
+            record_retrieval_cache(kind, True, saved_ms / 1000)
+            return value
+
+        start = time.perf_counter()
+        value = compute()
+        cost_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            # 并发阶段同时未命中时保留先写入的结果
+            value = self._values.setdefault(cache_key, value)
+            self._costs.setdefault(cache_key, cost_ms)
+            self.stats[kind]["misses"] += 1
+        record_retrieval_cache(kind, False)
+        return value
+
+    def identify_required_modules(self, user_input: str, *args: Any) -> List[str]:
+        """识别需要的模块（额外参数如npc_tags原样传给知识库）"""
+        key = (user_input,) + tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args)
+        return list(self._memoize("modules", key, lambda: self.kb.identify_required_modules(user_input, *args)))
+
+    def retrieve_functions(self, modules: Optional[List[str]] = None, query: str = "", top_k: int = 30) -> List[Any]:
+        """检索相关函数（结果按 (查询, 模块, top_k) 缓存）"""
+        key = (query, tuple(modules) if modules else None, top_k)
+        return list(self._memoize(
+            "retrieval", key, lambda: self.kb.retrieve_functions(modules=modules, query=query, top_k=top_k)))
+
+    def format_function_doc(self, func: Any, omit_fields: Iterable[str] = ()) -> str:
+        """渲染单个函数文档（片段在知识库加载时已预先渲染，直接转发）"""
+        return self.kb.format_function_doc(func, omit_fields)
+
+    def function_doc_tokens(self, func: Any, omit_fields: Iterable[str] = ()) -> int:
+        """单个函数文档的token估算（加载时已预先计算，直接转发）"""
+        return self.kb.function_doc_tokens(func, omit_fields)
+
+    def get_function_docs_text(self, functions: List[Any], omit_fields: Optional[List[Iterable[str]]] = None) -> str:
+        """渲染函数文档列表（用于LLM提示词）"""
+        omit = tuple(frozenset(fields) for fields in omit_fields) if omit_fields else None
+        key = (tuple(id(func) for func in functions), omit)
+        return self._memoize("docs", key, lambda: self.kb.get_function_docs_text(functions, omit_fields))
+
+    def report(self) -> Dict[str, Any]:
+        """各类缓存的命中/未命中次数和省去的耗时（毫秒）"""
+        with self._lock:
+            report = {kind: {"hits": entry["hits"], "misses": entry["misses"], "savedMs": round(entry["savedMs"], 3)}
+                      for kind, entry in self.stats.items()}
+        report["savedMs"] = round(sum(entry["savedMs"] for entry in report.values()), 3)
+        return report
@@ -0,0 +1,139 @@
+"""
+进程内向量索引
+将L2归一化后的嵌入向量保存在一个连续的float32矩阵中，
+通过一次矩阵-向量乘法 + argpartition 完成top-k检索，可替代ChromaDB作为检索后端
+"""
+
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    print("警告: numpy未安装，无法使用NumPy向量索引。运行: pip install numpy")
+
+
+# 可选的检索后端
+VECTOR_BACKENDS = ("chroma", "numpy")
+
+
+def l2_normalize(matrix: "np.ndarray") -> "np.ndarray":
+    """按行L2归一化（零向量保持为零），返回新矩阵"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _normalize_vector(vector: Any) -> "np.ndarray":
+    """将单个查询向量转换为归一化的一维float32数组"""
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class NumpyVectorIndex:
+    """
+    NumPy向量索引
+    - 向量按行存储在连续的float32矩阵中（已L2归一化，内积即余弦相似度）
+    - 为每个模块预先计算行掩码，模块过滤不需要逐条比较元数据
+    - query() 兼容ChromaDB集合的调用方式，知识库无需区分后端
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.modules: List[str] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.module_masks: Dict[str, "np.ndarray"] = {}
+        self._combined_masks: Dict[FrozenSet[str], "np.ndarray"] = {}
+
+    def build(self, ids: Sequence[str], embeddings: Any, modules: Sequence[str], normalized: bool = False):
+        """
+        用完整的文档集合构建索引（覆盖已有内容）
+        normalized: embeddings已按行L2归一化（如向量缓存中的矩阵）；
+                    为连续的float32矩阵时直接使用，内存映射的只读矩阵也不会被复制
+        """
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids) or len(ids) != len(modules):
+            raise ValueError("ids、embeddings、modules的数量必须一致")
+
+        self.ids = list(ids)
+        self.modules = list(modules)
+        self.matrix = np.ascontiguousarray(matrix if normalized else l2_normalize(matrix))
+
+        module_array = np.asarray(self.modules, dtype=object)
+        self.module_masks = {
+            module: module_array == module for module in set(self.modules)
+        }
+        self._combined_masks = {}
+
+    def count(self) -> int:
+        """返回索引中的文档数量"""
+        return len(self.ids)
+
+    def _mask_for(self, modules: Optional[Sequence[str]]) -> Optional["np.ndarray"]:
+        """返回多个模块的合并行掩码（结果缓存）"""
+        if not modules:
+            return None
+        key = frozenset(modules)
+        mask = self._combined_masks.get(key)
+        if mask is None:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            for module in key:
+                module_mask = self.module_masks.get(module)
+                if module_mask is not None:
+                    mask |= module_mask
+            self._combined_masks[key] = mask
+        return mask
+
+    def search(self, query_embedding: Any, top_k: int, modules: Optional[Sequence[str]] = None) -> List[int]:
+        """
+        检索与查询向量最相似的文档
+        返回按相似度降序排列的行号列表
+        """
+        if not self.ids or top_k <= 0:
+            return []
+
+        scores = self.matrix @ _normalize_vector(query_embedding)
+
+        mask = self._mask_for(modules)
+        if mask is not None:
+            candidates = np.flatnonzero(mask)
+            if candidates.size == 0:
+                return []
+            scores = scores[candidates]
+        else:
+            candidates = None
+
+        k = min(top_k, scores.shape[0])
+        if k < scores.shape[0]:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(scores.shape[0])
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        rows = candidates[top] if candidates is not None else top
+        return rows.tolist()
+
+    def query(self, query_embeddings: List[Any], n_results: int = 10, where: Optional[Dict[str, Any]] = None) -> Dict[str, List[List[Any]]]:
+        """
+        ChromaDB风格的查询接口
+        仅支持按module过滤：{"module": "P1"} 或 {"module": {"$in": [...]}}
+        """
+        modules = None
+        if where:
+            condition = where.get("module")
+            if isinstance(condition, dict):
+                modules = condition.get("$in")
+            elif condition is not None:
+                modules = [condition]
+
+        result_ids = []
+        result_distances = []
+        for query_embedding in query_embeddings:
+            rows = self.search(query_embedding, n_results, modules)
+            similarities = self.matrix[rows] @ _normalize_vector(query_embedding) if rows else []
+            result_ids.append([self.ids[row] for row in rows])
+            result_distances.append([float(1.0 - s) for s in similarities])
+
+        return {"ids": result_ids, "distances": result_distances}